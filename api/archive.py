@@ -0,0 +1,75 @@
+import os
+import threading
+import zipfile
+
+COMPRESSION_MODES = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+
+class StreamingArchive:
+    """
+    ZIP archive that is written while the bot runs.
+    Each captured invoice is appended as soon as it lands, so finishing the run only
+    has to write the central directory. Closing it early (cancelled run) still leaves
+    a valid archive with every file captured so far.
+    """
+
+    def __init__(self, path, compression='stored', compresslevel=None):
+        if compression not in COMPRESSION_MODES:
+            raise ValueError(f"Unknown archive compression '{compression}'")
+        self.path = path
+        self._zip = zipfile.ZipFile(
+            path, 'w',
+            compression=COMPRESSION_MODES[compression],
+            compresslevel=int(compresslevel) if compresslevel not in (None, '') else None,
+        )
+        self._lock = threading.Lock()
+        self._names = set()
+        self._sources = set()
+        self.closed = False
+
+    @property
+    def count(self):
+        return len(self._names)
+
+    def contains(self, file_path):
+        return os.path.abspath(file_path) in self._sources
+
+    def add(self, file_path, arcname=None):
+        """Appends a file. Returns the name used inside the archive."""
+        arcname = arcname or os.path.basename(file_path)
+        with self._lock:
+            if self.closed: return None
+            source = os.path.abspath(file_path)
+            if source in self._sources: return None
+
+            # Two workers may capture files with the same name
+            base, extension = os.path.splitext(arcname)
+            n = 1
+            while arcname in self._names:
+                arcname = f"{base}_{n}{extension}"
+                n += 1
+
+            self._zip.write(file_path, arcname)
+            self._names.add(arcname)
+            self._sources.add(source)
+            return arcname
+
+    def moved(self, old_path, new_path):
+        """Keeps track of an archived file that was moved on disk afterwards."""
+        with self._lock:
+            if os.path.abspath(old_path) in self._sources:
+                self._sources.discard(os.path.abspath(old_path))
+                self._sources.add(os.path.abspath(new_path))
+
+    def close(self):
+        """Writes the central directory. Returns the archive path, or None if it is empty."""
+        with self._lock:
+            if not self.closed:
+                self._zip.close()
+                self.closed = True
+        return self.path if self._names else None
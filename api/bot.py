@@ -1,27 +1,54 @@
 import time
 import os
 import threading
-import zipfile
 import shutil
-import paramiko 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager 
+from selenium.common.exceptions import SessionNotCreatedException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys 
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from django.conf import settings
 from django.core.files import File
+from django.utils import timezone
 from selenium.webdriver.common.action_chains import ActionChains
-from asgiref.sync import async_to_sync
-from server.sio import sio
+from server.sio import emit, order_rooms
+from .browser import session_pool, driver_resolver, BrowserSession, build_chrome_options, block_heavy_resources
+from .waits import WaitEngine, WaitStats
+from .downloads import DownloadCapture
+from .status_buffer import StatusBuffer
+from .cancellation import cancellation
+from .archive import StreamingArchive
+from .delivery import DeliveryTarget, deliver_all, copy_files, check_deadline
+from .sftp import sftp_pool, ensure_remote_dir, upload_resumable
+from .http_export import HttpExporter
+from .telemetry import RunTimer
+from .invoice_flow import (
+    InvoiceFlow, Step, CircuitBreaker, FlowFailed, DownloadNotStarted, SessionLost, SESSION,
+    MENU_OPEN, FORM_OPEN, INVOICE_ENTERED, DIALOG_FILLED, DOWNLOAD_TRIGGERED, CAPTURED,
+)
+from .invoice_cache import InvoiceCache
+from .models import InvoiceItem
+
+FAVORITES_XPATH = "//*[contains(@title, 'Favorites') or contains(@aria-label, 'Favorites')]"
+REPORT_XPATH = "//*[contains(text(), 'Report')]"
+PO_FORM_XPATH = "//*[contains(text(), 'Purchase Order Form')]"
+NAME_INPUT_XPATH = "//label[contains(text(), 'Name')]/following::input[1]"
+DOWNLOAD_BUTTON_XPATH = "//button[span[text()='OK']] | //button[text()='OK']"
+EMAIL_XPATH = "//input[@type='email' or @name='loginfmt']"
 
 class AutoDownloadBot:
     def __init__(self, order_import_instance, config=None):
         self.order = order_import_instance
-        self.items = self.order.parsed_data or []
+        # Plain dicts (same keys as the old parsed_data entries) plus the row 'id'
+        self.items = [item.to_dict() for item in self.order.items.order_by('row')]
+        # Rows repeating an earlier invoice: {first row index: [duplicate row indexes]}
+        index_of = {item['id']: i for i, item in enumerate(self.items)}
+        self.duplicates = {}
+        for i, item in enumerate(self.items):
+            if item.get('duplicate_of') in index_of:
+                self.duplicates.setdefault(index_of[item['duplicate_of']], []).append(i)
+        self.canonical_of = {dup: first for first, dups in self.duplicates.items() for dup in dups}
         
         self.config = config or {}
         # Default config or fallback to hardcoded credentials
@@ -34,6 +61,14 @@ class AutoDownloadBot:
         self.use_digital_ocean = self.config.get('use_digital_ocean', False)
         self.use_company_server = self.config.get('use_company_server', True)
 
+        # --- SFTP Server (DigitalOcean) ---
+        # Configurable so uploads can also be pointed at a local SSH server for testing
+        self.sftp_host = self.config.get('sftp_host', "68.183.225.187")
+        self.sftp_port = int(self.config.get('sftp_port', 22))
+        self.sftp_username = self.config.get('sftp_username', "root")
+        self.sftp_password = self.config.get('sftp_password', "KakVey1417@Ket")
+        self.sftp_remote_dir = self.config.get('sftp_remote_dir', "/root/downloads")
+
         # --- Company Server Path ---
         # We use 'r' before the string to handle backslashes correctly in Windows paths
         self.company_server_path = self.config.get('company_server_path', r"\\192.168.54.11\hr\@KakveyKet(Kai)")
@@ -46,41 +81,105 @@ class AutoDownloadBot:
         self.start_index = int(self.config.get('start_index', 0))
         self.limit = self.config.get('limit') 
 
-        # Set to True if you don't want to see the browser window
-        self.headless = False 
+        # --- PARALLEL WORKERS ---
+        # Number of browsers that share the invoice list of this order.
+        # Each worker logs in on its own and downloads into its own folder.
+        self.workers = max(1, int(self.config.get('workers', 1) or 1))
 
-        self.chrome_options = Options()
-        self.chrome_options.add_experimental_option("detach", True)
-        
-        self.chrome_options.add_argument('--ignore-certificate-errors')
-        self.chrome_options.add_argument('--ignore-ssl-errors')
-        self.chrome_options.add_argument("--no-sandbox")
-        self.chrome_options.add_argument("--disable-dev-shm-usage")
-        self.chrome_options.add_argument("--start-maximized")
-        self.chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        self.chrome_options.add_experimental_option('useAutomationExtension', False)
-        
-        if self.headless:
-            self.chrome_options.add_argument("--headless")
+        # --- WARM SESSIONS ---
+        # Reuse logged-in browsers left by earlier runs instead of a fresh login every time
+        self.use_session_pool = self.config.get('use_session_pool', True)
+
+        # --- WAITS ---
+        # Optional per-step timeout overrides, e.g. {"dialog": 45, "overlay": 20}
+        self.wait_timeouts = self.config.get('wait_timeouts') or {}
+        self.wait_stats = WaitStats()
+        # Timing spans of every step (login, navigation, invoice steps, zip, deliveries)
+        self.timer = RunTimer()
+        # Seconds a started download may take before the invoice counts as failed
+        self.download_timeout = int(self.config.get('download_timeout', 60))
+        # Failed steps allowed per invoice, and session failures in a row before a re-login
+        self.invoice_attempts = int(self.config.get('invoice_attempts', 3))
+        self.session_failure_threshold = int(self.config.get('session_failure_threshold', 3))
+
+        # Set to True if you don't want to see the browser window
+        self.headless = bool(self.config.get('headless', False))
+        # 'standard' (visible, full page) or 'lean' (headless, no images/fonts, capped memory)
+        self.browser_profile = self.config.get('browser_profile', getattr(settings, 'BOT_BROWSER_PROFILE', 'standard'))
+        # Lean profile: JS heap cap of each renderer only; whole browsers are capped by BOT_SESSION_MAX_RSS_MB
+        self.browser_memory_mb = int(self.config.get('browser_memory_mb', 512))
+        self.browser_window_size = self.config.get('browser_window_size', '1280,800')
+        # Pooled browsers are only reused by runs of the same account and profile
+        self.session_key = session_pool.make_key(self.target_url, self.username, self.browser_profile)
 
         # Setup Download Directory (Django Media Temp)
         # We save here first to ensure we capture the file from Chrome
+        # Created when the run starts (a bot built only to pre-warm a browser leaves nothing behind)
         self.download_dir = os.path.join(settings.MEDIA_ROOT, 'temp', str(self.order.id))
-        if not os.path.exists(self.download_dir):
-            os.makedirs(self.download_dir)
-            
-        prefs = {
-            "download.default_directory": self.download_dir,
-            "download.prompt_for_download": False,
-            "directory_upgrade": True,
-            "safebrowsing.enabled": True
-        }
-        self.chrome_options.add_experimental_option("prefs", prefs)
+
+        self.chrome_options = self._build_chrome_options(self.download_dir)
+
+        # Workers share the order instance, so DB writes go through this lock
+        self._lock = threading.Lock()
+        self._cancelled = False
+        # Set when another worker took this run over (lease lost)
+        self.abandoned = False
+        # Set by the job runner: returns False once the job's lease belongs to another worker
+        self.lease_check = None
+
+        # --- STOP SIGNAL ---
+        # stop_bot sets this flag in-process; the DB is only re-checked every N seconds
+        self._cancel_event = threading.Event()
+        self.stop_db_check_interval = getattr(settings, 'BOT_STOP_DB_CHECK_INTERVAL', 15)
+        self._last_stop_db_check = 0
+
+        # --- STATUS WRITES ---
+        # Item statuses are saved every N changes or T seconds instead of on every change
+        self.status_flush_items = int(self.config.get('status_flush_items', 20))
+        self.status_flush_seconds = float(self.config.get('status_flush_seconds', 5))
+        self.status_buffer = None
+
+        # --- ARCHIVE ---
+        # Files are appended to archive.zip as they are captured ('stored', 'deflated', 'bzip2', 'lzma')
+        self.archive_compression = self.config.get('archive_compression', 'stored')
+        self.archive_compresslevel = self.config.get('archive_compresslevel')
+        self.archive = None
+
+        # --- DELIVERY ---
+        # Destinations are pushed in parallel; timeouts/retries can be set per target key
+        # ('storage', 'sftp', 'local', 'company'), e.g. {"sftp": 900}
+        self.delivery_workers = int(self.config.get('delivery_workers', 4))
+        self.delivery_timeouts = self.config.get('delivery_timeouts') or {}
+        self.delivery_retries = self.config.get('delivery_retries') or {}
+        # Keep a ZIP copy in cloud storage (needed for the preview endpoint)
+        self.save_zip_backup = self.config.get('save_zip_backup', True)
+        # Optional HTTP fast path: export endpoint called with the browser's cookies,
+        # '{invoice}' is replaced by the invoice number. Anything it misses goes through the UI.
+        self.http_export_url = self.config.get('http_export_url', '')
+        self.http_export_method = self.config.get('http_export_method', 'GET')
+        self.http_export_data = self.config.get('http_export_data') or None
+        self.http_export_workers = int(self.config.get('http_export_workers', 4))
+        self.http_export_rate = float(self.config.get('http_export_rate', 5))    # Requests per second
+        # Parallel file copies per folder destination
+        self.copy_workers = int(self.config.get('copy_workers', 4))
+
+        # --- INVOICE CACHE ---
+        # Invoices already fetched for earlier orders are copied from the shared cache, not the ERP
+        self.use_invoice_cache = self.config.get('use_invoice_cache', True)
+        self.report_type = self.config.get('report_type', 'po_form')
+        self.invoice_cache = InvoiceCache() if self.use_invoice_cache else None
+
+    def _build_chrome_options(self, download_dir, profile_dir=None):
+        """Chrome options for one browser session downloading into download_dir."""
+        return build_chrome_options(
+            download_dir, self.browser_profile, self.headless, profile_dir,
+            memory_mb=self.browser_memory_mb, window_size=self.browser_window_size,
+        )
 
     def _emit(self, event_type, payload):
         try:
             message = {'type': event_type, 'order_id': self.order.id, **payload}
-            async_to_sync(sio.emit)('bot_update', message)
+            emit('bot_update', message, to=order_rooms(self.order, status_change=event_type == 'status_change'))
         except Exception as e:
             print(f"Socket Emit Error: {e}")
 
@@ -90,114 +189,163 @@ class AutoDownloadBot:
         t.daemon = False 
         t.start()
 
+    def run_sync(self):
+        """Runs the whole job in the calling thread (used by the bot worker processes)."""
+        self._process_in_background()
+
+    def abandon(self):
+        """Another worker owns this run now: stop as soon as possible without touching the order."""
+        with self._lock:
+            self.abandoned = True
+            self._cancelled = True
+        if self._cancel_event: self._cancel_event.set()
+
+    def _still_owner(self):
+        """False once another worker took this run over: it then delivers and cleans up, not this one."""
+        if self.abandoned: return False
+        if self.lease_check:
+            try:
+                if not self.lease_check():
+                    self.abandon()
+                    return False
+            except Exception as e:
+                # DB hiccup: the lease is still valid until it expires
+                print(f"Lease check failed: {e}")
+        return True
+
     def _update_item_status(self, index, status):
-        """Updates the status of a specific invoice item in the database JSON."""
+        """
+        Updates the status of a specific invoice item and of the rows repeating its invoice.
+        The DB write is batched by the status buffer.
+        """
         if self.items and index < len(self.items):
-            self.items[index]['status'] = status
-            self.order.parsed_data = self.items
-            self.order.save()
-            self._emit('progress', {'index': index, 'status': status, 'invoice': self.items[index].get('invoice_number')})
+            duration_ms = self.timer.finish_item(index) if status in ('completed', 'failed') else None
+            for i in [index] + self.duplicates.get(index, []):
+                with self._lock:
+                    self.items[i]['status'] = status
+                if self.status_buffer: self.status_buffer.add(i, status)
+                else: self._flush_item_statuses({i: status})
+                payload = {'index': i, 'status': status, 'invoice': self.items[i].get('invoice_number')}
+                if duration_ms is not None: payload['duration_ms'] = duration_ms
+                # Progress events stay immediate, only the DB write is deferred
+                self._emit('progress', payload)
+
+    def _flush_item_statuses(self, changes):
+        """Writes buffered item statuses to their InvoiceItem rows, one UPDATE per status."""
+        by_status = {}
+        for index, status in changes.items():
+            by_status.setdefault(status, []).append(self.items[index]['id'])
+        now = timezone.now()
+        for status, ids in by_status.items():
+            InvoiceItem.objects.filter(pk__in=ids).update(status=status, updated_at=now)
 
     def _check_stop_signal(self):
-        self.order.refresh_from_db()
-        if self.order.bot_status == 'stopping':
+        # Fast path: in-process flag set by stop_bot (or by the Redis listener)
+        if self._cancelled: return True
+        if not self._cancel_event.is_set():
+            # Safety net on a slow cadence, for stop requests that missed the flag
+            if time.time() - self._last_stop_db_check < self.stop_db_check_interval: return False
+            self._last_stop_db_check = time.time()
+            with self._lock:
+                # Only the status column, not the whole parsed_data blob
+                self.order.refresh_from_db(fields=['bot_status'])
+                if self.order.bot_status != 'stopping': return False
+
+        with self._lock:
+            # Another worker already handled the stop request
+            if self._cancelled: return True
+            self._cancelled = True
             self.order.bot_status = 'cancelled'
             self.order.bot_message = "Stopped by user."
-            self.order.save()
-            self._emit('status_change', {'status': 'cancelled', 'message': 'Stopped by user.'})
-            return True
-        return False
+            self.order.save(update_fields=['bot_status', 'bot_message'])
+        self._emit('status_change', {'status': 'cancelled', 'message': 'Stopped by user.'})
+        return True
+
+    def _on_download_captured(self, pending):
+        """Called by the download watcher once an invoice file is complete on disk."""
+        self.timer.record('invoice.capture', time.time() - pending.started_at)
+        # Appended right away, so the archive is ready when the last invoice is
+        if self.archive: self.archive.add(pending.path)
+        self._store_in_cache(pending.context, pending.path)
+        self._update_item_status(pending.context, 'completed')
+
+    def _on_download_failed(self, pending):
+        print(f"Download capture failed: {pending.error}")
+        self._update_item_status(pending.context, 'failed')
 
-    def _rename_latest_download(self, new_name):
-        """Waits for a file to appear in the download folder and renames it to match the invoice number."""
+    def _store_in_cache(self, index, path):
+        if not self.invoice_cache: return
         try:
-            # Wait loop for file to appear (Fast polling)
-            retries = 20 # Wait up to 10 seconds (20 * 0.5s)
-            while retries > 0:
-                if self._check_stop_signal(): return
-                files = [os.path.join(self.download_dir, f) for f in os.listdir(self.download_dir) if os.path.isfile(os.path.join(self.download_dir, f))]
-                # Ignore temp files, the archive itself, and partial downloads
-                valid_files = [f for f in files if "archive.zip" not in f and not f.endswith('.crdownload') and not f.endswith('.tmp')]
-                
-                if valid_files:
-                    # Get the most recently created file
-                    latest_file = max(valid_files, key=os.path.getctime)
-                    
-                    # If it's already named correctly, skip
-                    if os.path.basename(latest_file).startswith(new_name):
-                        return 
-
-                    extension = os.path.splitext(latest_file)[1]
-                    new_path = os.path.join(self.download_dir, f"{new_name}{extension}")
-                    
-                    # Handle duplicates if the file already exists
-                    if os.path.exists(new_path):
-                        timestamp = int(time.time())
-                        new_path = os.path.join(self.download_dir, f"{new_name}_{timestamp}{extension}")
-                        
-                    os.rename(latest_file, new_path)
-                    print(f"Captured and renamed to: {os.path.basename(new_path)}")
-                    return
-                
-                time.sleep(0.5)
-                retries -= 1
-        except Exception as e: 
-            print(f"Error renaming file: {e}")
+            self.invoice_cache.put(self.items[index].get('invoice_number'), self.report_type, path)
+        except Exception as e:
+            print(f"Invoice cache write failed: {e}")
 
-    def _zip_files(self):
-        """Compresses all downloaded files into a single ZIP archive."""
-        zip_filename = os.path.join(self.download_dir, 'archive.zip')
-        files = os.listdir(self.download_dir)
-        
-        # Ensure we don't zip empty folders or just re-zip an existing zip
-        has_files = any(f != 'archive.zip' and not f.endswith('.crdownload') for f in files)
-        if not has_files: return None
-
-        with zipfile.ZipFile(zip_filename, 'w') as zipf:
-            for root, dirs, files in os.walk(self.download_dir):
-                for file in files:
-                    if file != 'archive.zip':
-                        zipf.write(os.path.join(root, file), file)
-        return zip_filename
-
-
-    def _upload_to_sftp(self, local_path, remote_filename):
-        """Uploads ZIP to Server, Unzips it, then Deletes the ZIP."""
-        # --- CONFIGURATION ---
-        hostname = "68.183.225.187"
-        username = "root"
-        
-        # --- PASSWORD ---
-        server_password = "KakVey1417@Ket" 
-        
-        remote_dir = "/root/downloads"
+    def _fill_from_cache(self):
+        """Copies the pending invoices found in the shared cache into the order folder. Returns how many."""
+        indexes = self._pending_indexes()
+        if not self.invoice_cache or not indexes: return 0
+        entries = self.invoice_cache.lookup_many([self.items[i].get('invoice_number') for i in indexes], self.report_type)
+        served = 0
+        for i in indexes:
+            if self._check_stop_signal(): break
+            entry = entries.get(self.items[i].get('invoice_number'))
+            if not entry: continue
+            path = self.invoice_cache.materialize(entry, self.download_dir)
+            if not path: continue
+            if self.archive: self.archive.add(path)
+            self._update_item_status(i, 'completed')
+            served += 1
+        if served:
+            print(f"{served} invoices taken from the invoice cache")
+            self._emit('log', {'message': f'{served} invoices taken from the invoice cache'})
+        return served
+
+    def _collect_worker_files(self, worker_dirs):
+        """Moves the files downloaded by each worker into the main download folder."""
+        for worker_dir in worker_dirs:
+            if not os.path.exists(worker_dir): continue
+            for name in os.listdir(worker_dir):
+                src = os.path.join(worker_dir, name)
+                if not os.path.isfile(src) or name.endswith('.crdownload'): continue
+                dest = os.path.join(self.download_dir, name)
+                if os.path.exists(dest):
+                    base, extension = os.path.splitext(name)
+                    dest = os.path.join(self.download_dir, f"{base}_{int(time.time())}{extension}")
+                shutil.move(src, dest)
+                if self.archive: self.archive.moved(src, dest)
+            try:
+                shutil.rmtree(worker_dir)
+            except: pass
+
+    def _finalize_archive(self):
+        """Adds any file the watcher did not archive yet and closes the ZIP. Returns its path or None."""
+        if not self.archive: return None
+        for path in self._captured_files():
+            if not self.archive.contains(path): self.archive.add(path)
+        return self.archive.close()
+
+
+    def _upload_to_sftp(self, local_path, remote_filename, deadline=None):
+        """Uploads ZIP to Server, Unzips it, then Deletes the ZIP. Every SSH read times out at the deadline."""
+        remaining = lambda: max(1, deadline - time.time()) if deadline else None
+        hostname = self.sftp_host
+        remote_dir = self.sftp_remote_dir
         
         print(f"🚀 Starting SFTP Upload to {hostname} (Password Auth)...")
         
+        conn = None
+        healthy = True
         try:
-            # Initialize SSH Client
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            # Connect using PASSWORD
-            ssh.connect(hostname, username=username, password=server_password)
-            
-            # Open SFTP
-            sftp = ssh.open_sftp()
-            
-            # Ensure remote directory exists
-            try:
-                sftp.chdir(remote_dir)
-            except IOError:
-                sftp.mkdir(remote_dir)
-                sftp.chdir(remote_dir)
+            # Reuses an authenticated connection from an earlier upload when possible
+            conn = sftp_pool.acquire(hostname, self.sftp_username, self.sftp_password, self.sftp_port)
+            conn.set_timeout(remaining())
+            ensure_remote_dir(conn.sftp, remote_dir)
             
             # 1. Upload the ZIP file first (It's faster to upload 1 zip than 100 files)
+            # A retry continues from whatever part of the file already reached the server
             remote_zip_path = f"{remote_dir}/{remote_filename}"
             print(f"Uploading ZIP to {remote_zip_path}...")
-            sftp.put(local_path, remote_zip_path)
-            
-            sftp.close() # Close SFTP, keep SSH open for commands
+            upload_resumable(conn.sftp, local_path, remote_zip_path, deadline=deadline)
             
             # 2. Extract (Unzip) on the Server
             # Create a dedicated folder for these files so they don't get mixed up
@@ -207,336 +355,630 @@ class AutoDownloadBot:
             
             print(f"📂 Extracting files to server folder: {extract_path}...")
             
-            # Command: Install unzip (if missing) -> Create Folder -> Unzip -> Remove Zip
-            # This ensures you get "extraction auto not zip"
+            # unzip is installed once per host, not on every upload
+            sftp_pool.ensure_tool(conn, 'unzip', "apt-get install -y unzip", timeout=remaining())
             command = (
-                f"apt-get install -y unzip && "
                 f"mkdir -p '{extract_path}' && "
                 f"unzip -o '{remote_zip_path}' -d '{extract_path}' && "
                 f"rm '{remote_zip_path}'"
             )
-            
-            # Execute command on DigitalOcean
-            stdin, stdout, stderr = ssh.exec_command(command)
-            exit_status = stdout.channel.recv_exit_status()
-            
-            ssh.close()
+            exit_status, _, error = conn.exec_command(command, timeout=remaining())
 
             if exit_status == 0:
                 print(f"✅ Extraction Success! Files are ready in {extract_path}")
                 return True, f"Uploaded & Extracted to: {extract_path}"
             else:
-                error = stderr.read().decode().strip()
                 print(f"⚠️ Extraction Warning: {error}")
                 return True, f"Uploaded Zip (Extraction failed: {error})"
 
         except Exception as e:
+            healthy = False
             error_msg = f"SFTP/SSH Failed: {str(e)}"
             print(f"❌ {error_msg}")
             return False, error_msg
+        finally:
+            if conn: sftp_pool.release(conn, healthy=healthy)
+
+    def _captured_files(self):
+        """Invoice files of this run, straight from the capture folder."""
+        files = []
+        for name in sorted(os.listdir(self.download_dir)):
+            path = os.path.join(self.download_dir, name)
+            if name == 'archive.zip' or not os.path.isfile(path) or name.endswith(('.crdownload', '.part')): continue
+            files.append(path)
+        return files
 
-    def _extract_locally(self, zip_path, destination_root, target_zip_name, location_name="Local"):
-        """Helper to unzip files locally (or to network share)"""
+    def _copy_to_folder(self, files, destination_root, target_zip_name, location_name="Local", deadline=None):
+        """Copies the invoice files into <root>/<zip name> (local or network share). Returns (success, message, bytes)."""
         try:
             if not os.path.exists(destination_root):
                 print(f"Path not found: {destination_root}")
-                return f"Failed: {location_name} path not found"
+                return False, f"Failed: {location_name} path not found", 0
 
             # Create a subfolder based on the zip name
             folder_name = os.path.splitext(target_zip_name)[0]
-            extract_dest = os.path.join(destination_root, folder_name)
+            copy_dest = os.path.join(destination_root, folder_name)
             
-            if not os.path.exists(extract_dest):
-                os.makedirs(extract_dest)
-            
-            print(f"Extracting to {location_name}: {extract_dest}")
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_dest)
-            
-            return f"Extracted to {location_name}"
+            print(f"Copying to {location_name}: {copy_dest}")
+            copied, skipped, written = copy_files(files, copy_dest, self.copy_workers, deadline=deadline)
+            message = f"Copied to {location_name}"
+            if skipped: message += f" ({skipped} already up to date)"
+            return True, message, written
+        except TimeoutError:
+            raise
         except Exception as e:
-            print(f"Error extracting to {location_name}: {e}")
-            return f"Failed: {location_name} extraction error"
+            print(f"Error copying to {location_name}: {e}")
+            return False, f"Failed: {location_name} copy error", 0
 
-    def _process_in_background(self):
-        """Main logic loop: Opens browser, logs in, iterates invoices, downloads, and saves."""
-        driver = None
+    def _save_to_storage(self, zip_path, target_zip_name, deadline=None):
+        """
+        Backup copy of the ZIP in the default storage (S3). Returns (success, message, bytes).
+        A stalled upload is ended by the S3 client's own timeouts (AWS_S3_CLIENT_CONFIG).
+        """
+        check_deadline(deadline, "Cloud storage upload")
+        with open(zip_path, 'rb') as f:
+            self.order.generated_zip.save(target_zip_name, File(f), save=False)
+        return True, "Saved to cloud storage", os.path.getsize(zip_path)
+
+    def _upload_zip_to_sftp(self, zip_path, target_zip_name, deadline=None):
+        success, msg = self._upload_to_sftp(zip_path, target_zip_name, deadline)
+        return success, msg, os.path.getsize(zip_path) if success else 0
+
+    def _needs_zip(self):
+        """Only the cloud backup and the SFTP upload take the ZIP; folders get the files directly."""
+        return self.save_zip_backup or self.use_digital_ocean
+
+    def _delivery_targets(self, files, zip_path, target_zip_name):
+        """Enabled destinations for this run, each with its own timeout and retry count."""
+        def target(key, name, send, default_timeout, default_retries):
+            return DeliveryTarget(
+                key, name, send,
+                timeout=self.delivery_timeouts.get(key, default_timeout),
+                retries=self.delivery_retries.get(key, default_retries),
+            )
+
+        targets = []
+        if zip_path:
+            # --- 1. SAVE TO DJANGO MODEL (BACKUP) ---
+            if self.save_zip_backup:
+                targets.append(target('storage', "Cloud Storage", lambda deadline: self._save_to_storage(zip_path, target_zip_name, deadline), 300, 2))
+
+            # --- 2. UPLOAD TO DIGITALOCEAN SERVER (SFTP) ---
+            if self.use_digital_ocean:
+                targets.append(target('sftp', "SFTP Server", lambda deadline: self._upload_zip_to_sftp(zip_path, target_zip_name, deadline), 600, 1))
+
+        # --- 3. OPTIONAL LOCAL COPY ---
+        if self.local_target_path:
+            local_root = os.path.normpath(self.local_target_path)
+            targets.append(target('local', "Local Folder", lambda deadline: self._copy_to_folder(files, local_root, target_zip_name, "Local Folder", deadline), 120, 0))
+
+        # --- 4. COMPANY SERVER COPY (SMB/Network Share) ---
+        if self.use_company_server and self.company_server_path:
+            targets.append(target('company', "Company Server", lambda deadline: self._copy_to_folder(files, self.company_server_path, target_zip_name, "Company Server", deadline), 300, 1))
+
+        return targets
+
+    # --- Browser Helpers (shared by every worker) ---
+    def _fill_input_robust(self, driver, element, text):
+        try: element.click()
+        except: driver.execute_script("arguments[0].click();", element)
+        element.send_keys(Keys.CONTROL + "a")
+        element.send_keys(Keys.DELETE)
+        element.send_keys(text)
+
+    def _start_browser(self, download_dir, profile_dir=None):
+        options = self._build_chrome_options(download_dir, profile_dir)
         try:
-            self.order.refresh_from_db()
-            self.order.bot_status = 'running'
-            self.order.bot_message = "Initializing Browser..."
-            self.order.save()
-            self._emit('status_change', {'status': 'running', 'message': 'Initializing Browser...'})
+            service = ChromeService(executable_path=driver_resolver.resolve())
+            driver = webdriver.Chrome(service=service, options=options)
+        except SessionNotCreatedException as e:
+            # Chrome was upgraded under the pinned driver: resolve it again once.
+            # Anything else (e.g. "user data directory is already in use") is not the driver's fault.
+            if 'version' not in str(e).lower(): raise
+            print("Pinned chromedriver rejected, resolving again...")
+            driver_resolver.invalidate()
+            service = ChromeService(executable_path=driver_resolver.resolve())
+            driver = webdriver.Chrome(service=service, options=options)
+        if self.browser_profile == 'lean': block_heavy_resources(driver)
+        return driver
 
-            print("Starting Browser...")
-            driver_path = ChromeDriverManager().install()
-            service = ChromeService(executable_path=driver_path)
-            driver = webdriver.Chrome(service=service, options=self.chrome_options)
-            
-            print(f"Navigating to {self.target_url}")
-            driver.get(self.target_url)
-            wait = WebDriverWait(driver, 60) 
-            short_wait = WebDriverWait(driver, 5)
+    def prewarm(self):
+        """Starts a spare browser for this ERP account in the background for the next run."""
+        if not self.use_session_pool: return False
 
-            # --- Fast Wait Helper ---
-            def wait_for_loading():
-                try:
-                    driver.implicitly_wait(0.1) 
-                    overlays = driver.find_elements(By.CSS_SELECTOR, ".modalBackground, .sys-loading-overlay")
-                    if overlays and any(o.is_displayed() for o in overlays):
-                        driver.implicitly_wait(5)
-                        WebDriverWait(driver, 10).until(EC.invisibility_of_element_located((By.CSS_SELECTOR, ".modalBackground")))
-                        WebDriverWait(driver, 10).until(EC.invisibility_of_element_located((By.CSS_SELECTOR, ".sys-loading-overlay")))
-                    driver.implicitly_wait(5) 
-                except: pass
-
-            # --- Robust Input Helper ---
-            def fill_input_robust(element, text):
-                try: element.click()
-                except: driver.execute_script("arguments[0].click();", element)
-                element.send_keys(Keys.CONTROL + "a")
-                element.send_keys(Keys.DELETE)
-                element.send_keys(text)
-
-            # --- 1. LOGIN ---
-            if self._check_stop_signal(): 
-                if driver: driver.quit()
+        def launch():
+            spare_dir = os.path.join(settings.MEDIA_ROOT, 'temp', 'spare')
+            os.makedirs(spare_dir, exist_ok=True)
+            profile_dir = session_pool.claim_profile(self.session_key)
+            try:
+                driver = self._start_browser(spare_dir, profile_dir)
+            except Exception:
+                session_pool.release_profile(profile_dir)
+                raise
+            return BrowserSession(self.session_key, driver, profile_dir)
+
+        return session_pool.prewarm(self.session_key, launch)
+
+    def _has_element(self, driver, xpath):
+        """Instant presence check (the wait engine keeps the implicit wait at 0)."""
+        try:
+            return any(e.is_displayed() for e in driver.find_elements(By.XPATH, xpath))
+        except:
+            return False
+
+    def _is_signed_in(self, driver):
+        return self._has_element(driver, FAVORITES_XPATH)
+
+    def _is_on_export_page(self, driver):
+        return self._has_element(driver, REPORT_XPATH)
+
+    def _login(self, waits, label=""):
+        driver = waits.driver
+        print(f"{label}Navigating to {self.target_url}")
+        driver.get(self.target_url)
+
+        try:
+            # A persisted profile may still hold a valid ERP session
+            waits.until('login_page', lambda d: self._is_signed_in(d) or self._has_element(d, EMAIL_XPATH), timeout=60)
+            if self._is_signed_in(driver):
+                self._emit('log', {'message': f'{label}Session still signed in'})
+                print(f"{label}Session still signed in, skipping login.")
                 return
 
-            try:
-                print("Logging in...")
-                email_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@type='email' or @name='loginfmt']")))
-                fill_input_robust(email_field, self.username)
-                email_field.send_keys(Keys.ENTER)
-                
-                password_field = wait.until(EC.visibility_of_element_located((By.XPATH, "//input[@type='password' or @name='passwd']")))
-                password_field.send_keys(self.password)
-                time.sleep(0.5) 
+            print(f"{label}Logging in...")
+            email_field = waits.until('login_email', EC.presence_of_element_located((By.XPATH, EMAIL_XPATH)), timeout=60)
+            self._fill_input_robust(driver, email_field, self.username)
+            email_field.send_keys(Keys.ENTER)
+            
+            password_field = waits.visible('login_password', "//input[@type='password' or @name='passwd']", timeout=60)
+            password_field.send_keys(self.password)
+            # Password field must own the focus before ENTER submits it
+            waits.until('login_password_focus', lambda d: d.switch_to.active_element == password_field, timeout=2, required=False)
+            driver.switch_to.active_element.send_keys(Keys.ENTER)
+            
+            if waits.until('login_stay_signed_in', EC.presence_of_element_located((By.ID, "idSIButton9")), timeout=5, required=False):
                 driver.switch_to.active_element.send_keys(Keys.ENTER)
-                
-                try:
-                    short_wait.until(EC.presence_of_element_located((By.ID, "idSIButton9")))
-                    driver.switch_to.active_element.send_keys(Keys.ENTER)
-                except: pass
-                
-                WebDriverWait(driver, 120).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-                self._emit('log', {'message': 'Login Successful'})
-                print("Login Successful!")
-            except Exception as e:
-                print(f"Login Failed: {e}")
-                raise e
+            
+            waits.until('login_finished', EC.presence_of_element_located((By.TAG_NAME, "body")), timeout=120)
+            self._emit('log', {'message': f'{label}Login Successful'})
+            print(f"{label}Login Successful!")
+        except Exception as e:
+            print(f"{label}Login Failed: {e}")
+            raise e
 
-            # --- AUTO CLOSE POPUP (ADDED HERE) ---
+    def _close_startup_popups(self, waits):
+        driver = waits.driver
+        try:
+            print("Checking for startup popups...")
+            # 3. Try Clicking Close Buttons (X or text)
+            close_selectors = [
+                "//button[@title='Close']", 
+                "//button[@aria-label='Close']",
+                "//button[span[text()='Close']]",
+                "//div[@role='button'][@title='Close']",
+                "//*[@data-icon-name='Cancel']",
+                "//*[@data-icon-name='ChromeClose']" 
+            ]
+            # Wait for the popup itself instead of a fixed 5 seconds
+            if not waits.any_visible('popup', close_selectors): return
+
+            # 1. Reset Focus
             try:
-                print("Checking for startup popups...")
-                time.sleep(5) 
+                driver.find_element(By.TAG_NAME, "body").click()
+            except: pass
 
-                # 1. Reset Focus
-                try:
-                    driver.find_element(By.TAG_NAME, "body").click()
-                except: pass
+            # 2. Try ESCAPE
+            try:
+                ActionChains(driver).send_keys(Keys.ESCAPE).perform()
+                print("Sent ESC key.")
+                waits.overlay_gone('popup_closed')
+            except: pass
 
-                # 2. Try ESCAPE
+            for xpath in close_selectors:
                 try:
-                    ActionChains(driver).send_keys(Keys.ESCAPE).perform()
-                    print("Sent ESC key.")
-                    time.sleep(1)
-                except: pass
-
-                # 3. Try Clicking Close Buttons (X or text)
-                close_selectors = [
-                    "//button[@title='Close']", 
-                    "//button[@aria-label='Close']",
-                    "//button[span[text()='Close']]",
-                    "//div[@role='button'][@title='Close']",
-                    "//*[@data-icon-name='Cancel']",
-                    "//*[@data-icon-name='ChromeClose']" 
-                ]
-                for xpath in close_selectors:
-                    try:
-                        elements = driver.find_elements(By.XPATH, xpath)
-                        for btn in elements:
-                            if btn.is_displayed():
-                                print(f"Found and clicking: {xpath}")
-                                driver.execute_script("arguments[0].click();", btn)
-                                time.sleep(1)
-                    except: continue
+                    elements = driver.find_elements(By.XPATH, xpath)
+                    for btn in elements:
+                        if btn.is_displayed():
+                            print(f"Found and clicking: {xpath}")
+                            driver.execute_script("arguments[0].click();", btn)
+                            waits.overlay_gone('popup_closed')
+                except: continue
 
-            except Exception as e:
-                print(f"Popup check finished: {e}")
-            # -------------------------------------
+        except Exception as e:
+            print(f"Popup check finished: {e}")
 
-            if self._check_stop_signal(): 
-                if driver: driver.quit()
-                return
+    def _navigate_to_export(self, waits, label=""):
+        waits.overlay_gone()
+        try:
+            self._emit('log', {'message': f'{label}Navigating...'})
+            fav_btn = waits.clickable('navigation', FAVORITES_XPATH, timeout=60)
+            fav_btn.click()
+            export_link = waits.clickable('navigation', "//*[contains(text(), 'Export Invoice (Bulk)')]", timeout=60)
+            export_link.click()
+        except Exception as e: 
+            print(f"{label}Navigation failed, trying direct URL or skipping...")
+        
+        waits.overlay_gone()
+        print(f"{label}Navigated. Starting Loop...")
+
+    def _process_invoice(self, waits, capture, i, breaker=None, label=""):
+        """
+        Drives the Report -> Purchase Order Form flow for one invoice. Returns False if stopped.
+        The item is marked completed by the download watcher once its file is captured.
+        A failed step is retried from the last state still on the page (see api/invoice_flow.py).
+        """
+        driver = waits.driver
+        fill_input_robust = lambda element, text: self._fill_input_robust(driver, element, text)
+        item = self.items[i]
+        invoice = item.get('invoice_number')
+        download = {'pending': None, 'started': False}
+
+        def find_invoice_input(d):
+            inputs = d.find_elements(By.CSS_SELECTOR, "input[role='textbox']")
+            for inp in inputs:
+                if inp.is_displayed() and inp.is_enabled(): return inp
+            return False
+
+        # --- STEPS ---
+        def open_menu():
+            waits.overlay_gone()
+            waits.clickable('menu', REPORT_XPATH).click()
+            waits.clickable('menu', PO_FORM_XPATH)
+
+        def open_form():
+            waits.clickable('menu', PO_FORM_XPATH).click()
+            waits.overlay_gone()
+            waits.until('invoice_input', find_invoice_input)
+            lap('menu')
 
-            # --- 2. NAVIGATION ---
-            wait_for_loading()
-            time.sleep(2) 
+        def enter_invoice():
+            input_field = waits.until('invoice_input', find_invoice_input)
+            fill_input_robust(input_field, invoice)
+            change_btn = waits.clickable('change_button', "//*[text()='Change' or text()='Apply' or text()='OK']", required=False)
+            if change_btn: change_btn.click()
+            else: input_field.send_keys(Keys.ENTER)
+            waits.overlay_gone()
+            lap('fill')
+
+        def fill_dialog():
+            # Some reports skip the Name dialog
+            name_input = waits.visible('dialog', NAME_INPUT_XPATH, required=False)
+            if name_input:
+                fill_input_robust(name_input, f"{invoice}.xlsx")
+                dialog_ok_btn = waits.clickable('dialog_ok', "//button[contains(@name, 'OK') or text()='OK']", required=False)
+                if dialog_ok_btn: dialog_ok_btn.click()
+                else: name_input.send_keys(Keys.ENTER)
+                waits.overlay_gone()
+            waits.clickable('download_button', DOWNLOAD_BUTTON_XPATH)
+            lap('dialog')
+
+        def trigger_download():
+            pending = download['pending']
+            if pending:
+                # The click of the failed attempt may have started the download after all
+                if waits.download_started(pending.folder, pending.known, timeout=0):
+                    capture.watch(pending)
+                    download['started'] = True
+                    lap('download')
+                    return
+                capture.discard(pending)
+            main_ok_btn = waits.clickable('download_button', DOWNLOAD_BUTTON_XPATH)
+            pending = download['pending'] = capture.expect(invoice, context=i)
+            driver.execute_script("arguments[0].click();", main_ok_btn)
+            # Chrome fixes the target folder when the download starts, so wait for that
+            # before the next invoice points it elsewhere. Completion is left to the watcher.
+            if not waits.download_started(pending.folder, pending.known): raise DownloadNotStarted("Download did not start")
+            capture.watch(pending)
+            download['started'] = True
+            waits.overlay_gone()
+            lap('download')
+
+        def close_success_popup():
+            waits.any_visible('success_popup', ["//*[@role='dialog' or @role='alertdialog']//button"])
             try:
-                self._emit('log', {'message': 'Navigating...'})
-                fav_btn = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[contains(@title, 'Favorites') or contains(@aria-label, 'Favorites')]")))
-                fav_btn.click()
-                export_link = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[contains(text(), 'Export Invoice (Bulk)')]")))
-                export_link.click()
-            except Exception as e: 
-                print("Navigation failed, trying direct URL or skipping...")
-            
-            wait_for_loading()
-            print("Navigated. Starting Loop...")
+                driver.switch_to.active_element.send_keys(Keys.ENTER)
+            except: pass
+            waits.overlay_gone()
+            lap('popup')
+
+        # --- RECOVERY ---
+        def on_failure(error_class, error):
+            signed_out = self._has_element(driver, EMAIL_XPATH)
+            if signed_out: error_class = SESSION
+            message = str(error).strip().split('\n')[0]
+            print(f"{label}[{i+1}] {error_class} error after {flow.state or 'start'}: {message}")
+            if error_class == SESSION and breaker and (breaker.failure() or signed_out):
+                print(f"{label}Session lost, logging in again...")
+                self._emit('log', {'message': f'{label}Session lost, logging in again'})
+                if not self._open_export_page(waits, label): raise SessionLost("Stopped during re-login")
+                breaker.success()
+            return error_class
+
+        flow = InvoiceFlow(
+            [
+                Step(MENU_OPEN, open_menu, holds=lambda: self._has_element(driver, PO_FORM_XPATH)),
+                Step(FORM_OPEN, open_form, holds=lambda: bool(find_invoice_input(driver))),
+                Step(INVOICE_ENTERED, enter_invoice, holds=lambda: self._has_element(driver, NAME_INPUT_XPATH)),
+                Step(DIALOG_FILLED, fill_dialog, holds=lambda: (
+                    self._has_element(driver, DOWNLOAD_BUTTON_XPATH) and not self._has_element(driver, NAME_INPUT_XPATH)
+                )),
+                Step(DOWNLOAD_TRIGGERED, trigger_download, holds=lambda: download['started']),
+                Step(CAPTURED, close_success_popup),
+            ],
+            max_failures=self.invoice_attempts,
+            on_failure=on_failure,
+            should_stop=self._check_stop_signal,
+            is_done=lambda: self.items[i].get('status') == 'completed',
+        )
+
+        self.timer.start_item(i)
+        self._update_item_status(i, 'processing')
+        print(f"[{i+1}] Processing: {invoice}")
+        lap = self.timer.stopwatch('invoice')
+        try:
+            if not flow.run(): return False
+        except FlowFailed as e:
+            print(f"Failed Invoice {invoice}: {e}")
+            if download['pending'] and not download['started']: capture.discard(download['pending'])
+            self._update_item_status(i, 'failed')
+            return True
+        if breaker: breaker.success()
+        if flow.errors:
+            print(f"{label}[{i+1}] Recovered after {len(flow.errors)} retries: " + ", ".join(f"{state}/{error_class}" for state, error_class, _ in flow.errors))
+        return True
+
+    def _open_export_page(self, waits, label=""):
+        """Login (unless the profile is still signed in), close popups and open Export Invoice (Bulk)."""
+        # --- 1. LOGIN ---
+        with self.timer.span('login'):
+            self._login(waits, label)
+
+        # --- AUTO CLOSE POPUP ---
+        self._close_startup_popups(waits)
+
+        if self._check_stop_signal(): return False
+
+        # --- 2. NAVIGATION ---
+        with self.timer.span('navigation'):
+            self._navigate_to_export(waits, label)
+        return True
+
+    def _run_worker(self, worker_id, indexes, download_dir):
+        """One browser session: login, navigate, then process its share of the invoices."""
+        label = f"[W{worker_id}] " if self.workers > 1 else ""
+        session = None
+        capture = None
+        healthy = True
+        breaker = CircuitBreaker(self.session_failure_threshold)
+        try:
+            if not os.path.exists(download_dir):
+                os.makedirs(download_dir)
+
+            if self._check_stop_signal(): return
+
+            session = session_pool.acquire(self.session_key) if self.use_session_pool else None
+            if session:
+                print(f"{label}Reusing warm browser session...")
+                self._emit('log', {'message': f'{label}Reusing warm browser session'})
+                session.set_download_dir(download_dir)
+                waits = WaitEngine(session.driver, self.wait_stats, self.wait_timeouts)
+                # Usually still on the export page from the previous run
+                if not self._is_on_export_page(session.driver):
+                    if not self._open_export_page(waits, label): return
+            else:
+                print(f"{label}Starting Browser...")
+                profile_dir = session_pool.claim_profile(self.session_key) if self.use_session_pool else None
+                try:
+                    with self.timer.span('browser_start'):
+                        driver = self._start_browser(download_dir, profile_dir)
+                except Exception:
+                    if profile_dir: session_pool.release_profile(profile_dir)
+                    raise
+                session = BrowserSession(self.session_key, driver, profile_dir)
+                waits = WaitEngine(driver, self.wait_stats, self.wait_timeouts)
+                if not self._open_export_page(waits, label): return
+
+            capture = DownloadCapture(
+                session.driver, download_dir,
+                on_captured=self._on_download_captured,
+                on_failed=self._on_download_failed,
+                timeout=self.download_timeout,
+            )
+
+            # --- 2b. HTTP FAST PATH (optional) ---
+            if self.http_export_url:
+                self._export_over_http(session.driver, indexes, download_dir, label)
 
             # --- 3. INVOICE LOOP ---
-            processed_count = 0
-            
-            def find_invoice_input():
-                inputs = driver.find_elements(By.CSS_SELECTOR, "input[role='textbox']")
-                for inp in inputs:
-                    if inp.is_displayed() and inp.is_enabled(): return inp
-                raise Exception("No input found")
-
-            # Apply limits if configured
-            total_items = len(self.items)
-            end_index = min(self.start_index + (int(self.limit) if self.limit else total_items), total_items)
-            
-            for i in range(self.start_index, end_index):
-                if self._check_stop_signal(): 
-                    if driver: driver.quit()
-                    return 
+            for i in indexes:
+                if self._check_stop_signal(): return
 
-                item = self.items[i]
-                invoice = item.get('invoice_number')
-                
                 # Check if item is already done to avoid reprocessing
-                if item.get('status') == 'completed': continue
+                if self.items[i].get('status') == 'completed': continue
+
+                if not self._process_invoice(waits, capture, i, breaker, label): return
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            # Let downloads that are still finishing land before the files are zipped
+            if capture:
+                capture.wait_all()
+                capture.close()
+            if session:
+                if self.use_session_pool: session_pool.release(session, healthy=healthy)
+                else: session.quit()
+
+    def _export_over_http(self, driver, indexes, download_dir, label=""):
+        """Fetches the invoices straight from the export endpoint with the session cookies."""
+        todo = [(i, self.items[i].get('invoice_number')) for i in indexes if self.items[i].get('status') != 'completed']
+        if not todo: return
+        print(f"{label}HTTP export of {len(todo)} invoices...")
+        self._emit('log', {'message': f'{label}Fast export of {len(todo)} invoices'})
+
+        def on_done(index, path):
+            if self.archive: self.archive.add(path)
+            self._store_in_cache(index, path)
+            self._update_item_status(index, 'completed')
+
+        def on_failed(index, error):
+            print(f"{label}HTTP export failed for {self.items[index].get('invoice_number')}: {error}")
+
+        exporter = HttpExporter(
+            self.http_export_url, self.http_export_method, self.http_export_data,
+            max_workers=self.http_export_workers, rate=self.http_export_rate, timeout=self.download_timeout,
+        )
+        try:
+            exporter.load_cookies(driver)
+            with self.timer.span('http_export'):
+                failed = exporter.export_all(todo, download_dir, on_done, on_failed, should_stop=self._check_stop_signal)
+        finally:
+            exporter.close()
+        if failed:
+            print(f"{label}{len(failed)} invoices left for the UI flow")
+
+    def _pending_indexes(self):
+        """
+        Items of the configured start_index/limit window that are not completed yet, one per
+        invoice: a repeated invoice is fetched through its first row (even outside the window).
+        """
+        total_items = len(self.items)
+        end_index = min(self.start_index + (int(self.limit) if self.limit else total_items), total_items)
+        indexes = []
+        seen = set()
+        for i in range(self.start_index, end_index):
+            if self.items[i].get('status') == 'completed': continue
+            first = self.canonical_of.get(i, i)
+            # First row done in an earlier run, this copy was not: fetch it on its own
+            if self.items[first].get('status') == 'completed': first = i
+            if first in seen: continue
+            seen.add(first)
+            indexes.append(first)
+        return indexes
+
+    def _split_indexes(self):
+        """Splits the pending invoices into one share per worker."""
+        indexes = self._pending_indexes()
+
+        # Never start more browsers than there are invoices left
+        worker_count = max(1, min(self.workers, len(indexes)))
+        # Interleave so every worker gets a similar mix of early and late rows
+        return [indexes[w::worker_count] for w in range(worker_count)]
+
+    def _target_zip_name(self):
+        target_zip_name = f"Invoices_{self.order.id}.zip"
+        try:
+            if self.order.file and hasattr(self.order.file, 'name'):
+                original = os.path.basename(self.order.file.name)
+                target_zip_name = f"{os.path.splitext(original)[0]}.zip"
+        except: pass
+        return target_zip_name
+
+    def _save_partial_archive(self, zip_path, target_zip_name):
+        """Cancelled run: keep what was captured so far as the order's ZIP."""
+        if not zip_path: return
+        with open(zip_path, 'rb') as f:
+            self.order.generated_zip.save(target_zip_name, File(f), save=False)
+        self.order.bot_message = f"Stopped by user. Partial archive saved ({self.archive.count} files)."
+        self.order.save(update_fields=['bot_message', 'generated_zip'])
+        self._emit('status_change', {
+            'status': 'cancelled',
+            'message': self.order.bot_message,
+            'file_url': self.order.generated_zip.url
+        })
+
+    def _process_in_background(self):
+        """Main logic loop: Opens browser(s), logs in, iterates invoices, downloads, and saves."""
+        self._cancel_event = cancellation.register(self.order.id)
+        try:
+            self.order.refresh_from_db()
+            # Stop pressed before this thread registered its flag
+            if self.order.bot_status == 'stopping': self._cancel_event.set()
+            self.order.bot_status = 'running'
+            self.order.bot_message = "Initializing Browser..."
+            self.order.save()
+            self._emit('status_change', {'status': 'running', 'message': 'Initializing Browser...'})
+
+            os.makedirs(self.download_dir, exist_ok=True)
+            self.status_buffer = StatusBuffer(self._flush_item_statuses, self.status_flush_items, self.status_flush_seconds)
+            if self._needs_zip():
+                self.archive = StreamingArchive(
+                    os.path.join(self.download_dir, 'archive.zip'),
+                    self.archive_compression, self.archive_compresslevel,
+                )
+
+            # Invoices fetched by earlier orders need no browser at all
+            with self.timer.span('cache'):
+                self._fill_from_cache()
 
-                for attempt in range(3): # Retry logic
-                    if self._check_stop_signal(): 
-                        if driver: driver.quit()
-                        return
+            shards = self._split_indexes()
+            worker_errors = []
+
+            if not any(shards):
+                print("Every invoice is already downloaded, no browser needed.")
+            elif len(shards) == 1:
+                # Single browser: download straight into the order folder
+                self._run_worker(1, shards[0], self.download_dir)
+            else:
+                print(f"Starting {len(shards)} parallel browsers...")
+                self._emit('log', {'message': f'Starting {len(shards)} parallel browsers...'})
+                worker_dirs = [os.path.join(self.download_dir, f"worker_{n}") for n in range(1, len(shards) + 1)]
+
+                def worker_target(worker_id, indexes, worker_dir):
                     try:
-                        self._update_item_status(i, 'processing')
-                        print(f"[{i+1}] Processing: {invoice}")
-                        wait_for_loading()
-
-                        # --- INTERACTION LOGIC (Simplified) ---
-                        # 1. Open Report
-                        print("Clicking Report Dropdown...")
-                        try:
-                            target_report_text = "Report"
-                            report_link = wait.until(EC.element_to_be_clickable((By.XPATH, f"//*[contains(text(), '{target_report_text}')]")))
-                            report_link.click()
-                            time.sleep(0.5)
-                            po_form_link = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[contains(text(), 'Purchase Order Form')]")))
-                            po_form_link.click()
-                        except Exception as nav_err:
-                            print(f"Menu error: {nav_err}")
-                            time.sleep(1)
-                            report_link = wait.until(EC.element_to_be_clickable((By.XPATH, f"//*[contains(text(), '{target_report_text}')]")))
-                            report_link.click()
-                            time.sleep(0.5)
-                            po_form_link = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[contains(text(), 'Purchase Order Form')]")))
-                            po_form_link.click()
-
-                        wait_for_loading()
-                        time.sleep(2) 
-
-                        # 2. Fill Invoice
-                        input_field = wait.until(lambda d: find_invoice_input())
-                        fill_input_robust(input_field, invoice)
-                        
-                        # 3. Click Change/Apply
-                        try:
-                            change_btn = driver.find_element(By.XPATH, "//*[text()='Change' or text()='Apply' or text()='OK']")
-                            change_btn.click()
-                        except:
-                            input_field.send_keys(Keys.ENTER)
-
-                        wait_for_loading()
-                        time.sleep(1)
-
-                        # 4. Handle Dialog & Download
-                        try:
-                            name_input = wait.until(EC.visibility_of_element_located((By.XPATH, "//label[contains(text(), 'Name')]/following::input[1]")))
-                            fill_input_robust(name_input, f"{invoice}.xlsx")
-                            
-                            try:
-                                dialog_ok_btn = driver.find_element(By.XPATH, "//button[contains(@name, 'OK') or text()='OK']")
-                                dialog_ok_btn.click()
-                            except:
-                                name_input.send_keys(Keys.ENTER)
-
-                            wait_for_loading()
-                            time.sleep(1)
-                        except Exception as dialog_err:
-                            print(f"Dialog step error: {dialog_err}")
-
-                        # 5. Final Download Trigger
-                        try:
-                            main_ok_btn = short_wait.until(EC.element_to_be_clickable((By.XPATH, "//button[span[text()='OK']] | //button[text()='OK']")))
-                            driver.execute_script("arguments[0].click();", main_ok_btn)
-                            
-                            # Capture and Rename File
-                            self._rename_latest_download(invoice)
-                        except Exception as err:
-                            print(f"Download trigger failed: {err}")
-                            try: driver.switch_to.active_element.send_keys(Keys.ENTER)
-                            except: pass
-
-                        wait_for_loading()
-                        time.sleep(2) 
-
-                        # 6. Close Success Popup
-                        try:
-                            driver.switch_to.active_element.send_keys(Keys.ENTER)
-                        except: pass
-                        
-                        wait_for_loading()
-                        time.sleep(2) 
-
-                        self._update_item_status(i, 'completed')
-                        processed_count += 1
-                        break 
+                        self._run_worker(worker_id, indexes, worker_dir)
                     except Exception as e:
-                        print(f"Failed Invoice {invoice}: {e}")
-                        if attempt == 2: self._update_item_status(i, 'failed')
-                        else: time.sleep(1)
+                        print(f"[W{worker_id}] Worker failed: {e}")
+                        worker_errors.append(f"Worker {worker_id}: {e}")
+
+                threads = [
+                    threading.Thread(target=worker_target, args=(n, shard, worker_dir))
+                    for n, (shard, worker_dir) in enumerate(zip(shards, worker_dirs), start=1)
+                ]
+                for t in threads: t.start()
+                for t in threads: t.join()
+
+                self._collect_worker_files(worker_dirs)
+
+                # Every browser crashed: report it like a single-browser failure
+                if len(worker_errors) == len(shards):
+                    raise Exception(worker_errors[0])
+
+            # How long each wait step really took, to tune timeouts
+            wait_summary = self.wait_stats.format_summary()
+            if wait_summary:
+                print(f"Wait timings: {wait_summary}")
+                self._emit('log', {'message': f'Wait timings: {wait_summary}'})
+
+            # Every worker is done: write the last item statuses before packaging
+            self.status_buffer.close()
 
             # --- 4. FINISH & SAVE ---
-            print("Zipping files...")
-            zip_path = self._zip_files()
-            
-            target_zip_name = f"Invoices_{self.order.id}.zip"
-            try:
-                if self.order.file and hasattr(self.order.file, 'name'):
-                    original = os.path.basename(self.order.file.name)
-                    target_zip_name = f"{os.path.splitext(original)[0]}.zip"
-            except: pass
+            print("Finalizing archive...")
+            with self.timer.span('zip'):
+                zip_path = self._finalize_archive()
+            target_zip_name = self._target_zip_name()
 
-            if zip_path and os.path.exists(zip_path):
-                status_messages = []
+            if self._cancelled:
+                if not self.abandoned: self._save_partial_archive(zip_path, target_zip_name)
+                return
 
-                # --- 1. SAVE TO DJANGO MODEL (BACKUP) ---
-                with open(zip_path, 'rb') as f:
-                    self.order.generated_zip.save(target_zip_name, File(f))
-                cloud_url = self.order.generated_zip.url
-                
-                # --- 2. UPLOAD TO DIGITALOCEAN SERVER (SFTP) ---
-                # This is the step that satisfies your requirement to store on 68.183.225.187
-                if self.use_digital_ocean:
-                    success, msg = self._upload_to_sftp(zip_path, target_zip_name)
-                    status_messages.append(msg)
-
-                # --- 3. OPTIONAL LOCAL COPY (Can leave this if you still want it on Windows too) ---
-                if self.local_target_path:
-                    # UPDATED: Now Extracts instead of Copies
-                    msg = self._extract_locally(zip_path, os.path.normpath(self.local_target_path), target_zip_name, "Local Folder")
-                    status_messages.append(msg)
-                
-                # --- 4. COMPANY SERVER COPY (SMB/Network Share) ---
-                if self.use_company_server and self.company_server_path:
-                    # UPDATED: Now Extracts instead of Copies
-                    msg = self._extract_locally(zip_path, self.company_server_path, target_zip_name, "Company Server")
-                    status_messages.append(msg)
+            # A previous owner running late must not deliver a partial archive
+            if not self._still_owner():
+                print("Run taken over by another worker, skipping delivery.")
+                return
+
+            files = self._captured_files()
+            if files:
+                # All destinations at once: the slowest one no longer delays the others
+                results = deliver_all(self._delivery_targets(files, zip_path, target_zip_name), self.delivery_workers)
+                for r in results:
+                    print(f"Delivery {r.name}: {'OK' if r.success else 'FAILED'} in {r.duration:.1f}s ({r.bytes} bytes)")
+                    self.timer.record(f"delivery.{r.key}", r.duration)
+
+                status_messages = [r.summary() for r in results]
+                status_messages.extend(worker_errors)
+                cloud_url = self.order.generated_zip.url if self.order.generated_zip else None
 
                 # Combine messages
                 status_msg = " | ".join(status_messages)
@@ -547,26 +989,44 @@ class AutoDownloadBot:
                 self._emit('status_change', {
                     'status': 'completed', 
                     'message': status_msg, 
-                    'file_url': cloud_url 
+                    'file_url': cloud_url,
+                    'deliveries': [r.as_dict() for r in results],
+                    'wait_stats': self.wait_stats.summary(),
+                    'timings': self.timer.format_summary()
                 })
             else:
                 self.order.bot_status = 'completed'
                 self.order.bot_message = "Finished, no files found."
                 self._emit('status_change', {'status': 'completed', 'message': "Finished, no files."})
             
-            self.order.save()
+            # ...nor remove the folder the new owner downloads into
+            if not self._still_owner():
+                print("Run taken over by another worker during delivery, leaving its folder alone.")
+                return
+
+            self.order.save(update_fields=['bot_status', 'bot_message', 'generated_zip'])
             
             # 5. Cleanup Temp Folder
             try:
                 shutil.rmtree(self.download_dir)
             except: pass
 
-            if driver: driver.quit()
+            if self.invoice_cache:
+                try:
+                    evicted = self.invoice_cache.evict()
+                    if evicted: print(f"Invoice cache: evicted {evicted} old files")
+                except Exception as e:
+                    print(f"Invoice cache eviction failed: {e}")
 
         except Exception as e:
             print(f"CRITICAL BOT ERROR: {e}")
+            if self.abandoned: return
             self.order.bot_status = 'failed'
             self.order.bot_message = f"Error: {str(e)}"
-            self.order.save()
+            self.order.save(update_fields=['bot_status', 'bot_message'])
             self._emit('status_change', {'status': 'failed', 'message': f"Error: {str(e)}"})
-            if driver: driver.quit()
\ No newline at end of file
+        finally:
+            # Finished, failed or cancelled: nothing buffered may be lost
+            if self.status_buffer: self.status_buffer.close()
+            if self.archive: self.archive.close()
+            cancellation.unregister(self.order.id)
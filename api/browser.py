@@ -0,0 +1,394 @@
+import time
+import os
+import json
+import hashlib
+import threading
+from django.conf import settings
+from filelock import FileLock, Timeout
+from selenium.webdriver.chrome.options import Options
+
+BROWSER_PROFILES = ('standard', 'lean')
+
+# Lean profile: what the ERP pages need to work, nothing else
+LEAN_ARGUMENTS = [
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-extensions',
+    '--disable-sync',
+    '--disable-features=Translate,OptimizationHints,MediaRouter,AutofillServerCommunication',
+    '--metrics-recording-only',
+    '--no-first-run',
+    '--mute-audio',
+    '--blink-settings=imagesEnabled=false',
+    '--renderer-process-limit=2',
+]
+BLOCKED_RESOURCE_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm', '*.mp3', '*.ogg', '*.wav',
+]
+
+
+def build_chrome_options(download_dir, profile='standard', headless=False, profile_dir=None, memory_mb=512, window_size='1280,800'):
+    """
+    Chrome options for one bot browser.
+    'standard' is the visible, maximized browser the bot always used.
+    'lean' is for packing many bots on one host: headless=new, no images, small
+    viewport, background services off, a V8 heap cap, and no detach so Chrome
+    never outlives its worker.
+    memory_mb only caps the JavaScript heap of each renderer (--max-old-space-size);
+    it does not bound the browser or GPU processes. The whole browser is limited by
+    the session pool (BOT_SESSION_MAX_RSS_MB), which recycles it when it grows past that.
+    """
+    if profile not in BROWSER_PROFILES:
+        raise ValueError(f"Unknown browser profile '{profile}'")
+    lean = profile == 'lean'
+
+    chrome_options = Options()
+    if not lean:
+        chrome_options.add_experimental_option("detach", True)
+
+    chrome_options.add_argument('--ignore-certificate-errors')
+    chrome_options.add_argument('--ignore-ssl-errors')
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+
+    if lean:
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument(f"--window-size={window_size}")
+        for argument in LEAN_ARGUMENTS:
+            chrome_options.add_argument(argument)
+        if memory_mb:
+            chrome_options.add_argument(f"--js-flags=--max-old-space-size={int(memory_mb)}")
+    else:
+        chrome_options.add_argument("--start-maximized")
+        if headless:
+            chrome_options.add_argument("--headless=new")
+            chrome_options.add_argument(f"--window-size={window_size}")
+
+    # Persistent profile keeps the ERP cookies between browser restarts
+    if profile_dir:
+        chrome_options.add_argument(f"--user-data-dir={profile_dir}")
+
+    prefs = {
+        "download.default_directory": download_dir,
+        "download.prompt_for_download": False,
+        "directory_upgrade": True,
+        "safebrowsing.enabled": True
+    }
+    if lean:
+        prefs["profile.managed_default_content_settings.images"] = 2
+    chrome_options.add_experimental_option("prefs", prefs)
+    return chrome_options
+
+
+def block_heavy_resources(driver):
+    """Lean profile: fonts, images and media are never fetched (CDP, per browser)."""
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_RESOURCE_PATTERNS})
+    except Exception as e:
+        print(f"Could not block resources: {e}")
+
+
+class BrowserSession:
+    """A logged-in Chrome driver that can be handed from one bot run to the next."""
+
+    def __init__(self, key, driver, profile_dir=None):
+        self.key = key
+        self.driver = driver
+        self.profile_dir = profile_dir
+        self.created_at = time.time()
+        self.last_used = time.time()
+
+    def is_expired(self, max_age):
+        return time.time() - self.created_at > max_age
+
+    def is_idle(self, idle_timeout):
+        return time.time() - self.last_used > idle_timeout
+
+    def is_alive(self):
+        """Cheap health check: the browser answers and the page finished loading."""
+        try:
+            return self.driver.execute_script("return document.readyState") == 'complete'
+        except Exception:
+            return False
+
+    def memory_mb(self):
+        """RSS of chromedriver and every Chrome process under it (browser, GPU, renderers), in MB."""
+        import psutil
+        try:
+            root = psutil.Process(self.driver.service.process.pid)
+            processes = [root] + root.children(recursive=True)
+        except (AttributeError, psutil.Error):
+            return 0
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / (1024 * 1024)
+
+    def set_download_dir(self, download_dir):
+        """Points Chrome downloads at a new folder without restarting the browser."""
+        self.driver.execute_cdp_cmd('Page.setDownloadBehavior', {
+            'behavior': 'allow',
+            'downloadPath': download_dir,
+        })
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+
+class BrowserSessionPool:
+    """
+    Keeps authenticated drivers alive between bot runs.
+    Sessions are grouped by key (ERP url + username) and evicted when idle or too old,
+    or not taken back when the whole browser uses more than max_rss_mb.
+    """
+
+    def __init__(self, idle_timeout=600, max_age=4 * 3600, max_size=4, reap_interval=60, max_rss_mb=0):
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.max_size = max_size
+        self.max_rss_mb = max_rss_mb
+        self.reap_interval = reap_interval
+        self._idle = {}
+        self._claimed = {}     # profile folder -> its slot lock
+        self._warming = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    @staticmethod
+    def make_key(target_url, username, profile='standard'):
+        return f"{target_url}|{username}|{profile}"
+
+    def claim_profile(self, key):
+        """
+        Reserves a persistent Chrome profile folder for a new browser, so its cookies
+        (and the ERP login) survive a browser restart. Chrome locks a profile per process,
+        so every live browser of the same key gets its own slot. A slot is held through a
+        lock file next to its folder, so bot worker processes (and nodes sharing MEDIA_ROOT)
+        never hand the same folder to two browsers; the OS drops the lock if a worker dies.
+        """
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        root = os.path.join(settings.MEDIA_ROOT, 'browser_profiles')
+        os.makedirs(root, exist_ok=True)
+        slot = 0
+        while True:
+            slot += 1
+            path = os.path.join(root, f"{digest}_{slot}")
+            with self._lock:
+                if path in self._claimed: continue
+                self._claimed[path] = None
+            # Released from whichever thread ends the browser, so not thread-local
+            lock = FileLock(f"{path}.lock", thread_local=False)
+            try:
+                lock.acquire(timeout=0)
+            except Timeout:
+                # In use by another process
+                with self._lock:
+                    self._claimed.pop(path, None)
+                continue
+            with self._lock:
+                self._claimed[path] = lock
+            break
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+    def acquire(self, key):
+        """Returns a healthy idle session for key, or None if the caller must start a new browser."""
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key) or []
+                if not sessions: return None
+                # Most recently used first, it is the least likely to be logged out
+                session = sessions.pop()
+
+            if session.is_expired(self.max_age) or not session.is_alive():
+                print("Discarding stale browser session.")
+                self._discard(session)
+                continue
+
+            session.last_used = time.time()
+            return session
+
+    def release(self, session, healthy=True):
+        """Puts a session back for the next run, or closes it if it is broken or the pool is full."""
+        if not healthy or session.is_expired(self.max_age):
+            self._discard(session)
+            return
+        if self.max_rss_mb:
+            memory = session.memory_mb()
+            if memory > self.max_rss_mb:
+                # Long-lived browsers grow (renderer caches, leaks): a fresh one is cheaper than the host swapping
+                print(f"Browser uses {memory:.0f} MB (limit {self.max_rss_mb} MB), recycling it.")
+                self._discard(session)
+                return
+
+        session.last_used = time.time()
+        with self._lock:
+            total = sum(len(s) for s in self._idle.values())
+            pooled = total < self.max_size
+            if pooled:
+                self._idle.setdefault(session.key, []).append(session)
+        if not pooled:
+            self._discard(session)
+            return
+        self._start_reaper()
+
+    def release_profile(self, profile_dir):
+        with self._lock:
+            lock = self._claimed.pop(profile_dir, None)
+        if lock: lock.release()
+
+    def _discard(self, session):
+        session.quit()
+        self.release_profile(session.profile_dir)
+
+    def prune(self):
+        """Closes idle or expired sessions."""
+        stale = []
+        with self._lock:
+            for key, sessions in self._idle.items():
+                keep = []
+                for s in sessions:
+                    if s.is_idle(self.idle_timeout) or s.is_expired(self.max_age): stale.append(s)
+                    else: keep.append(s)
+                self._idle[key] = keep
+        for s in stale:
+            self._discard(s)
+        return len(stale)
+
+    def prewarm(self, key, launch):
+        """
+        Starts a spare browser for key in the background (launch() returns a BrowserSession),
+        so the next run skips the Chrome startup. Does nothing if one is idle or warming already.
+        """
+        with self._lock:
+            if self._closed or self._idle.get(key) or key in self._warming: return False
+            self._warming.add(key)
+
+        def warm():
+            try:
+                session = launch()
+                with self._lock:
+                    closed = self._closed
+                # The process is shutting down: don't leave the spare behind
+                if closed: self._discard(session)
+                else: self.release(session)
+                print("Spare browser ready.")
+            except Exception as e:
+                print(f"Could not pre-warm a browser: {e}")
+            finally:
+                with self._lock:
+                    self._warming.discard(key)
+
+        threading.Thread(target=warm, daemon=True).start()
+        return True
+
+    def close_all(self):
+        with self._lock:
+            self._closed = True
+            sessions = [s for group in self._idle.values() for s in group]
+            self._idle = {}
+        for s in sessions:
+            self._discard(s)
+
+    def _start_reaper(self):
+        if self._reaper and self._reaper.is_alive(): return
+
+        def reap():
+            while True:
+                time.sleep(self.reap_interval)
+                self.prune()
+
+        self._reaper = threading.Thread(target=reap, daemon=True)
+        self._reaper.start()
+
+
+class DriverResolver:
+    """
+    Finds chromedriver once per process instead of once per run.
+    The result is pinned in a small JSON file together with the local Chrome version,
+    so later processes reuse it without any network call as long as Chrome was not
+    upgraded and the driver file still exists.
+    """
+
+    def __init__(self, pin_file):
+        self.pin_file = pin_file
+        self._path = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def browser_version():
+        """Version of the installed Chrome, read from the local binary (offline)."""
+        try:
+            from webdriver_manager.core.os_manager import OperationSystemManager, ChromeType
+            return OperationSystemManager().get_browser_version_from_os(ChromeType.GOOGLE)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _major(version):
+        return str(version).split('.')[0] if version else None
+
+    def _read_pin(self):
+        try:
+            with open(self.pin_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def resolve(self):
+        """Returns the chromedriver path, downloading it only when the pin is missing or outdated."""
+        with self._lock:
+            if self._path and os.path.isfile(self._path): return self._path
+
+            version = self.browser_version()
+            pin = self._read_pin()
+            if pin and os.path.isfile(pin.get('driver_path', '')) and self._major(pin.get('browser_version')) == self._major(version):
+                self._path = pin['driver_path']
+                return self._path
+
+            from webdriver_manager.chrome import ChromeDriverManager
+            print("Resolving chromedriver...")
+            self._path = ChromeDriverManager().install()
+            try:
+                os.makedirs(os.path.dirname(self.pin_file), exist_ok=True)
+                with open(self.pin_file, 'w') as f:
+                    json.dump({'driver_path': self._path, 'browser_version': version, 'resolved_at': time.time()}, f)
+            except OSError as e:
+                print(f"Could not write the driver pin: {e}")
+            return self._path
+
+    def invalidate(self):
+        """Forgets the pinned driver (e.g. Chrome refused it after an upgrade)."""
+        with self._lock:
+            self._path = None
+            try:
+                os.remove(self.pin_file)
+            except OSError:
+                pass
+
+
+driver_resolver = DriverResolver(
+    getattr(settings, 'BOT_DRIVER_PIN_FILE', os.path.join(settings.MEDIA_ROOT, 'drivers', 'chromedriver.json'))
+)
+
+# One pool per process, shared by every bot run
+session_pool = BrowserSessionPool(
+    idle_timeout=getattr(settings, 'BOT_SESSION_IDLE_TIMEOUT', 600),
+    max_age=getattr(settings, 'BOT_SESSION_MAX_AGE', 4 * 3600),
+    max_size=getattr(settings, 'BOT_SESSION_POOL_SIZE', 4),
+    max_rss_mb=getattr(settings, 'BOT_SESSION_MAX_RSS_MB', 0),
+)
@@ -0,0 +1,91 @@
+import threading
+from django.conf import settings
+
+CANCEL_CHANNEL = 'bot:cancel'
+
+
+class CancellationRegistry:
+    """
+    In-process stop flags for running bots, keyed by order id.
+    stop_bot sets the flag directly when the bot runs in the same process.
+    When REDIS_URL is configured the request is also published, so bots running
+    in other processes receive it through their own registry's listener.
+    """
+
+    def __init__(self, redis_url=''):
+        self.redis_url = redis_url
+        self._events = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self._redis = None
+
+    def register(self, order_id):
+        """Returns the stop flag for a run that is starting in this process."""
+        with self._lock:
+            event = self._events.setdefault(str(order_id), threading.Event())
+        self._start_listener()
+        return event
+
+    def unregister(self, order_id):
+        with self._lock:
+            self._events.pop(str(order_id), None)
+
+    def is_cancelled(self, order_id):
+        with self._lock:
+            event = self._events.get(str(order_id))
+        return bool(event and event.is_set())
+
+    def cancel(self, order_id):
+        """Signals the run of order_id here and, through Redis, in every other process."""
+        found = self._set_local(order_id)
+        client = self._client()
+        if client:
+            try:
+                client.publish(CANCEL_CHANNEL, str(order_id))
+            except Exception as e:
+                print(f"Cancel publish failed: {e}")
+        return found
+
+    def _set_local(self, order_id):
+        with self._lock:
+            event = self._events.get(str(order_id))
+        if event:
+            event.set()
+            return True
+        return False
+
+    # --- Redis pub/sub fallback ---
+    def _client(self):
+        if not self.redis_url: return None
+        if self._redis is None:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(self.redis_url)
+            except Exception as e:
+                print(f"Redis unavailable for cancellation: {e}")
+                self.redis_url = ''
+                return None
+        return self._redis
+
+    def _start_listener(self):
+        client = self._client()
+        if not client: return
+        with self._lock:
+            if self._listener and self._listener.is_alive(): return
+            self._listener = threading.Thread(target=self._listen, args=(client,), daemon=True)
+            self._listener.start()
+
+    def _listen(self, client):
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CANCEL_CHANNEL)
+            for message in pubsub.listen():
+                order_id = message.get('data')
+                if isinstance(order_id, bytes): order_id = order_id.decode()
+                self._set_local(order_id)
+        except Exception as e:
+            # The bots still see the stop through their slow DB check
+            print(f"Cancel listener stopped: {e}")
+
+
+cancellation = CancellationRegistry(getattr(settings, 'REDIS_URL', ''))
@@ -0,0 +1,161 @@
+import time
+import os
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+COPY_CHUNK = 8 * 1024 * 1024
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class DeliveryResult:
+    def __init__(self, key, name):
+        self.key = key
+        self.name = name
+        self.success = False
+        self.message = ''
+        self.bytes = 0
+        self.duration = 0.0
+        self.attempts = 0
+
+    def summary(self):
+        """Short text for bot_message, e.g. 'Extracted to Local Folder (2.1s, 4.3 MB)'."""
+        return f"{self.message} ({self.duration:.1f}s, {format_bytes(self.bytes)})"
+
+    def as_dict(self):
+        return {
+            'target': self.key,
+            'name': self.name,
+            'success': self.success,
+            'message': self.message,
+            'bytes': self.bytes,
+            'duration': round(self.duration, 3),
+            'attempts': self.attempts,
+        }
+
+
+def check_deadline(deadline, what="delivery"):
+    """Raises TimeoutError once deadline (a time.time() value, or None) has passed."""
+    if deadline and time.time() > deadline:
+        raise TimeoutError(f"{what} ran past its deadline")
+
+
+class DeliveryTarget:
+    """
+    One destination of the bot output.
+    `send(deadline)` returns (success, message, bytes_sent). It runs in the calling
+    thread and must give up by itself once time.time() passes deadline (socket and
+    storage timeouts, deadline checks between chunks and files), so an attempt is
+    always over before the next one starts. Failures are retried with a growing delay.
+    """
+
+    def __init__(self, key, name, send, timeout=300, retries=1, retry_delay=2):
+        self.key = key
+        self.name = name
+        self.send = send
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    def _attempt(self):
+        try:
+            return self.send(time.time() + self.timeout)
+        except TimeoutError:
+            return False, f"{self.name} timed out after {self.timeout}s", 0
+        except Exception as e:
+            return False, f"{self.name} failed: {e}", 0
+
+    def deliver(self):
+        result = DeliveryResult(self.key, self.name)
+        start = time.time()
+        for attempt in range(self.retries + 1):
+            result.attempts = attempt + 1
+            result.success, result.message, result.bytes = self._attempt()
+            if result.success: break
+            if attempt < self.retries:
+                print(f"{self.name} delivery failed ({result.message}), retrying...")
+                time.sleep(self.retry_delay * (2 ** attempt))
+        result.duration = time.time() - start
+        return result
+
+
+def deliver_all(targets, max_workers=4):
+    """Pushes to every target concurrently (bounded). Results keep the order of targets."""
+    if not targets: return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as pool:
+        return list(pool.map(lambda target: target.deliver(), targets))
+
+
+# --- Filesystem targets (local folder, SMB share) ---
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def same_file(src, dest):
+    """True when dest already holds the same bytes as src (size first, then hash)."""
+    try:
+        if os.path.getsize(src) != os.path.getsize(dest): return False
+    except OSError:
+        return False
+    return file_digest(src) == file_digest(dest)
+
+
+def fast_copy(src, dest):
+    """
+    Copies one file using kernel-side copies where available: copy_file_range
+    (Linux, can be a server-side copy on network filesystems), otherwise
+    shutil.copyfile, which uses sendfile on Linux and CopyFile2 on Windows.
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(remaining, COPY_CHUNK))
+                    if copied == 0: break
+                    remaining -= copied
+                if remaining == 0: return
+        except OSError:
+            # Cross-device or unsupported filesystem: use the portable path
+            pass
+    shutil.copyfile(src, dest)
+
+
+def copy_files(files, dest_dir, max_workers=4, deadline=None):
+    """
+    Copies files straight into dest_dir in parallel, skipping files whose size and
+    hash already match. Each file is written to '<name>.part' and renamed, so a
+    target never shows half-copied invoices. Raises TimeoutError when deadline passes
+    (checked before every file). Returns (copied, skipped, bytes_written).
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+
+    def copy_one(src):
+        check_deadline(deadline, f"Copy to {dest_dir}")
+        dest = os.path.join(dest_dir, os.path.basename(src))
+        if same_file(src, dest): return False, 0
+        part = f"{dest}.part"
+        fast_copy(src, part)
+        os.replace(part, dest)
+        return True, os.path.getsize(dest)
+
+    copied = skipped = written = 0
+    if not files: return copied, skipped, written
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as pool:
+        for did_copy, size in pool.map(copy_one, files):
+            if did_copy:
+                copied += 1
+                written += size
+            else:
+                skipped += 1
+    return copied, skipped, written
@@ -0,0 +1,216 @@
+import time
+import os
+import shutil
+import threading
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    # Optional: without it the watcher scans the capture folders every `poll` seconds
+    Observer = None
+
+# Chrome writes these while a download is still in progress
+PARTIAL_SUFFIXES = ('.crdownload', '.tmp')
+# With file events, the folders are still scanned this often to notice timeouts
+EVENT_SAFETY_TICK = 1.0
+
+
+class _WakeOnChange:
+    """watchdog handler: any file event under the watched folders wakes the capture watcher."""
+
+    def __init__(self, wakeup):
+        self.wakeup = wakeup
+
+    def dispatch(self, event):
+        self.wakeup.set()
+
+
+class PendingDownload:
+    """One expected file. Resolved by the capture watcher once Chrome finishes writing it."""
+
+    def __init__(self, name, folder, known=None, context=None):
+        self.name = name
+        self.folder = folder
+        self.known = known or set()
+        self.context = context
+        self.started_at = time.time()
+        self.path = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.path
+
+
+class DownloadCapture:
+    """
+    Routes every invoice download into its own folder through the DevTools
+    Page.setDownloadBehavior command, so a file can never be mistaken for another
+    invoice's. A single watcher thread resolves each folder as soon as its file is
+    complete and moves it to download_dir as <name><ext>, which lets the bot move on
+    to the next invoice while the previous download is still finishing.
+    The watcher is woken by file events (watchdog: inotify, ReadDirectoryChangesW,
+    FSEvents) when Chrome renames the finished file; it only polls when watchdog is
+    not installed or the folder cannot be watched.
+    """
+
+    def __init__(self, driver, download_dir, on_captured=None, on_failed=None, timeout=60, poll=0.1):
+        self.driver = driver
+        self.download_dir = download_dir
+        self.capture_root = os.path.join(download_dir, '.capture')
+        self.on_captured = on_captured
+        self.on_failed = on_failed
+        self.timeout = timeout
+        self.poll = poll
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._counter = 0
+        self._isolated = True
+        self._shared_watched = False
+        self._observer = self._start_observer()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def _start_observer(self):
+        if Observer is None: return None
+        try:
+            os.makedirs(self.capture_root, exist_ok=True)
+            observer = Observer()
+            observer.schedule(_WakeOnChange(self._wakeup), self.capture_root, recursive=True)
+            observer.daemon = True
+            observer.start()
+            return observer
+        except Exception as e:
+            print(f"File events unavailable, polling downloads: {e}")
+            return None
+
+    def expect(self, name, context=None):
+        """Prepares a private folder for the next download and points Chrome at it."""
+        with self._lock:
+            self._counter += 1
+            folder = os.path.join(self.capture_root, f"{self._counter}")
+        known = None
+        if self._isolated:
+            os.makedirs(folder, exist_ok=True)
+            try:
+                self.driver.execute_cdp_cmd('Page.setDownloadBehavior', {'behavior': 'allow', 'downloadPath': folder})
+            except Exception as e:
+                # Not a Chromium driver: fall back to spotting new files in the shared folder
+                print(f"Isolated download capture unavailable: {e}")
+                self._isolated = False
+        if not self._isolated:
+            folder = self.download_dir
+            known = set(os.listdir(folder))
+            self._watch_shared_folder()
+        return PendingDownload(name, folder, known, context)
+
+    def _watch_shared_folder(self):
+        """Shared-folder fallback: finished files appear next to the order files, watch there too."""
+        if not self._observer or self._shared_watched: return
+        self._shared_watched = True
+        try:
+            self._observer.schedule(_WakeOnChange(self._wakeup), self.download_dir, recursive=False)
+        except Exception as e:
+            print(f"Could not watch {self.download_dir}: {e}")
+
+    def watch(self, pending):
+        """Hands a triggered download to the watcher thread."""
+        with self._lock:
+            self._pending.append(pending)
+        self._wakeup.set()
+
+    def discard(self, pending):
+        """Forgets a download that never started (the invoice will be retried)."""
+        with self._lock:
+            if pending in self._pending: self._pending.remove(pending)
+        pending.error = "discarded"
+        pending.done.set()
+
+    def wait_all(self, timeout=None):
+        """Blocks until every watched download is captured or timed out."""
+        deadline = time.time() + (timeout if timeout is not None else self.timeout)
+        while True:
+            with self._lock:
+                if not self._pending: return True
+                pending = self._pending[0]
+            remaining = deadline - time.time()
+            if remaining <= 0: return False
+            pending.done.wait(remaining)
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._observer:
+            try:
+                self._observer.stop()
+                self._observer.join(timeout=2)
+            except Exception: pass
+        try:
+            shutil.rmtree(self.capture_root)
+        except: pass
+
+    # --- Watcher ---
+    def _finished_file(self, pending):
+        try:
+            names = os.listdir(pending.folder)
+        except FileNotFoundError:
+            return None
+        new_names = [n for n in names if n not in pending.known]
+        # Still writing: Chrome keeps a .crdownload next to the final name
+        if any(n.endswith(PARTIAL_SUFFIXES) for n in new_names): return None
+        files = [os.path.join(pending.folder, n) for n in new_names if os.path.isfile(os.path.join(pending.folder, n))]
+        return files[0] if files else None
+
+    def _store(self, pending, src):
+        extension = os.path.splitext(src)[1]
+        new_path = os.path.join(self.download_dir, f"{pending.name}{extension}")
+        # Handle duplicates if the file already exists
+        if os.path.exists(new_path):
+            new_path = os.path.join(self.download_dir, f"{pending.name}_{int(time.time() * 1000)}{extension}")
+        shutil.move(src, new_path)
+        if pending.folder != self.download_dir:
+            try: os.rmdir(pending.folder)
+            except OSError: pass
+        else:
+            # Shared-folder fallback: the renamed file must not look new to other pendings
+            with self._lock:
+                for other in self._pending:
+                    other.known.add(os.path.basename(new_path))
+        return new_path
+
+    def _watch(self):
+        while not self._closed:
+            # Cleared before the scan: an event arriving meanwhile triggers another one
+            self._wakeup.clear()
+            with self._lock:
+                pending_list = list(self._pending)
+            if not pending_list:
+                self._wakeup.wait(1)
+                continue
+
+            for pending in pending_list:
+                try:
+                    src = self._finished_file(pending)
+                    if src:
+                        pending.path = self._store(pending, src)
+                        print(f"Captured and renamed to: {os.path.basename(pending.path)}")
+                    elif time.time() - pending.started_at > self.timeout:
+                        pending.error = f"Download of {pending.name} timed out"
+                    else:
+                        continue
+                except Exception as e:
+                    pending.error = f"Error capturing {pending.name}: {e}"
+
+                callback = self.on_captured if pending.path else self.on_failed
+                if callback:
+                    try: callback(pending)
+                    except Exception as e: print(f"Capture callback error: {e}")
+                # Removed last, so wait_all() also covers the callback
+                with self._lock:
+                    if pending in self._pending: self._pending.remove(pending)
+                pending.done.set()
+
+            self._wakeup.wait(EVENT_SAFETY_TICK if self._observer else self.poll)
@@ -0,0 +1,251 @@
+import json
+import time
+import random
+import secrets
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+SESSION_COOKIE = 'erp_session'
+
+# Single page copying the markup AutoDownloadBot looks for: Microsoft-style login
+# (loginfmt / passwd / idSIButton9), Favorites -> "Export Invoice (Bulk)",
+# Report -> Purchase Order Form -> Apply -> Name dialog -> OK -> download, success popup.
+# Like D365, the Name dialog only exists in the DOM while it is open: the bot's XPaths
+# (DOWNLOAD_BUTTON_XPATH is a union whose first match must be the download button,
+# NAME_INPUT_XPATH marks the dialog state) rely on a closed dialog being gone.
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Fake ERP</title>
+<style>
+  .hidden { display: none; }
+  .sys-loading-overlay { position: fixed; inset: 0; background: rgba(0,0,0,.2); }
+  [role=dialog] { border: 1px solid #999; padding: 8px; margin: 8px; }
+</style></head>
+<body>
+<div id="overlay" class="sys-loading-overlay hidden"></div>
+
+<div id="login" class="%(login_class)s">
+  <input id="email" type="email" name="loginfmt" autofocus>
+  <div id="pw" class="hidden"><input id="password" type="password" name="passwd"></div>
+  <div id="stay" class="hidden"></div>
+</div>
+
+<div id="app" class="%(app_class)s">
+  <div id="startup" role="dialog" class="%(popup_class)s"><span>Welcome</span><button title="Close" onclick="hide('startup')">x</button></div>
+  <button title="Favorites" onclick="show('favs')">*</button>
+  <div id="favs" class="hidden"><a href="#" onclick="openExport(); return false;">Export Invoice (Bulk)</a></div>
+
+  <div id="export" class="hidden">
+    <button onclick="show('menu')">Report</button>
+    <div id="menu" class="hidden"><div onclick="step(openForm)">Purchase Order Form</div></div>
+    <div id="form" class="hidden"><input role="textbox" id="invoice"><button onclick="step(openDialog)">Apply</button></div>
+    <div id="panel" class="hidden"><button id="download"><span>OK</span></button></div>
+    <div id="done" role="alertdialog" class="hidden"><span>Operation completed</span><button id="close-done" onclick="hide('done')">Close</button></div>
+  </div>
+</div>
+
+<script>
+const CFG = %(config)s;
+const $ = (id) => document.getElementById(id);
+const show = (id) => $(id).classList.remove('hidden');
+const hide = (id) => $(id).classList.add('hidden');
+
+// Every step shows the loading overlay for ui_latency seconds (plus jitter)
+function step(fn) {
+  show('overlay');
+  const delay = CFG.ui_latency * 1000 * (1 + Math.random() * CFG.jitter);
+  setTimeout(() => { hide('overlay'); fn(); }, delay);
+}
+function openExport() { hide('favs'); step(() => show('export')); }
+function openForm() {
+  hide('menu');
+  $('invoice').value = '';
+  show('form');
+}
+function closeDialog() {
+  const dialog = $('dialog');
+  if (dialog) dialog.remove();
+}
+function openDialog() {
+  hide('form');
+  closeDialog();
+  // Failure injection: the dialog sometimes never shows up
+  if (Math.random() < CFG.ui_fail_rate) return;
+  const dialog = document.createElement('div');
+  dialog.id = 'dialog';
+  dialog.setAttribute('role', 'dialog');
+  dialog.innerHTML = '<label>Name</label><input id="filename"><button name="DialogOK">OK</button>';
+  dialog.querySelector('button').onclick = () => step(openDownload);
+  $('panel').before(dialog);
+}
+function openDownload() { closeDialog(); show('panel'); }
+
+$('download').onclick = () => {
+  hide('panel');
+  const a = document.createElement('a');
+  a.href = '/download?invoice=' + encodeURIComponent($('invoice').value);
+  a.download = '';
+  document.body.appendChild(a);
+  a.click();
+  a.remove();
+  step(() => { show('done'); $('close-done').focus(); });
+};
+
+// Login: email -> password -> "Stay signed in?"
+$('email').addEventListener('keydown', (e) => {
+  if (e.key !== 'Enter') return;
+  step(() => { show('pw'); $('password').focus(); });
+});
+$('password').addEventListener('keydown', (e) => {
+  if (e.key !== 'Enter') return;
+  show('overlay');
+  fetch('/login', { method: 'POST', body: JSON.stringify({ username: $('email').value, password: $('password').value }) })
+    .then((r) => {
+      hide('overlay');
+      if (!r.ok) return;
+      // Added only now, like the real page: the bot waits for it to appear
+      hide('pw');
+      $('stay').innerHTML = '<span>Stay signed in?</span><button id="idSIButton9">Yes</button>';
+      show('stay');
+      $('idSIButton9').onclick = () => { window.location = '/'; };
+      $('idSIButton9').focus();
+    });
+});
+</script>
+</body></html>
+"""
+
+
+class FakeErp:
+    """
+    Local stand-in for the D365 pages the bot drives, for benchmarks without the real ERP.
+    Latencies are in seconds; fail rates are probabilities (0..1).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, username='bot', password='bot',
+                 ui_latency=0.2, download_latency=0.3, login_latency=0.5, jitter=0.5,
+                 ui_fail_rate=0.0, download_fail_rate=0.0, startup_popup=True, file_size=100 * 1024):
+        self.username = username
+        self.password = password
+        self.config = {'ui_latency': ui_latency, 'jitter': jitter, 'ui_fail_rate': ui_fail_rate}
+        self.download_latency = download_latency
+        self.login_latency = login_latency
+        self.download_fail_rate = download_fail_rate
+        self.startup_popup = startup_popup
+        self.file_size = file_size
+        self.sessions = set()
+        self.stats = {'logins': 0, 'downloads': 0, 'download_failures': 0, 'exports': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def open_session(self):
+        """A signed-in session cookie value, as the browser gets it after the login page."""
+        token = secrets.token_hex(16)
+        with self._lock:
+            self.sessions.add(token)
+        return token
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _file(self, invoice):
+        return b'%PDF-1.4\n% ' + invoice.encode() + b'\n' + b'0' * max(0, self.file_size - 32)
+
+    def _handler(self):
+        erp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _signed_in(self):
+                for part in self.headers.get('Cookie', '').split(';'):
+                    name, _, value = part.strip().partition('=')
+                    if name == SESSION_COOKIE and value in erp.sessions: return True
+                return False
+
+            def _send(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_invoice(self, invoice):
+                time.sleep(erp.download_latency)
+                if random.random() < erp.download_fail_rate:
+                    erp._count('download_failures')
+                    self._send(500, b'Report server error', 'text/plain')
+                    return
+                self._send(200, erp._file(invoice), 'application/pdf', {
+                    'Content-Disposition': f'attachment; filename="PO_{invoice}.pdf"',
+                })
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                invoice = query.get('invoice', [''])[0]
+
+                if url.path == '/':
+                    signed_in = self._signed_in()
+                    page = PAGE % {
+                        'login_class': 'hidden' if signed_in else '',
+                        'app_class': '' if signed_in else 'hidden',
+                        'popup_class': '' if erp.startup_popup else 'hidden',
+                        'config': json.dumps(erp.config),
+                    }
+                    self._send(200, page.encode(), 'text/html; charset=utf-8')
+                elif url.path == '/download' and self._signed_in():
+                    erp._count('downloads')
+                    self._send_invoice(invoice)
+                elif url.path == '/report/po_form':
+                    # Direct export endpoint for the HTTP fast path (same session cookie)
+                    if not self._signed_in():
+                        self._send(200, b'<html>Sign in</html>', 'text/html')
+                        return
+                    erp._count('exports')
+                    self._send_invoice(invoice)
+                elif url.path == '/stats':
+                    self._send(200, json.dumps(erp.stats).encode(), 'application/json')
+                else:
+                    self._send(404, b'Not found', 'text/plain')
+
+            def do_POST(self):
+                if urlparse(self.path).path != '/login':
+                    self._send(404, b'Not found', 'text/plain')
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    data = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    data = {}
+                time.sleep(erp.login_latency)
+                if data.get('username') != erp.username or data.get('password') != erp.password:
+                    self._send(401, b'Bad credentials', 'text/plain')
+                    return
+                token = erp.open_session()
+                erp._count('logins')
+                self._send(200, b'ok', 'text/plain', {'Set-Cookie': f'{SESSION_COOKIE}={token}; Path=/'})
+
+        return Handler
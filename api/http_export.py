@@ -0,0 +1,142 @@
+import os
+import re
+import time
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
+
+# Responses that mean "not a file": usually the login page after the session expired
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+FILENAME_RE = re.compile(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', re.IGNORECASE)
+UNSAFE_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|]')
+
+
+class ExportError(Exception):
+    pass
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads (rate <= 0: no limit)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval: return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now: time.sleep(slot - now)
+
+
+class HttpExporter:
+    """
+    Downloads invoice reports straight from the ERP export endpoint, reusing the
+    cookies of a logged-in Selenium session instead of clicking through the
+    Report -> Purchase Order Form dialog for every invoice.
+
+    url_template / data_template use '{invoice}' as placeholder, e.g.
+    'https://erp.example.com/report/po_form?invoice={invoice}&format=pdf'.
+    """
+
+    def __init__(self, url_template, method='GET', data_template=None, max_workers=4, rate=5, timeout=60):
+        self.url_template = url_template
+        self.method = (method or 'GET').upper()
+        self.data_template = data_template or None
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.limiter = RateLimiter(float(rate or 0))
+
+        # One keep-alive pool shared by the export threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def load_cookies(self, driver):
+        """Copies the browser's session (cookies and user agent) into the HTTP client."""
+        for cookie in driver.get_cookies():
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        try:
+            self.session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent")
+        except Exception:
+            pass
+
+    def _request(self, invoice):
+        value = quote(str(invoice), safe='')
+        url = self.url_template.replace('{invoice}', value)
+        data = None
+        if self.data_template:
+            data = {k: str(v).replace('{invoice}', str(invoice)) for k, v in self.data_template.items()}
+        self.limiter.wait()
+        return self.session.request(self.method, url, data=data, timeout=self.timeout, stream=True)
+
+    def fetch(self, invoice, dest_dir):
+        """Downloads one invoice report into dest_dir as <invoice><ext>. Returns the file path."""
+        response = self._request(invoice)
+        try:
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if response.status_code != 200:
+                raise ExportError(f"HTTP {response.status_code}")
+            if content_type in HTML_TYPES:
+                raise ExportError("Got a web page instead of a file (session expired?)")
+
+            match = FILENAME_RE.search(response.headers.get('Content-Disposition', ''))
+            extension = os.path.splitext(match.group(1))[1] if match else ''
+            extension = extension or mimetypes.guess_extension(content_type) or '.pdf'
+
+            name = UNSAFE_FILENAME_CHARS.sub('_', str(invoice))
+            path = os.path.join(dest_dir, f"{name}{extension}")
+            if os.path.exists(path):
+                path = os.path.join(dest_dir, f"{name}_{int(time.time() * 1000)}{extension}")
+            part = f"{path}.part"
+            size = 0
+            with open(part, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=256 * 1024):
+                    f.write(chunk)
+                    size += len(chunk)
+            if not size:
+                os.remove(part)
+                raise ExportError("Empty file")
+            os.replace(part, path)
+            return path
+        finally:
+            response.close()
+
+    def export_all(self, jobs, dest_dir, on_done, on_failed=None, should_stop=None):
+        """
+        Fetches every (index, invoice) concurrently. on_done(index, path) runs for each
+        file; failures go to on_failed(index, error) and are left for the UI flow.
+        Returns the indexes that failed or were skipped (stop requested, or the
+        endpoint does not work at all: the first few requests all failed).
+        """
+        failed = []
+        done = [0]
+        lock = threading.Lock()
+
+        def work(job):
+            index, invoice = job
+            with lock:
+                give_up = not done[0] and len(failed) >= 5
+            if give_up or (should_stop and should_stop()):
+                with lock: failed.append(index)
+                return
+            try:
+                on_done(index, self.fetch(invoice, dest_dir))
+                with lock: done[0] += 1
+            except Exception as e:
+                with lock: failed.append(index)
+                if on_failed: on_failed(index, e)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            list(pool.map(work, jobs))
+        return sorted(failed)
+
+    def close(self):
+        self.session.close()
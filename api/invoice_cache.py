@@ -0,0 +1,104 @@
+import os
+import shutil
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from .delivery import file_digest, fast_copy
+
+
+class InvoiceCache:
+    """
+    Invoice reports fetched by earlier runs, keyed by (invoice number, report type).
+    Files are stored once per content hash: <root>/<sha[:2]>/<sha>, so the same report
+    reached under several keys takes the space of one. Entries older than max_age_days
+    count as misses and are fetched again; past max_mb the least recently used entries
+    are evicted.
+    """
+
+    def __init__(self, root=None, max_mb=None, max_age_days=None):
+        self.root = root or settings.BOT_INVOICE_CACHE_DIR
+        self.max_bytes = int((max_mb if max_mb is not None else settings.BOT_INVOICE_CACHE_MAX_MB) * 1024 * 1024)
+        self.max_age = timedelta(days=max_age_days if max_age_days is not None else settings.BOT_INVOICE_CACHE_MAX_AGE_DAYS)
+        self._lock = threading.Lock()
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def lookup_many(self, invoice_numbers, report_type):
+        """{invoice_number: entry} of the fresh entries among invoice_numbers (one query)."""
+        from .models import CachedInvoiceFile
+        entries = CachedInvoiceFile.objects.filter(invoice_number__in=set(invoice_numbers), report_type=report_type)
+        if self.max_age:
+            entries = entries.filter(fetched_at__gte=timezone.now() - self.max_age)
+        return {e.invoice_number: e for e in entries if os.path.exists(self._blob_path(e.sha256))}
+
+    def materialize(self, entry, dest_dir):
+        """Copies a cached file into dest_dir under its original name. Returns the path, or None if the file is gone."""
+        from .models import CachedInvoiceFile
+        dest = os.path.join(dest_dir, entry.file_name)
+        if os.path.exists(dest):
+            base, extension = os.path.splitext(entry.file_name)
+            dest = os.path.join(dest_dir, f"{base}_{entry.id}{extension}")
+        try:
+            fast_copy(self._blob_path(entry.sha256), dest)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            return None
+        CachedInvoiceFile.objects.filter(pk=entry.pk).update(last_used_at=timezone.now(), hits=F('hits') + 1)
+        return dest
+
+    def put(self, invoice_number, report_type, path):
+        """Stores a freshly downloaded file (the original stays where it is)."""
+        from .models import CachedInvoiceFile
+        sha256 = file_digest(path)
+        size = os.path.getsize(path)
+        blob = self._blob_path(sha256)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            # Written under a temporary name: readers never see a half-copied file
+            part = f"{blob}.{os.getpid()}.{threading.get_ident()}.part"
+            fast_copy(path, part)
+            os.replace(part, blob)
+
+        now = timezone.now()
+        values = {'sha256': sha256, 'size': size, 'file_name': os.path.basename(path), 'fetched_at': now, 'last_used_at': now}
+        try:
+            CachedInvoiceFile.objects.update_or_create(invoice_number=invoice_number, report_type=report_type, defaults=values)
+        except IntegrityError:
+            # Another worker stored the same invoice at the same moment
+            CachedInvoiceFile.objects.filter(invoice_number=invoice_number, report_type=report_type).update(**values)
+
+    def total_bytes(self):
+        """Space used on disk (each distinct file counted once)."""
+        from .models import CachedInvoiceFile
+        return sum(dict(CachedInvoiceFile.objects.values_list('sha256', 'size')).values())
+
+    def evict(self):
+        """Drops the least recently used entries until the store fits in max_bytes. Returns how many were dropped."""
+        from .models import CachedInvoiceFile
+        if not self.max_bytes: return 0
+        with self._lock:
+            total = self.total_bytes()
+            if total <= self.max_bytes: return 0
+
+            removed = 0
+            for entry in CachedInvoiceFile.objects.order_by('last_used_at').only('id', 'sha256', 'size'):
+                if total <= self.max_bytes: break
+                entry.delete()
+                removed += 1
+                # The file goes once no other invoice points at it
+                if not CachedInvoiceFile.objects.filter(sha256=entry.sha256).exists():
+                    try:
+                        os.remove(self._blob_path(entry.sha256))
+                    except FileNotFoundError:
+                        pass
+                    total -= entry.size
+            return removed
+
+    def clear(self):
+        from .models import CachedInvoiceFile
+        CachedInvoiceFile.objects.all().delete()
+        shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,139 @@
+import time
+from selenium.common.exceptions import (
+    TimeoutException, StaleElementReferenceException, ElementClickInterceptedException,
+    ElementNotInteractableException, InvalidSessionIdException, NoSuchWindowException, WebDriverException,
+)
+
+# States of one invoice, in order. Each step moves the page into the next state.
+MENU_OPEN = 'menu_open'                     # Report menu expanded
+FORM_OPEN = 'form_open'                     # Purchase Order Form shows the invoice input
+INVOICE_ENTERED = 'invoice_entered'         # Invoice applied, Name dialog shown
+DIALOG_FILLED = 'dialog_filled'             # Name dialog confirmed, download button shown
+DOWNLOAD_TRIGGERED = 'download_triggered'   # Chrome started writing the file
+CAPTURED = 'captured'                       # Success popup closed; the watcher finishes the file
+
+# Error classes, each with its own backoff and recovery
+TRANSIENT = 'transient'     # Overlay or element still loading: wait and retry the step
+STALE = 'stale'             # Element replaced or covered while clicking: retry almost at once
+DOWNLOAD = 'download'       # Download did not start: check the folder again before re-triggering
+SESSION = 'session'         # Signed out or browser gone: start over, re-login if it keeps happening
+
+# (first delay, max delay) in seconds; doubles with every failure of the same invoice
+BACKOFF = {
+    TRANSIENT: (0.5, 4.0),
+    STALE: (0.1, 1.0),
+    DOWNLOAD: (1.0, 5.0),
+    SESSION: (2.0, 10.0),
+}
+
+
+class DownloadNotStarted(Exception):
+    pass
+
+
+class SessionLost(Exception):
+    pass
+
+
+class FlowFailed(Exception):
+    """All attempts of one invoice failed. Keeps the state it got stuck in."""
+
+    def __init__(self, state, error_class, error):
+        super().__init__(f"stuck before {state} ({error_class}): {error}")
+        self.state = state
+        self.error_class = error_class
+
+
+def classify_error(error):
+    if isinstance(error, (SessionLost, InvalidSessionIdException, NoSuchWindowException)): return SESSION
+    if isinstance(error, DownloadNotStarted): return DOWNLOAD
+    if isinstance(error, (StaleElementReferenceException, ElementClickInterceptedException, ElementNotInteractableException)): return STALE
+    if isinstance(error, TimeoutException): return TRANSIENT
+    if isinstance(error, WebDriverException) and 'disconnected' in str(error).lower(): return SESSION
+    return TRANSIENT
+
+
+def backoff(error_class, failures):
+    first, cap = BACKOFF.get(error_class, BACKOFF[TRANSIENT])
+    return min(cap, first * (2 ** (failures - 1)))
+
+
+class Step:
+    """
+    run() moves the page into `state`. holds() tells whether the page is still in that
+    state after a later step failed, so a retry can continue from there.
+    """
+
+    def __init__(self, state, run, holds=None):
+        self.state = state
+        self.run = run
+        self.holds = holds
+
+
+class CircuitBreaker:
+    """Counts consecutive session failures of one browser; trips at `threshold`."""
+
+    def __init__(self, threshold=3):
+        self.threshold = threshold
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        return self.failures >= self.threshold
+
+    def success(self):
+        self.failures = 0
+
+
+class InvoiceFlow:
+    """
+    Runs the steps of one invoice. After a failure it waits by error class, then resumes
+    from the last state that still holds on the page instead of starting from the menu.
+    on_failure(error_class, error) may recover (e.g. re-login) and returns the class to use.
+    """
+
+    def __init__(self, steps, max_failures=3, on_failure=None, should_stop=None, is_done=None, sleep=time.sleep):
+        self.steps = steps
+        self.max_failures = max_failures
+        self.on_failure = on_failure
+        self.should_stop = should_stop
+        # Checked before every step: the file of an earlier attempt may have landed meanwhile
+        self.is_done = is_done
+        self.sleep = sleep
+        self.state = None
+        self.errors = []
+
+    def run(self):
+        """True when every step ran (or the file is already there), False if stopped. Raises FlowFailed after max_failures."""
+        reached = -1
+        while reached < len(self.steps) - 1:
+            if self.should_stop and self.should_stop(): return False
+            if self.is_done and self.is_done(): return True
+            step = self.steps[reached + 1]
+            try:
+                step.run()
+            except Exception as e:
+                error_class = classify_error(e)
+                if self.on_failure: error_class = self.on_failure(error_class, e) or error_class
+                self.errors.append((step.state, error_class, str(e).split('\n')[0]))
+                if len(self.errors) >= self.max_failures: raise FlowFailed(step.state, error_class, e)
+                self.sleep(backoff(error_class, len(self.errors)))
+                reached = self._resume_point(-1 if error_class == SESSION else reached)
+                continue
+            reached += 1
+            self.state = step.state
+        return True
+
+    def _resume_point(self, reached):
+        """Index of the last completed step whose state still holds, -1 to start over."""
+        while reached >= 0:
+            holds = self.steps[reached].holds
+            try:
+                if holds is None or holds():
+                    self.state = self.steps[reached].state
+                    return reached
+            except Exception:
+                pass
+            reached -= 1
+        self.state = None
+        return -1
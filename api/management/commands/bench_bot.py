@@ -0,0 +1,125 @@
+import time
+import shutil
+import tempfile
+import threading
+import statistics
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from api.models import User, OrderImport, InvoiceItem
+from api.bot import AutoDownloadBot
+from api.fake_erp import FakeErp
+from api.scheduler import process_memory_mb
+
+
+class MemorySampler:
+    """Peak RSS of this process and its Chrome children while a benchmark level runs."""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, process_memory_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+
+
+class Command(BaseCommand):
+    help = "End-to-end bot throughput against the local fake ERP, for 1..N concurrent bots."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bots', type=int, nargs='+', default=[1, 2, 4], help="Concurrent bot counts to measure")
+        parser.add_argument('--invoices', type=int, default=20, help="Invoices per bot")
+        parser.add_argument('--profile', default='lean', choices=['standard', 'lean'])
+        parser.add_argument('--ui-latency', type=float, default=0.2)
+        parser.add_argument('--download-latency', type=float, default=0.3)
+        parser.add_argument('--ui-fail-rate', type=float, default=0.0)
+        parser.add_argument('--download-fail-rate', type=float, default=0.0)
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark orders and files")
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench_bot', defaults={'email': 'bench_bot@localhost', 'role': 'guest'})
+        erp = FakeErp(
+            ui_latency=options['ui_latency'],
+            download_latency=options['download_latency'],
+            ui_fail_rate=options['ui_fail_rate'],
+            download_fail_rate=options['download_fail_rate'],
+        ).start()
+        config = {
+            'target_url': erp.url,
+            'username': erp.username,
+            'password': erp.password,
+            'browser_profile': options['profile'],
+            'headless': True,
+            'use_session_pool': False,
+            'save_zip_backup': False,
+            # Every invoice from the fake ERP, never from files of earlier runs
+            'use_invoice_cache': False,
+            'download_timeout': 30,
+        }
+        self.stdout.write(
+            f"Fake ERP {erp.url}: ui {options['ui_latency']}s, download {options['download_latency']}s, "
+            f"failures ui {options['ui_fail_rate']:.0%} / download {options['download_fail_rate']:.0%}, profile {options['profile']}"
+        )
+
+        # Uploads, temp folders and archives go to a throwaway local MEDIA_ROOT, never to S3
+        media_root = tempfile.mkdtemp(prefix='bench_bot_media_')
+        storages = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'}}
+        orders = []
+        try:
+            with override_settings(MEDIA_ROOT=media_root, STORAGES=storages):
+                for bots in options['bots']:
+                    self._run_level(bots, options['invoices'], config, user, orders)
+        finally:
+            erp.stop()
+            if options['keep']:
+                self.stdout.write(f"Kept {len(orders)} benchmark orders, files in {media_root}")
+            else:
+                OrderImport.objects.filter(pk__in=[order.pk for order in orders]).delete()
+                shutil.rmtree(media_root, ignore_errors=True)
+        self.stdout.write(f"Fake ERP counters: {erp.stats}")
+
+    def _run_level(self, bots, invoices, config, user, orders):
+        level = []
+        for n in range(bots):
+            order = OrderImport(uploaded_by=user, folder_name='bench', bot_status='idle')
+            order.file.save(f"bench_{n}.xlsx", ContentFile(b''), save=False)
+            order.save()
+            orders.append(order)
+            level.append(order)
+            InvoiceItem.objects.bulk_create([
+                InvoiceItem(order=order, row=row, invoice_number=f"B{order.id}-{row:04d}") for row in range(invoices)
+            ])
+
+        runs = [AutoDownloadBot(order, dict(config)) for order in level]
+        threads = [threading.Thread(target=bot.run_sync) for bot in runs]
+        t0 = time.perf_counter()
+        with MemorySampler() as memory:
+            for t in threads: t.start()
+            for t in threads: t.join()
+        elapsed = time.perf_counter() - t0
+
+        durations = [d for bot in runs for d in bot.timer.as_dict().get('invoice', [])]
+        done = InvoiceItem.objects.filter(order__in=level, status='completed').count()
+        total = bots * invoices
+        if durations:
+            p50 = statistics.median(durations)
+            p95 = statistics.quantiles(durations, n=20)[-1] if len(durations) >= 2 else durations[0]
+            latency = f"p50 {p50:.2f}s, p95 {p95:.2f}s"
+        else:
+            latency = "no invoice finished"
+        self.stdout.write(
+            f"bots={bots:>2}: {done}/{total} invoices in {elapsed:.1f}s = {done / elapsed * 60:.0f} invoices/min, "
+            f"{latency}, peak memory {memory.peak:.0f} MB"
+        )
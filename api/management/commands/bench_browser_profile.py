@@ -0,0 +1,102 @@
+import time
+import tempfile
+import threading
+import statistics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from django.core.management.base import BaseCommand
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service as ChromeService
+from api.browser import BROWSER_PROFILES, build_chrome_options, block_heavy_resources, driver_resolver
+
+# A page shaped like the ERP list: a table, icons, a web font and a banner image
+PAGE = b"""<html><head><style>
+@font-face { font-family: Erp; src: url('/static/erp.woff2'); }
+body { font-family: Erp, sans-serif; }
+</style></head><body>
+<img src="/static/banner.jpg" width="1200" height="200">
+<table>%s</table>
+</body></html>"""
+ROW = b'<tr><td><img src="/static/icon_%d.png"></td><td>INV%05d</td><td>Purchase Order Form</td></tr>'
+
+
+def make_page_server(asset_latency):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith('/static/'):
+                time.sleep(asset_latency)
+                body = b'\0' * 64 * 1024
+                content_type = 'application/octet-stream'
+            else:
+                body = PAGE % b''.join(ROW % (n, n) for n in range(60))
+                content_type = 'text/html'
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+
+def browser_memory_mb(service):
+    """RSS of chromedriver and every Chrome process under it, in MB."""
+    import psutil
+    root = psutil.Process(service.process.pid)
+    total = 0
+    for process in [root] + root.children(recursive=True):
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / (1024 * 1024)
+
+
+class Command(BaseCommand):
+    help = "Compares browser profiles (memory and per-page latency) on a local ERP-like page."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=30, help="Page loads per profile (one per simulated invoice)")
+        parser.add_argument('--asset-latency', type=float, default=0.02, help="Seconds per image/font request")
+        parser.add_argument('--profiles', nargs='+', default=list(BROWSER_PROFILES), choices=BROWSER_PROFILES)
+        parser.add_argument(
+            '--headless', action='store_true',
+            help="Run 'standard' headless too (hosts without a display). Off by default: the bot runs it headed and maximized",
+        )
+
+    def handle(self, *args, **options):
+        server = make_page_server(options['asset_latency'])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/invoice"
+        driver_path = driver_resolver.resolve()
+
+        try:
+            for profile in options['profiles']:
+                # Same options the bot builds today: 'standard' headed and maximized, 'lean' always headless
+                chrome_options = build_chrome_options(tempfile.mkdtemp(prefix='bench_dl_'), profile, headless=options['headless'])
+                service = ChromeService(executable_path=driver_path)
+                t0 = time.perf_counter()
+                driver = webdriver.Chrome(service=service, options=chrome_options)
+                startup = time.perf_counter() - t0
+                try:
+                    if profile == 'lean': block_heavy_resources(driver)
+                    latencies = []
+                    peak = 0
+                    for n in range(options['pages']):
+                        t0 = time.perf_counter()
+                        driver.get(f"{url}?n={n}")
+                        latencies.append(time.perf_counter() - t0)
+                        peak = max(peak, browser_memory_mb(service))
+                    p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) >= 2 else latencies[0]
+                    mode = 'headless' if profile == 'lean' or options['headless'] else 'headed'
+                    self.stdout.write(
+                        f"{profile:>8} ({mode}): startup {startup:.2f}s, page p50 {statistics.median(latencies) * 1000:.0f} ms, "
+                        f"p95 {p95 * 1000:.0f} ms, RSS now {browser_memory_mb(service):.0f} MB, peak {peak:.0f} MB"
+                    )
+                finally:
+                    driver.quit()
+        finally:
+            server.shutdown()
@@ -0,0 +1,77 @@
+import time
+import shutil
+import tempfile
+import threading
+import statistics
+from urllib.parse import urlparse
+from django.core.management.base import BaseCommand
+from api.fake_erp import FakeErp, SESSION_COOKIE
+from api.http_export import HttpExporter
+
+
+class FakeDriver:
+    """Just enough of a WebDriver for HttpExporter.load_cookies."""
+
+    def __init__(self, url, session_id):
+        self.host = urlparse(url).hostname
+        self.session_id = session_id
+
+    def get_cookies(self):
+        return [{'name': SESSION_COOKIE, 'value': self.session_id, 'domain': self.host, 'path': '/'}]
+
+    def execute_script(self, script):
+        return 'Mozilla/5.0 (bench)'
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the HTTP export fast path against the export endpoint of the local fake ERP."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=100)
+        parser.add_argument('--latency', type=float, default=0.2, help="Server time per export, in seconds")
+        parser.add_argument('--size', type=int, default=200 * 1024, help="Bytes per exported file")
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+        parser.add_argument('--rate', type=float, default=0, help="Requests per second cap (0 = none)")
+
+    def handle(self, *args, **options):
+        erp = FakeErp(download_latency=options['latency'], file_size=options['size']).start()
+        # Signed in as the bot's browser would be; the exporter borrows its cookie
+        driver = FakeDriver(erp.url, erp.open_session())
+        url = f"{erp.url}report/po_form?invoice={{invoice}}"
+        jobs = [(i, f"INV{i:05d}") for i in range(options['invoices'])]
+
+        self.stdout.write(f"{len(jobs)} invoices, {options['latency'] * 1000:.0f} ms server latency, rate cap {options['rate'] or 'none'}")
+        try:
+            for workers in options['workers']:
+                dest = tempfile.mkdtemp(prefix='bench_export_')
+                exporter = HttpExporter(url, max_workers=workers, rate=options['rate'])
+                exporter.load_cookies(driver)
+                durations = []
+                lock = threading.Lock()
+
+                # Per-invoice latency, measured from the moment the worker picked it up
+                fetch = exporter.fetch
+
+                def timed_fetch(invoice, dest_dir):
+                    t0 = time.perf_counter()
+                    try:
+                        return fetch(invoice, dest_dir)
+                    finally:
+                        with lock: durations.append(time.perf_counter() - t0)
+                exporter.fetch = timed_fetch
+
+                t0 = time.perf_counter()
+                failed = exporter.export_all(jobs, dest, on_done=lambda index, path: None)
+                elapsed = time.perf_counter() - t0
+                exporter.close()
+                shutil.rmtree(dest, ignore_errors=True)
+
+                ok = len(jobs) - len(failed)
+                p95 = statistics.quantiles(durations, n=20)[-1] if len(durations) >= 2 else durations[0]
+                self.stdout.write(
+                    f"workers={workers:>3}: {ok}/{len(jobs)} ok in {elapsed:.2f}s "
+                    f"({ok / elapsed * 60:.0f} invoices/min), p50 {statistics.median(durations) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms"
+                )
+        finally:
+            erp.stop()
+        self.stdout.write(f"Fake ERP counters: {erp.stats}")
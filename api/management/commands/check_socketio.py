@@ -0,0 +1,94 @@
+import os
+import time
+import asyncio
+import socketio
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from server.sio import make_client_manager, make_external_manager
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks that the Socket.IO client manager delivers across processes: two servers "
+        "(like two uvicorn workers) and a bot worker writer share one pub/sub channel."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manager', choices=['redis', 'fakeredis'], help="Default: SOCKETIO_CLIENT_MANAGER")
+        parser.add_argument('--url', help="Redis URL (default: SOCKETIO_REDIS_URL)")
+        parser.add_argument('--timeout', type=float, default=5)
+
+    def handle(self, *args, **options):
+        kind = options['manager'] or settings.SOCKETIO_CLIENT_MANAGER
+        if kind == 'memory':
+            raise CommandError("SOCKETIO_CLIENT_MANAGER is 'memory': events never leave the process. Use --manager redis or fakeredis.")
+        url = options['url'] or settings.SOCKETIO_REDIS_URL
+
+        if kind == 'fakeredis':
+            try:
+                import fakeredis  # noqa: F401
+            except ImportError:
+                raise CommandError("fakeredis is not installed (pip install fakeredis)")
+        else:
+            import redis
+            try:
+                redis.Redis.from_url(url, socket_connect_timeout=2).ping()
+            except redis.RedisError as e:
+                raise CommandError(f"Redis at {url} is not reachable: {e}")
+
+        # Own channel, so the check never reaches real clients
+        channel = f"socketio-check-{os.getpid()}"
+        failures = asyncio.run(self._check(kind, url, channel, options['timeout']))
+        if failures: raise CommandError(f"{len(failures)} checks failed: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS(f"Socket.IO over {kind}: all checks passed"))
+
+    async def _check(self, kind, url, channel, timeout):
+        servers = []
+        received = {}
+        for name in ('worker_a', 'worker_b'):
+            server = socketio.AsyncServer(async_mode='asgi', client_manager=make_client_manager(kind, url, channel))
+            received[name] = []
+
+            # Stands in for the engine.io transport: records what each client would get
+            async def capture(eio_sid, eio_pkt, name=name, server=server):
+                received[name].append(server.packet_class(encoded_packet=eio_pkt.data).data)
+            server._send_eio_packet = capture
+            servers.append(server)
+        worker_a, worker_b = servers
+
+        # One client on each server, in different rooms
+        sid_a = await worker_a.manager.connect('client-a', '/')
+        await worker_a.enter_room(sid_a, 'order:2')
+        sid_b = await worker_b.manager.connect('client-b', '/')
+        await worker_b.enter_room(sid_b, 'order:1')
+        for server in servers: server.manager.initialize()
+        await asyncio.sleep(0.5)    # Listeners subscribed
+
+        async def expect(label, target, event):
+            t0 = time.perf_counter()
+            while time.perf_counter() - t0 < timeout:
+                if event in received[target]:
+                    self.stdout.write(f"  OK   {label} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+                    return True
+                await asyncio.sleep(0.02)
+            self.stdout.write(f"  FAIL {label}")
+            return False
+
+        failures = []
+        event = ['bot_update', {'type': 'progress', 'order_id': 1, 'index': 0, 'status': 'completed'}]
+        await worker_a.emit(*event, to='order:1')
+        if not await expect("emit on worker A reaches a client on worker B", 'worker_b', event): failures.append('cross-worker')
+        if event in received['worker_a']:
+            self.stdout.write("  FAIL room targeting: the client of another order got the event")
+            failures.append('rooms')
+        else:
+            self.stdout.write("  OK   clients outside the room got nothing")
+
+        event = ['bot_update', {'type': 'status_change', 'order_id': 1, 'status': 'completed'}]
+        writer = make_external_manager(kind, url, channel)
+        await asyncio.to_thread(writer.emit, *event, to='order:1')
+        if not await expect("bot worker process (write-only) reaches worker B", 'worker_b', event): failures.append('bot-worker')
+
+        for server in servers:
+            if getattr(server.manager, 'thread', None): server.manager.thread.cancel()
+        return failures
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from api.fake_erp import FakeErp
+
+
+class Command(BaseCommand):
+    help = "Serves the local fake ERP (login, export page, report dialog, downloads) for manual bot runs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--ui-latency', type=float, default=0.2)
+        parser.add_argument('--download-latency', type=float, default=0.3)
+        parser.add_argument('--ui-fail-rate', type=float, default=0.0)
+        parser.add_argument('--download-fail-rate', type=float, default=0.0)
+
+    def handle(self, *args, **options):
+        erp = FakeErp(
+            port=options['port'],
+            ui_latency=options['ui_latency'],
+            download_latency=options['download_latency'],
+            ui_fail_rate=options['ui_fail_rate'],
+            download_fail_rate=options['download_fail_rate'],
+        ).start()
+        self.stdout.write(f"Fake ERP on {erp.url} (username '{erp.username}', password '{erp.password}'). Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            erp.stop()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from api.recovery import recover_interrupted_runs
+
+
+class Command(BaseCommand):
+    help = "Finds bot runs left 'running' by a crash, reattaches their downloaded files and queues them to resume."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only list the interrupted runs")
+
+    def handle(self, *args, **options):
+        results = recover_interrupted_runs(dry_run=options['dry_run'])
+        if not results:
+            self.stdout.write("No interrupted bot runs.")
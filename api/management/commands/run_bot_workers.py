@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.scheduler import BotScheduler, worker_mode_problems
+
+
+class Command(BaseCommand):
+    help = "Runs queued bot jobs in separate worker processes (keep this running next to the web server)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help="Bots running at the same time (default BOT_MAX_CONCURRENCY)")
+        parser.add_argument('--max-jobs', type=int, help="Recycle a worker after this many jobs (default BOT_WORKER_MAX_JOBS)")
+        parser.add_argument('--node', help="Name of this node in job leases (default BOT_NODE_NAME or the hostname)")
+        parser.add_argument('--max-rss-mb', type=int, help="Recycle a worker above this memory, Chrome included (default BOT_WORKER_MAX_RSS_MB)")
+
+    def handle(self, *args, **options):
+        if settings.BOT_RUN_MODE != 'workers':
+            raise CommandError(f"BOT_RUN_MODE is '{settings.BOT_RUN_MODE}': the web process runs the bot jobs itself.")
+        problems = worker_mode_problems()
+        if problems:
+            raise CommandError("Bot worker processes need Redis:\n  " + "\n  ".join(problems))
+        scheduler = BotScheduler(
+            concurrency=options['concurrency'],
+            max_jobs=options['max_jobs'],
+            max_rss_mb=options['max_rss_mb'],
+            node=options['node'],
+        )
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping bot workers...")
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_alter_destination_id_alter_forwarder_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.PositiveIntegerField()),
+                ('no', models.CharField(blank=True, default='', max_length=50)),
+                ('customer', models.CharField(blank=True, default='', max_length=255)),
+                ('invoice_number', models.CharField(max_length=100)),
+                ('destination', models.CharField(blank=True, default='', max_length=255)),
+                ('forwarder', models.CharField(blank=True, default='', max_length=255)),
+                ('qty', models.FloatField(default=0)),
+                ('amount', models.FloatField(default=0)),
+                ('eta', models.CharField(blank=True, default='', max_length=50)),
+                ('via', models.CharField(blank=True, default='', max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='api.orderimport')),
+            ],
+            options={
+                'ordering': ['row'],
+                'indexes': [models.Index(fields=['order', 'status'], name='api_invoice_order_i_3fbfce_idx'), models.Index(fields=['invoice_number'], name='api_invoice_invoice_b60785_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'row'), name='unique_invoice_item_row')],
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations
+
+
+def to_float(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def backfill_items(apps, schema_editor):
+    """Copies the parsed_data list of every existing order into InvoiceItem rows."""
+    OrderImport = apps.get_model('api', 'OrderImport')
+    InvoiceItem = apps.get_model('api', 'InvoiceItem')
+
+    for order in OrderImport.objects.filter(parsed_data__isnull=False).iterator():
+        # Failed imports store {"error": ...} instead of a list
+        if not isinstance(order.parsed_data, list): continue
+        if InvoiceItem.objects.filter(order=order).exists(): continue
+
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(
+                order=order,
+                row=row,
+                no=str(item.get('no', ''))[:50],
+                customer=str(item.get('customer', ''))[:255],
+                invoice_number=str(item.get('invoice_number', ''))[:100],
+                destination=str(item.get('destination', ''))[:255],
+                forwarder=str(item.get('forwarder', ''))[:255],
+                qty=to_float(item.get('qty')),
+                amount=to_float(item.get('amount')),
+                eta=str(item.get('eta', ''))[:50],
+                via=str(item.get('via', ''))[:100],
+                status=item.get('status') or 'pending',
+            )
+            for row, item in enumerate(order.parsed_data)
+        ], batch_size=500)
+
+        # The rows are now the source of truth
+        order.parsed_data = None
+        order.save(update_fields=['parsed_data'])
+
+
+def restore_parsed_data(apps, schema_editor):
+    OrderImport = apps.get_model('api', 'OrderImport')
+    InvoiceItem = apps.get_model('api', 'InvoiceItem')
+
+    for order in OrderImport.objects.filter(parsed_data__isnull=True).iterator():
+        items = InvoiceItem.objects.filter(order=order).order_by('row')
+        if not items.exists(): continue
+        order.parsed_data = [
+            {
+                "no": i.no, "customer": i.customer, "invoice_number": i.invoice_number,
+                "destination": i.destination, "forwarder": i.forwarder, "qty": i.qty,
+                "amount": i.amount, "eta": i.eta, "via": i.via, "status": i.status,
+            }
+            for i in items
+        ]
+        order.save(update_fields=['parsed_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_invoiceitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_items, restore_parsed_data),
+    ]
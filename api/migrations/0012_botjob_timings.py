@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_botjob_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='botjob',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
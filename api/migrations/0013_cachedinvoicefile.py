@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_botjob_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedInvoiceFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('invoice_number', models.CharField(max_length=100)),
+                ('report_type', models.CharField(default='po_form', max_length=50)),
+                ('sha256', models.CharField(max_length=64)),
+                ('size', models.BigIntegerField(default=0)),
+                ('file_name', models.CharField(max_length=255)),
+                ('fetched_at', models.DateTimeField()),
+                ('last_used_at', models.DateTimeField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_used_at'], name='api_cachedi_last_us_912fd6_idx'), models.Index(fields=['sha256'], name='api_cachedi_sha256_715d48_idx')],
+                'constraints': [models.UniqueConstraint(fields=('invoice_number', 'report_type'), name='unique_cached_invoice')],
+            },
+        ),
+    ]
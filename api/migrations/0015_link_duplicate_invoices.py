@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+def link_duplicates(apps, schema_editor):
+    """Same as InvoiceItem.link_duplicates, for the orders imported before the field existed."""
+    InvoiceItem = apps.get_model('api', 'InvoiceItem')
+
+    order_ids = InvoiceItem.objects.values_list('order_id', flat=True).distinct()
+    for order_id in order_ids.iterator():
+        first_row = {}
+        changed = []
+        for item in InvoiceItem.objects.filter(order_id=order_id).order_by('row').only('id', 'invoice_number'):
+            canonical = first_row.setdefault(item.invoice_number, item.id)
+            if canonical == item.id: continue
+            item.duplicate_of_id = canonical
+            changed.append(item)
+        InvoiceItem.objects.bulk_update(changed, ['duplicate_of'], batch_size=500)
+
+
+def unlink_duplicates(apps, schema_editor):
+    InvoiceItem = apps.get_model('api', 'InvoiceItem')
+    InvoiceItem.objects.filter(duplicate_of__isnull=False).update(duplicate_of=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_invoiceitem_duplicate_of'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_duplicates, unlink_duplicates),
+    ]
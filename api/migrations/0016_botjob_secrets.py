@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+def move_credentials(apps, schema_editor):
+    """Jobs queued before: credentials out of the clear-text config (kept encrypted only while the job may run)."""
+    from api.scheduler import split_secrets
+    BotJob = apps.get_model('api', 'BotJob')
+    for job in BotJob.objects.all().only('id', 'status', 'config'):
+        config, secrets = split_secrets(job.config)
+        if not secrets: continue
+        job.config = config
+        job.secrets = secrets if job.status in ('queued', 'running') else ''
+        job.save(update_fields=['config', 'secrets'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_link_duplicate_invoices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='botjob',
+            name='secrets',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(move_credentials, migrations.RunPython.noop),
+    ]
@@ -115,6 +115,172 @@ class OrderImport(models.Model):
     def __str__(self):
         return f"Order {self.id} - {self.uploaded_at}"
 
+
+class InvoiceItem(models.Model):
+    """One checklist line of an OrderImport (previously an entry of parsed_data)."""
+    order = models.ForeignKey(OrderImport, on_delete=models.CASCADE, related_name='items')
+    # Position in the checklist, used as the 'index' of bot progress events
+    row = models.PositiveIntegerField()
+
+    no = models.CharField(max_length=50, blank=True, default='')
+    customer = models.CharField(max_length=255, blank=True, default='')
+    invoice_number = models.CharField(max_length=100)
+    # Set when an earlier row of the same checklist has the same invoice number:
+    # the bot fetches the invoice once, for that row, and copies its status here
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='duplicates')
+    destination = models.CharField(max_length=255, blank=True, default='')
+    forwarder = models.CharField(max_length=255, blank=True, default='')
+    qty = models.FloatField(default=0)
+    amount = models.FloatField(default=0)
+    eta = models.CharField(max_length=50, blank=True, default='')
+    via = models.CharField(max_length=100, blank=True, default='')
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed')
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['row']
+        indexes = [
+            models.Index(fields=['order', 'status']),
+            models.Index(fields=['invoice_number']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'row'], name='unique_invoice_item_row'),
+        ]
+
+    def to_dict(self):
+        """Same shape as the old parsed_data entries, which the frontend still reads."""
+        return {
+            "id": self.id,
+            "no": self.no,
+            "customer": self.customer,
+            "invoice_number": self.invoice_number,
+            "destination": self.destination,
+            "forwarder": self.forwarder,
+            "qty": self.qty,
+            "amount": self.amount,
+            "eta": self.eta,
+            "via": self.via,
+            "status": self.status,
+            "duplicate_of": self.duplicate_of_id,
+        }
+
+    @classmethod
+    def link_duplicates(cls, order):
+        """Points every repeated invoice of an order at its first row. Returns how many rows are duplicates."""
+        first_row = {}
+        changed = []
+        duplicates = 0
+        for item in cls.objects.filter(order=order).order_by('row').only('id', 'invoice_number', 'duplicate_of'):
+            canonical = first_row.setdefault(item.invoice_number, item.id)
+            target = canonical if canonical != item.id else None
+            if target: duplicates += 1
+            if item.duplicate_of_id != target:
+                item.duplicate_of_id = target
+                changed.append(item)
+        cls.objects.bulk_update(changed, ['duplicate_of'], batch_size=500)
+        return duplicates
+
+    def __str__(self):
+        return f"{self.invoice_number} (Order {self.order_id})"
+
+
+class CachedInvoiceFile(models.Model):
+    """
+    An invoice report already fetched from the ERP, shared by every order (see api/invoice_cache.py).
+    The file itself lives once per content hash under BOT_INVOICE_CACHE_DIR.
+    """
+    invoice_number = models.CharField(max_length=100)
+    report_type = models.CharField(max_length=50, default='po_form')
+    sha256 = models.CharField(max_length=64)
+    size = models.BigIntegerField(default=0)
+    file_name = models.CharField(max_length=255)
+    fetched_at = models.DateTimeField()
+    last_used_at = models.DateTimeField()
+    hits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_used_at']),
+            models.Index(fields=['sha256']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['invoice_number', 'report_type'], name='unique_cached_invoice'),
+        ]
+
+    def __str__(self):
+        return f"{self.invoice_number} ({self.report_type})"
+
+
+class StepTiming(models.Model):
+    """
+    Cumulative histogram of one bot timing step since the first run, served by /api/metrics/.
+    Runs add to it when they finish (RunTimer.publish).
+    """
+    step = models.CharField(max_length=100, unique=True)
+    # Count of durations <= each bound of api.telemetry.DURATION_BUCKETS, cumulative like Prometheus
+    buckets = models.JSONField(default=list, blank=True)
+    count = models.BigIntegerField(default=0)
+    total_seconds = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.step} x{self.count}"
+
+
+class BotJob(models.Model):
+    """A queued bot run. Picked up by the worker processes of `manage.py run_bot_workers`."""
+    order = models.ForeignKey(OrderImport, on_delete=models.CASCADE, related_name='bot_jobs')
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    # Higher runs first; within a priority, users with fewer running jobs go first
+    priority = models.IntegerField(default=0)
+    # Run settings without the credentials; those are only kept encrypted in `secrets`
+    # while the job may still run (see api/scheduler.py split_secrets / job_config)
+    config = models.JSONField(default=dict, blank=True)
+    secrets = models.TextField(blank=True, default='')
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled')
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    worker_pid = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    # Lease of the worker running the job ("<node>:<pid>"), renewed by its heartbeat.
+    # Once it expires, any worker on any node may take the job over and resume it.
+    lease_owner = models.CharField(max_length=255, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+    # Timing spans of the run: {"login": [4.2], "invoice.menu": [0.8, 0.7, ...], ...} in seconds
+    timings = models.JSONField(default=dict, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-priority', 'created_at']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} - Order {self.order_id} ({self.status})"
+
 # class OrderImport(models.Model):
 #     file = models.FileField(upload_to='uploads/orders/')
 #     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -0,0 +1,150 @@
+import os
+import re
+import shutil
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+# Chrome/partial-copy leftovers that can never be completed after a crash
+PARTIAL_SUFFIXES = ('.crdownload', '.tmp', '.part')
+# Suffix added when two captured files had the same name (see DownloadCapture)
+COLLISION_SUFFIX = re.compile(r'_\d+$')
+
+
+def order_temp_dir(order_id):
+    """Same folder as AutoDownloadBot.download_dir."""
+    return os.path.join(settings.MEDIA_ROOT, 'temp', str(order_id))
+
+
+def _unique_path(folder, name):
+    base, extension = os.path.splitext(name)
+    path = os.path.join(folder, name)
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(folder, f"{base}_{n}{extension}")
+        n += 1
+    return path
+
+
+def gather_captured_files(download_dir):
+    """
+    Brings finished downloads from the worker folders up into download_dir and removes
+    what a crash leaves unusable: partial downloads, unnamed files still in the capture
+    folders and the unfinished archive.zip (it is rebuilt from the files).
+    Returns the file names now in download_dir.
+    """
+    if not os.path.isdir(download_dir): return []
+    for root, dirs, files in os.walk(download_dir, topdown=False):
+        in_capture = '.capture' in os.path.relpath(root, download_dir).split(os.sep)
+        for name in files:
+            path = os.path.join(root, name)
+            if in_capture or name.endswith(PARTIAL_SUFFIXES) or (root == download_dir and name == 'archive.zip'):
+                os.remove(path)
+            elif root != download_dir:
+                shutil.move(path, _unique_path(download_dir, name))
+        if root != download_dir:
+            shutil.rmtree(root, ignore_errors=True)
+    return sorted(name for name in os.listdir(download_dir) if os.path.isfile(os.path.join(download_dir, name)))
+
+
+def _captured_invoices(order):
+    """Invoice numbers whose file is in the order folder on this node (after gathering the worker folders)."""
+    names = set()
+    for file_name in gather_captured_files(order_temp_dir(order.id)):
+        stem = os.path.splitext(file_name)[0]
+        names.add(stem)
+        names.add(COLLISION_SUFFIX.sub('', stem))
+    return names
+
+
+def reattach_files(order):
+    """Marks the items whose invoice file is already on disk as completed. Returns how many were marked."""
+    from .models import InvoiceItem
+    names = _captured_invoices(order)
+    ids = [item.id for item in order.items.exclude(status='completed').only('id', 'invoice_number') if item.invoice_number in names]
+    if ids:
+        InvoiceItem.objects.filter(pk__in=ids).update(status='completed', updated_at=timezone.now())
+    return len(ids)
+
+
+def reconcile_items(order):
+    """
+    Lease takeover: the statuses written by the previous owner only count if its files are
+    here. Gathers what it captured on this node, keeps 'completed' only for invoices whose
+    file exists, resets the other completed or in-flight items to pending (their files are
+    on another node or were never finished) and marks found files completed.
+    Returns (completed, reset).
+    """
+    from .models import InvoiceItem
+    names = _captured_invoices(order)
+    completed, reset = [], []
+    for item in order.items.only('id', 'invoice_number', 'status'):
+        if item.invoice_number in names:
+            if item.status != 'completed': completed.append(item.id)
+        elif item.status in ('completed', 'processing'):
+            reset.append(item.id)
+    now = timezone.now()
+    if completed: InvoiceItem.objects.filter(pk__in=completed).update(status='completed', updated_at=now)
+    if reset: InvoiceItem.objects.filter(pk__in=reset).update(status='pending', updated_at=now)
+    return len(completed), len(reset)
+
+
+def stale_orders():
+    """Orders marked running/stopping that no queued job or live lease backs any more."""
+    from .models import OrderImport, BotJob
+    live = BotJob.objects.filter(
+        Q(status='queued') | Q(status='running', lease_expires_at__gte=timezone.now())
+    ).values('order_id')
+    return OrderImport.objects.filter(bot_status__in=('running', 'stopping')).exclude(pk__in=live)
+
+
+def recover_order(order, dry_run=False):
+    """Reattaches the files of one interrupted run and queues it to resume. Returns a short description."""
+    from .models import BotJob
+    job = order.bot_jobs.order_by('-created_at').first()
+    if dry_run:
+        files = os.listdir(order_temp_dir(order.id)) if os.path.isdir(order_temp_dir(order.id)) else []
+        return f"Order {order.id}: {order.bot_status}, {len(files)} entries on disk, last job {job.status if job else 'none'}"
+
+    marked = reattach_files(order)
+    now = timezone.now()
+
+    if order.bot_status == 'stopping':
+        # Stop was requested before the crash: honour it
+        if job and job.status == 'running':
+            BotJob.objects.filter(pk=job.pk).update(status='cancelled', finished_at=now, lease_expires_at=None, secrets='')
+        order.bot_status = 'cancelled'
+        order.bot_message = "Stopped by user."
+        action = "cancelled"
+    elif job and job.status == 'running' and job.lease_expires_at:
+        # Expired lease: the next free worker takes the job over by itself
+        order.bot_message = f"Interrupted, resuming ({marked} invoices recovered from disk)..."
+        action = "resumes on lease takeover"
+    elif job:
+        if job.status == 'running':
+            BotJob.objects.filter(pk=job.pk).update(status='queued', lease_owner='', lease_expires_at=None)
+        else:
+            # Credentials of an ended job are gone: the bot uses its defaults
+            BotJob.objects.create(order=order, requested_by=job.requested_by, config=job.config, secrets=job.secrets, priority=job.priority)
+        order.bot_message = f"Interrupted, queued to resume ({marked} invoices recovered from disk)..."
+        action = "requeued"
+    else:
+        # Started before the job queue existed: its settings (credentials) are gone
+        order.bot_status = 'failed'
+        order.bot_message = f"Interrupted by a restart ({marked} invoices recovered from disk). Run the bot again to finish."
+        action = "failed, needs a manual run"
+
+    order.save(update_fields=['bot_status', 'bot_message'])
+    return f"Order {order.id}: {marked} items reattached, {action}"
+
+
+def recover_interrupted_runs(dry_run=False):
+    """Startup pass over every stale run. Returns one line per recovered order."""
+    results = []
+    for order in stale_orders():
+        try:
+            results.append(recover_order(order, dry_run=dry_run))
+        except Exception as e:
+            results.append(f"Order {order.id}: recovery failed: {e}")
+    for line in results: print(f"[recovery] {line}")
+    return results
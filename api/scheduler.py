@@ -0,0 +1,421 @@
+import os
+import json
+import time
+import base64
+import socket
+import hashlib
+import threading
+import multiprocessing
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from .recovery import recover_interrupted_runs, reconcile_items
+
+ACTIVE_JOB_STATUSES = ('queued', 'running')
+# Run config keys that are credentials: never stored in clear text on a job
+SECRET_KEY_SUFFIXES = ('password', 'secret', 'token')
+
+
+# --- Credentials of queued jobs ---
+def _fernet():
+    from cryptography.fernet import Fernet
+    key = settings.BOT_SECRETS_KEY or settings.SECRET_KEY
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(key.encode('utf-8')).digest()))
+
+
+def split_secrets(config):
+    """Returns (config without credentials, encrypted credentials or '')."""
+    config = dict(config or {})
+    secrets = {key: config.pop(key) for key in list(config) if key.lower().endswith(SECRET_KEY_SUFFIXES)}
+    if not secrets: return config, ''
+    return config, _fernet().encrypt(json.dumps(secrets).encode('utf-8')).decode('ascii')
+
+
+def job_config(job):
+    """The config a bot runs with: the stored settings plus the decrypted credentials."""
+    config = dict(job.config or {})
+    if job.secrets:
+        from cryptography.fernet import InvalidToken
+        try:
+            config.update(json.loads(_fernet().decrypt(job.secrets.encode('ascii'))))
+        except (InvalidToken, ValueError):
+            # Key changed since the job was queued: the bot falls back to its default credentials
+            print(f"Job {job.id}: credentials could not be decrypted, using the defaults")
+    return config
+
+
+# --- Queue (used by the API) ---
+def enqueue(order, user=None, config=None, priority=0):
+    """Queues a bot run for order. Returns (job, created); an order has at most one active job."""
+    from .models import OrderImport, BotJob
+    with transaction.atomic():
+        # Row lock so two quick clicks cannot queue the same order twice
+        OrderImport.objects.select_for_update().filter(pk=order.pk).first()
+        existing = BotJob.objects.filter(order=order, status__in=ACTIVE_JOB_STATUSES).first()
+        if existing: return existing, False
+        config, secrets = split_secrets(config)
+        job = BotJob.objects.create(order=order, requested_by=user, config=config, secrets=secrets, priority=priority)
+    return job, True
+
+
+def cancel_queued(order):
+    """Cancels a job that no worker picked up yet. Returns True if there was one."""
+    from .models import BotJob
+    return BotJob.objects.filter(order=order, status='queued').update(status='cancelled', finished_at=timezone.now(), secrets='') > 0
+
+
+def worker_identity(node=None):
+    """Lease owner name of this process: '<node>:<pid>'."""
+    return f"{node or settings.BOT_NODE_NAME or socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next_job(owner, lease_seconds=None):
+    """
+    Takes the next runnable job: queued, or running under a lease that expired (its
+    worker died). Highest priority first, then the user with the fewest running jobs
+    (so one user's batch cannot starve the others), then the oldest.
+    The claim is a conditional update, so two workers never get the same job.
+    """
+    from .models import BotJob
+    lease_seconds = lease_seconds or settings.BOT_LEASE_SECONDS
+    now = timezone.now()
+    runnable = Q(status='queued') | Q(status='running', lease_expires_at__lt=now)
+
+    running = dict(
+        BotJob.objects.filter(status='running', lease_expires_at__gte=now)
+        .values_list('requested_by').annotate(n=Count('id')).order_by()
+    )
+    candidates = list(BotJob.objects.filter(runnable).order_by('-priority', 'created_at')[:50])
+    candidates.sort(key=lambda job: (-job.priority, running.get(job.requested_by_id, 0), job.created_at))
+
+    for job in candidates:
+        if job.status == 'running' and job.attempts >= settings.BOT_JOB_MAX_ATTEMPTS:
+            # Keeps killing its workers (crash, OOM): stop retrying it
+            _give_up(job, now)
+            continue
+        claimed = BotJob.objects.filter(pk=job.pk).filter(runnable).update(
+            status='running', lease_owner=owner, worker_pid=os.getpid(),
+            lease_expires_at=now + timedelta(seconds=lease_seconds), heartbeat_at=now,
+            started_at=job.started_at or now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            if job.status == 'running':
+                print(f"[{owner}] Lease of job {job.id} expired ({job.lease_owner}), resuming it.")
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _give_up(job, now):
+    from .models import BotJob
+    message = f"Error: bot worker lost {job.attempts} times"
+    if BotJob.objects.filter(pk=job.pk, status='running', lease_expires_at__lt=now).update(
+        status='failed', error=message, finished_at=now, lease_owner='', lease_expires_at=None, secrets=''
+    ):
+        order = job.order
+        order.bot_status = 'failed'
+        order.bot_message = message
+        order.save(update_fields=['bot_status', 'bot_message'])
+
+
+def renew_lease(job_id, owner, lease_seconds=None):
+    """Heartbeat. Returns False when the lease now belongs to another worker (or the job ended)."""
+    from .models import BotJob
+    now = timezone.now()
+    return BotJob.objects.filter(pk=job_id, status='running', lease_owner=owner).update(
+        lease_expires_at=now + timedelta(seconds=lease_seconds or settings.BOT_LEASE_SECONDS),
+        heartbeat_at=now,
+    ) > 0
+
+
+class LeaseKeeper:
+    """Renews a job's lease every `interval` seconds while its bot runs."""
+
+    def __init__(self, job_id, owner, on_lost, lease_seconds=None, interval=None):
+        self.job_id = job_id
+        self.owner = owner
+        self.on_lost = on_lost
+        self.lease_seconds = lease_seconds or settings.BOT_LEASE_SECONDS
+        self.interval = interval or settings.BOT_HEARTBEAT_INTERVAL
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=self.interval + 1)
+
+    def _loop(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    if renew_lease(self.job_id, self.owner, self.lease_seconds): continue
+                except Exception as e:
+                    # DB hiccup: the lease is still valid until it expires
+                    print(f"[{self.owner}] Heartbeat failed: {e}")
+                    continue
+                print(f"[{self.owner}] Lost the lease of job {self.job_id}")
+                self.on_lost()
+                break
+        finally:
+            connection.close()
+
+
+def run_job(job, owner):
+    """Runs one job to the end in this process and records its outcome."""
+    from .models import BotJob
+    from .bot import AutoDownloadBot
+    order = job.order
+    print(f"[{owner}] Job {job.id}: order {order.id} (attempt {job.attempts})")
+    bot = None
+    keeper = None
+    try:
+        if job.attempts > 1:
+            # Taken over: the previous owner's files may be on another node or in its worker folders
+            found, reset = reconcile_items(order)
+            print(f"[{owner}] Job {job.id}: {found} invoices found on disk, {reset} reset to pending")
+        bot = AutoDownloadBot(order, job_config(job))
+        # Checked before delivery and cleanup, so a run taken over meanwhile backs off
+        bot.lease_check = lambda: renew_lease(job.id, owner)
+        keeper = LeaseKeeper(job.id, owner, on_lost=bot.abandon).start()
+        bot.run_sync()
+        # Have a browser ready for the next job of this account
+        if settings.BOT_PREWARM_BROWSER: bot.prewarm()
+        order.refresh_from_db(fields=['bot_status', 'bot_message'])
+        status = order.bot_status if order.bot_status in ('completed', 'cancelled') else 'failed'
+        error = (order.bot_message or '') if status == 'failed' else ''
+    except Exception as e:
+        print(f"[{owner}] Job {job.id} crashed: {e}")
+        status, error = 'failed', str(e)
+        if not (bot and bot.abandoned):
+            order.bot_status = 'failed'
+            order.bot_message = f"Error: {e}"
+            order.save(update_fields=['bot_status', 'bot_message'])
+    finally:
+        if keeper: keeper.stop()
+    # Only the lease owner may close the job; the credentials are not needed any more
+    BotJob.objects.filter(pk=job.pk, lease_owner=owner).update(
+        status=status, error=error, finished_at=timezone.now(), lease_expires_at=None, secrets='',
+        timings=bot.timer.as_dict() if bot else {},
+    )
+    if bot:
+        try:
+            bot.timer.publish()
+        except Exception as e:
+            print(f"[{owner}] Could not publish the timings of job {job.id}: {e}")
+    return status
+
+
+def prewarm_spare_browser():
+    """
+    Runner or worker start: starts a spare browser for the account of the latest job, so the
+    first job after a (re)start skips the cold Chrome launch too. Later spares are started
+    after each job (run_job).
+    """
+    if not settings.BOT_PREWARM_BROWSER: return False
+    from .models import BotJob
+    from .bot import AutoDownloadBot
+    try:
+        job = BotJob.objects.select_related('order').order_by('-created_at').first()
+        if not job: return False
+        return AutoDownloadBot(job.order, job_config(job)).prewarm()
+    except Exception as e:
+        print(f"Could not pre-warm a browser: {e}")
+        return False
+
+
+def process_memory_mb():
+    """RSS of this process plus its children (the Chrome processes), in MB."""
+    import psutil
+    process = psutil.Process()
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / (1024 * 1024)
+
+
+# --- In-process runner (BOT_RUN_MODE='inprocess') ---
+class InProcessRunner:
+    """
+    Runs queued jobs on threads of the web process, for a single server without Redis:
+    its socket events reach the clients directly and stop_bot sets the bot's flag in
+    this process. Up to `concurrency` threads; each exits once the queue is empty, the
+    last one arranging a new kick for jobs still leased by a process that died.
+    """
+
+    def __init__(self, concurrency=None):
+        self.concurrency = int(concurrency or settings.BOT_MAX_CONCURRENCY)
+        self._threads = []
+        self._kicked = False
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._recheck = None
+
+    def kick(self):
+        """Called after a job is queued (and on startup): makes sure a thread will claim it."""
+        with self._lock:
+            self._kicked = True
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if len(self._threads) >= self.concurrency: return
+            self._counter += 1
+            thread = threading.Thread(target=self._loop, args=(f"{worker_identity()}/t{self._counter}",), name='bot-runner', daemon=True)
+            self._threads.append(thread)
+        thread.start()
+
+    def _loop(self, owner):
+        try:
+            while True:
+                with self._lock:
+                    self._kicked = False
+                job = claim_next_job(owner)
+                if job:
+                    run_job(job, owner)
+                    continue
+                with self._lock:
+                    # A job queued while this thread was looking is claimed on the next pass
+                    if self._kicked: continue
+                    self._threads.remove(threading.current_thread())
+                    last = not self._threads
+                if last: self._schedule_recheck()
+                return
+        except Exception as e:
+            print(f"[{owner}] Bot runner stopped: {e}")
+            with self._lock:
+                if threading.current_thread() in self._threads: self._threads.remove(threading.current_thread())
+        finally:
+            connection.close()
+
+
+    def _schedule_recheck(self):
+        """
+        Jobs still leased by another process (this server before a restart) cannot be claimed
+        until their lease expires: kick again right after the earliest one does.
+        """
+        from .models import BotJob
+        with self._lock:
+            if self._recheck and self._recheck.is_alive(): return
+        expires = (
+            BotJob.objects.filter(status='running', lease_expires_at__isnull=False)
+            .exclude(lease_owner__startswith=f"{worker_identity()}/")
+            .order_by('lease_expires_at').values_list('lease_expires_at', flat=True).first()
+        )
+        if expires is None: return
+        delay = max(0, (expires - timezone.now()).total_seconds()) + 1
+        with self._lock:
+            self._recheck = threading.Timer(delay, self.kick)
+            self._recheck.daemon = True
+            self._recheck.start()
+
+
+inprocess_runner = InProcessRunner()
+
+
+# --- Worker process ---
+def worker_mode_problems():
+    """Why worker processes would lose events or stop requests with the current settings ([] if none)."""
+    problems = []
+    if not settings.REDIS_URL:
+        problems.append("REDIS_URL is not set: stop requests would only reach the workers through the slow DB check")
+    if settings.SOCKETIO_CLIENT_MANAGER != 'redis':
+        problems.append(
+            f"SOCKETIO_CLIENT_MANAGER is '{settings.SOCKETIO_CLIENT_MANAGER}': progress events of worker "
+            "processes would never reach the clients of the web server"
+        )
+    return problems
+
+
+def worker_main(max_jobs, max_rss_mb, poll_interval, node=None):
+    """Entry point of one bot worker process. Exits after max_jobs jobs or above max_rss_mb, and gets replaced."""
+    import django
+    django.setup()
+    from server.sio import enable_worker_mode, emitter
+    from .browser import session_pool, driver_resolver
+    enable_worker_mode()
+
+    # Driver lookup once per process (pinned, offline after the first time), not per run
+    try:
+        driver_resolver.resolve()
+    except Exception as e:
+        print(f"chromedriver not resolved yet: {e}")
+    prewarm_spare_browser()
+
+    owner = worker_identity(node)
+    done = 0
+    try:
+        while done < max_jobs:
+            job = claim_next_job(owner)
+            if not job:
+                # Idle workers must not hold a DB connection open
+                connection.close()
+                time.sleep(poll_interval)
+                continue
+            run_job(job, owner)
+            done += 1
+            memory = process_memory_mb()
+            if max_rss_mb and memory > max_rss_mb:
+                print(f"[{owner}] Using {memory:.0f} MB (limit {max_rss_mb} MB), recycling.")
+                break
+        else:
+            print(f"[{owner}] Finished {done} jobs, recycling.")
+    finally:
+        session_pool.close_all()
+        # Events still queued for the clients (e.g. the last job's final status)
+        emitter.close()
+        connection.close()
+
+
+# --- Supervisor (manage.py run_bot_workers) ---
+class BotScheduler:
+    """Keeps `concurrency` worker processes alive; each runs one bot at a time."""
+
+    def __init__(self, concurrency=None, max_jobs=None, max_rss_mb=None, poll_interval=None, node=None):
+        self.node = node or settings.BOT_NODE_NAME or socket.gethostname()
+        self.concurrency = int(concurrency or settings.BOT_MAX_CONCURRENCY)
+        self.max_jobs = int(max_jobs or settings.BOT_WORKER_MAX_JOBS)
+        self.max_rss_mb = int(max_rss_mb if max_rss_mb is not None else settings.BOT_WORKER_MAX_RSS_MB)
+        self.poll_interval = float(poll_interval or settings.BOT_QUEUE_POLL_INTERVAL)
+        # spawn: a clean interpreter per worker (no inherited DB connections or threads)
+        self._ctx = multiprocessing.get_context('spawn')
+        self.workers = []
+
+    def _start_worker(self):
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(self.max_jobs, self.max_rss_mb, self.poll_interval, self.node),
+            name='bot-worker',
+        )
+        process.start()
+        print(f"Started bot worker {process.pid}")
+        self.workers.append(process)
+
+    def run(self):
+        print(f"Bot scheduler on {self.node}: {self.concurrency} workers, recycle after {self.max_jobs} jobs or {self.max_rss_mb} MB")
+        # Runs interrupted by a crash or restart are picked up again before anything new
+        recover_interrupted_runs()
+        connection.close()
+        try:
+            while True:
+                for process in [p for p in self.workers if not p.is_alive()]:
+                    process.join()
+                    print(f"Bot worker {process.pid} exited ({process.exitcode})")
+                    self.workers.remove(process)
+                while len(self.workers) < self.concurrency:
+                    self._start_worker()
+                time.sleep(self.poll_interval)
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10):
+        for process in self.workers:
+            if process.is_alive(): process.terminate()
+        for process in self.workers:
+            process.join(timeout)
+        self.workers = []
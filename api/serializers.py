@@ -65,8 +65,15 @@ class DestinationSerializer(serializers.ModelSerializer):
 # 4. Order Import Serializer (NEW)
 class OrderImportSerializer(serializers.ModelSerializer):
     uploaded_by_name = serializers.ReadOnlyField(source='uploaded_by.username')
+    # Built from InvoiceItem rows; parsed_data itself now only holds import errors
+    parsed_data = serializers.SerializerMethodField()
 
     class Meta:
         model = OrderImport
         fields = ['id', 'file', 'uploaded_by', 'uploaded_by_name', 'uploaded_at', 'parsed_data']
         read_only_fields = ['uploaded_by', 'uploaded_at', 'parsed_data']
+
+    def get_parsed_data(self, obj):
+        items = obj.items.all()
+        if items: return [item.to_dict() for item in items]
+        return obj.parsed_data
@@ -0,0 +1,197 @@
+import time
+import os
+import socket
+import posixpath
+import threading
+import paramiko
+from .delivery import file_digest
+
+# Bigger SSH windows/packets than paramiko's defaults (2 MB / 32 KB) for long fat links
+WINDOW_SIZE = 16 * 1024 * 1024
+MAX_PACKET_SIZE = 256 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+class SFTPConnection:
+    """An authenticated SSH transport with its SFTP channel."""
+
+    def __init__(self, key, transport, sftp):
+        self.key = key
+        self.transport = transport
+        self.sftp = sftp
+        self.last_used = time.time()
+
+    def is_alive(self):
+        return self.transport.is_active()
+
+    def exec_command(self, command, timeout=None):
+        """Runs a shell command. Returns (exit_status, stdout, stderr). Reads raise socket.timeout after `timeout` seconds of silence."""
+        channel = self.transport.open_session()
+        try:
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            stdout = channel.makefile('rb').read().decode(errors='replace')
+            stderr = channel.makefile_stderr('rb').read().decode(errors='replace')
+            return channel.recv_exit_status(), stdout.strip(), stderr.strip()
+        finally:
+            channel.close()
+
+    def set_timeout(self, timeout):
+        """Timeout of every SFTP request on this connection (None: wait forever)."""
+        self.sftp.get_channel().settimeout(timeout)
+
+    def close(self):
+        try:
+            self.sftp.close()
+            self.transport.close()
+        except Exception:
+            pass
+
+
+class SFTPPool:
+    """
+    Keeps authenticated SFTP connections per (host, port, username) between uploads,
+    and remembers which remote tools are already installed on each host.
+    """
+
+    def __init__(self, max_idle=2, idle_timeout=300, connect_timeout=15):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._idle = {}
+        self._tools = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, username, password, port=22):
+        key = (host, int(port), username)
+        while True:
+            with self._lock:
+                conns = self._idle.get(key) or []
+                conn = conns.pop() if conns else None
+            if conn is None: break
+            if conn.is_alive() and time.time() - conn.last_used < self.idle_timeout:
+                return conn
+            conn.close()
+        return self._connect(key, password)
+
+    def release(self, conn, healthy=True):
+        if not healthy or not conn.is_alive():
+            conn.close()
+            return
+        conn.last_used = time.time()
+        try:
+            conn.set_timeout(None)
+        except Exception:
+            conn.close()
+            return
+        with self._lock:
+            conns = self._idle.setdefault(conn.key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def _connect(self, key, password):
+        host, port, username = key
+        sock = socket.create_connection((host, port), timeout=self.connect_timeout)
+        transport = paramiko.Transport(sock, default_window_size=WINDOW_SIZE, default_max_packet_size=MAX_PACKET_SIZE)
+        try:
+            # Same trust model as AutoAddPolicy: the host key is not pinned
+            transport.connect(username=username, password=password)
+            transport.set_keepalive(30)
+            sftp = paramiko.SFTPClient.from_transport(transport, window_size=WINDOW_SIZE, max_packet_size=MAX_PACKET_SIZE)
+        except Exception:
+            transport.close()
+            raise
+        return SFTPConnection(key, transport, sftp)
+
+    # --- Remote tools cache ---
+    def ensure_tool(self, conn, tool, install_command, timeout=None):
+        """Installs a remote tool only the first time it is found missing on a host."""
+        if tool in self._tools.get(conn.key, set()): return True
+        status, _, _ = conn.exec_command(f"command -v {tool}", timeout)
+        if status != 0:
+            print(f"Installing {tool} on {conn.key[0]}...")
+            status, _, err = conn.exec_command(install_command, timeout)
+            if status != 0:
+                print(f"Could not install {tool}: {err}")
+                return False
+        with self._lock:
+            self._tools.setdefault(conn.key, set()).add(tool)
+        return True
+
+
+def ensure_remote_dir(sftp, remote_dir):
+    """mkdir -p over SFTP."""
+    path = ''
+    for part in remote_dir.strip('/').split('/'):
+        path = f"{path}/{part}"
+        try:
+            sftp.stat(path)
+        except IOError:
+            sftp.mkdir(path)
+
+
+def _remove_stale_parts(sftp, remote_path, keep=None):
+    """Deletes the '<remote_path>.<hash>.part' files of other contents (older uploads under the same name)."""
+    folder, name = posixpath.split(remote_path)
+    try:
+        names = sftp.listdir(folder or '.')
+    except IOError:
+        return
+    for other in names:
+        if other.startswith(f"{name}.") and other.endswith('.part') and other != keep:
+            try: sftp.remove(posixpath.join(folder, other))
+            except IOError: pass
+
+
+def upload_resumable(sftp, local_path, remote_path, chunk_size=CHUNK_SIZE, deadline=None):
+    """
+    Uploads local_path with pipelined writes. Data goes to '<remote_path>.<sha256[:16]>.part'
+    first, so a partial file left by a previous attempt is only continued (from its size)
+    when it belongs to the same content; the part of another file uploaded under the same
+    name is never appended to.
+    Raises TimeoutError once deadline passes (checked between chunks); what was sent
+    so far stays for the next attempt. Returns the number of bytes sent in this call.
+    """
+    total = os.path.getsize(local_path)
+    part_path = f"{remote_path}.{file_digest(local_path)[:16]}.part"
+
+    try:
+        offset = sftp.stat(part_path).st_size
+    except IOError:
+        offset = 0
+    if offset > total: offset = 0
+
+    sent = 0
+    with open(local_path, 'rb') as local_file:
+        local_file.seek(offset)
+        with sftp.open(part_path, 'ab' if offset else 'wb') as remote_file:
+            # Don't wait for an ack after every write
+            remote_file.set_pipelined(True)
+            while True:
+                if deadline and time.time() > deadline:
+                    raise TimeoutError(f"Upload of {remote_path} ran past its deadline")
+                data = local_file.read(chunk_size)
+                if not data: break
+                remote_file.write(data)
+                sent += len(data)
+
+    if sftp.stat(part_path).st_size != total:
+        # Never resume from a part that is known to be wrong
+        try: sftp.remove(part_path)
+        except IOError: pass
+        raise IOError(f"Remote size mismatch for {remote_path}")
+    try:
+        sftp.posix_rename(part_path, remote_path)
+    except IOError:
+        # Server without the posix-rename extension
+        try: sftp.remove(remote_path)
+        except IOError: pass
+        sftp.rename(part_path, remote_path)
+    _remove_stale_parts(sftp, remote_path)
+    return sent
+
+
+# One pool per process, shared by every bot run
+sftp_pool = SFTPPool()
@@ -0,0 +1,65 @@
+import time
+import threading
+from django.db import connection
+
+
+class StatusBuffer:
+    """
+    Write-behind buffer for invoice item status changes.
+    Changes are collected in memory and written in one save every `max_items`
+    changes or `max_delay` seconds, whichever comes first. Call close() when the
+    run ends (finished, failed or cancelled) to write whatever is still pending.
+    """
+
+    def __init__(self, flush_fn, max_items=20, max_delay=5.0):
+        self.flush_fn = flush_fn
+        self.max_items = max(1, int(max_items))
+        self.max_delay = float(max_delay)
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.time()
+        self._stopped = threading.Event()
+        self._timer = threading.Thread(target=self._tick, daemon=True)
+        self._timer.start()
+
+    def add(self, index, status):
+        with self._lock:
+            self._dirty[index] = status
+            due = len(self._dirty) >= self.max_items or time.time() - self._last_flush >= self.max_delay
+        if due: self.flush()
+
+    def flush(self):
+        """Writes the pending changes. Returns the number of items written."""
+        with self._flush_lock:
+            with self._lock:
+                changes = self._dirty
+                self._dirty = {}
+                self._last_flush = time.time()
+            if not changes: return 0
+            try:
+                self.flush_fn(changes)
+            except Exception as e:
+                print(f"Status flush failed, will retry: {e}")
+                # Put them back unless a newer status arrived meanwhile
+                with self._lock:
+                    for index, status in changes.items():
+                        self._dirty.setdefault(index, status)
+                return 0
+            return len(changes)
+
+    def close(self):
+        self._stopped.set()
+        self._timer.join(timeout=self.max_delay + 1)
+        self.flush()
+
+    def _tick(self):
+        # Time-based flush, so a slow invoice does not hold earlier changes back
+        try:
+            while not self._stopped.wait(self.max_delay):
+                with self._lock:
+                    due = self._dirty and time.time() - self._last_flush >= self.max_delay
+                if due: self.flush()
+        finally:
+            # This thread has its own DB connection
+            connection.close()
@@ -0,0 +1,113 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Histogram buckets (seconds) of the metrics endpoint
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class RunTimer:
+    """
+    Timing spans of one bot run, e.g. 'login', 'invoice.menu', 'delivery.sftp'.
+    Every span keeps its raw durations; publish() adds them to the cumulative step
+    histograms of the metrics endpoint when the run finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._item_started = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._spans.setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def span(self, name):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - t0)
+
+    def stopwatch(self, prefix):
+        """Returns lap(step): records '<prefix>.<step>' as the time since the previous lap."""
+        last = [time.time()]
+
+        def lap(step):
+            now = time.time()
+            self.record(f"{prefix}.{step}", now - last[0])
+            last[0] = now
+        return lap
+
+    # --- Per-invoice totals (first click to file captured) ---
+    def start_item(self, index):
+        with self._lock:
+            self._item_started.setdefault(index, time.time())
+
+    def finish_item(self, index):
+        """Records the 'invoice' span. Returns its duration in ms, or None if it never started."""
+        with self._lock:
+            started = self._item_started.pop(index, None)
+        if started is None: return None
+        seconds = time.time() - started
+        self.record('invoice', seconds)
+        return int(seconds * 1000)
+
+    def as_dict(self):
+        """Stored on the BotJob: {span: [durations in seconds]}."""
+        with self._lock:
+            return {name: [round(d, 3) for d in values] for name, values in self._spans.items()}
+
+    def bucket_counts(self, buckets=DURATION_BUCKETS):
+        """{span: (cumulative count per bucket, count, sum of seconds)} of this run."""
+        with self._lock:
+            spans = {name: list(values) for name, values in self._spans.items()}
+        return {
+            name: ([sum(1 for d in durations if d <= bound) for bound in buckets], len(durations), sum(durations))
+            for name, durations in spans.items()
+        }
+
+    def publish(self):
+        """Adds this run to the StepTiming counters (once, when the run finishes)."""
+        from django.db import transaction, IntegrityError
+        from .models import StepTiming
+        counts = self.bucket_counts()
+        if not counts: return
+        for attempt in (1, 2):
+            try:
+                with transaction.atomic():
+                    rows = {row.step: row for row in StepTiming.objects.select_for_update().filter(step__in=counts)}
+                    for step, (buckets, count, total) in sorted(counts.items()):
+                        row = rows.get(step) or StepTiming(step=step)
+                        if len(row.buckets) != len(buckets):
+                            # New step, or DURATION_BUCKETS changed: the counters start over
+                            row.buckets, row.count, row.total_seconds = [0] * len(buckets), 0, 0.0
+                        row.buckets = [a + b for a, b in zip(row.buckets, buckets)]
+                        row.count += count
+                        row.total_seconds += total
+                        row.save()
+                return
+            except IntegrityError:
+                # Another worker created the same step first; its row is locked on the retry
+                if attempt == 2: raise
+
+    def format_summary(self):
+        """One line for logs, slowest spans first."""
+        totals = sorted(self.as_dict().items(), key=lambda kv: sum(kv[1]), reverse=True)
+        return " | ".join(f"{name} {sum(v):.1f}s x{len(v)}" for name, v in totals)
+
+
+def histogram_lines(metric, label, series, buckets=DURATION_BUCKETS):
+    """
+    Prometheus text lines of one histogram per label value.
+    series: {label_value: (cumulative count per bucket, count, sum of seconds)}.
+    """
+    lines = [f"# TYPE {metric} histogram"]
+    for value, (counts, count, total) in sorted(series.items()):
+        for bound, cumulative in zip(buckets, counts):
+            lines.append(f'{metric}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{label}="{value}",le="+Inf"}} {count}')
+        lines.append(f'{metric}_sum{{{label}="{value}"}} {round(total, 3)}')
+        lines.append(f'{metric}_count{{{label}="{value}"}} {count}')
+    return lines
@@ -0,0 +1,32 @@
+import pytest
+from django.core.files.base import ContentFile
+from api.models import User, OrderImport, InvoiceItem
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    """Own MEDIA_ROOT per test: order folders are keyed by ids that restart in every test."""
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    settings.BOT_INVOICE_CACHE_DIR = str(tmp_path / 'media' / 'invoice_cache')
+    return settings.MEDIA_ROOT
+
+
+@pytest.fixture
+def user(db):
+    return User.objects.create(username='tester', email='tester@localhost')
+
+
+@pytest.fixture
+def make_order(user):
+    """make_order(['INV1', 'INV2'], statuses=[...]): an order with one InvoiceItem per invoice."""
+    def make(invoices=(), statuses=None):
+        order = OrderImport(uploaded_by=user, folder_name='tests')
+        order.file.save('checklist.xlsx', ContentFile(b''), save=False)
+        order.save()
+        statuses = statuses or ['pending'] * len(invoices)
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(order=order, row=row, invoice_number=invoice, status=status)
+            for row, (invoice, status) in enumerate(zip(invoices, statuses))
+        ])
+        return order
+    return make
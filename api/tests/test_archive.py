@@ -0,0 +1,66 @@
+import os
+import zipfile
+import pytest
+from api.archive import StreamingArchive
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_streamed_zip_holds_the_added_files(tmp_path):
+    archive = StreamingArchive(str(tmp_path / 'archive.zip'))
+    first = write(tmp_path / 'worker_1' / 'INV1.pdf', b'one')
+    second = write(tmp_path / 'worker_2' / 'INV2.pdf', b'two')
+    assert archive.add(first) == 'INV1.pdf'
+    assert archive.add(second) == 'INV2.pdf'
+    # The same source twice is archived once
+    assert archive.add(first) is None
+    assert archive.close() == str(tmp_path / 'archive.zip')
+
+    with zipfile.ZipFile(tmp_path / 'archive.zip') as zf:
+        assert zf.namelist() == ['INV1.pdf', 'INV2.pdf']
+        assert zf.read('INV2.pdf') == b'two'
+
+
+def test_same_name_from_two_workers_gets_a_suffix(tmp_path):
+    archive = StreamingArchive(str(tmp_path / 'archive.zip'), compression='deflated')
+    archive.add(write(tmp_path / 'worker_1' / 'INV1.pdf', b'a'))
+    assert archive.add(write(tmp_path / 'worker_2' / 'INV1.pdf', b'b')) == 'INV1_1.pdf'
+    archive.close()
+    with zipfile.ZipFile(tmp_path / 'archive.zip') as zf:
+        assert zf.namelist() == ['INV1.pdf', 'INV1_1.pdf']
+
+
+def test_moved_file_is_still_known(tmp_path):
+    archive = StreamingArchive(str(tmp_path / 'archive.zip'))
+    old = write(tmp_path / 'worker_1' / 'INV1.pdf', b'a')
+    archive.add(old)
+    new = str(tmp_path / 'INV1.pdf')
+    os.replace(old, new)
+    archive.moved(old, new)
+    assert archive.contains(new)
+    assert archive.add(new) is None
+    archive.close()
+
+
+def test_closed_early_is_a_valid_archive(tmp_path):
+    archive = StreamingArchive(str(tmp_path / 'archive.zip'))
+    archive.add(write(tmp_path / 'INV1.pdf', b'a'))
+    archive.close()
+    assert archive.add(write(tmp_path / 'INV2.pdf', b'b')) is None
+    with zipfile.ZipFile(tmp_path / 'archive.zip') as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ['INV1.pdf']
+
+
+def test_empty_archive_closes_to_none(tmp_path):
+    assert StreamingArchive(str(tmp_path / 'archive.zip')).close() is None
+
+
+def test_unknown_compression_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        StreamingArchive(str(tmp_path / 'archive.zip'), compression='rar')
@@ -0,0 +1,85 @@
+import pytest
+from api.bot import AutoDownloadBot
+from api.models import InvoiceItem
+from api.status_buffer import StatusBuffer
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def make_bot(make_order):
+    """make_bot(['INV1', 'INV2', 'INV1'], statuses, **config): a bot over an order with its repeats linked."""
+    def make(invoices, statuses=None, **config):
+        order = make_order(invoices, statuses)
+        InvoiceItem.link_duplicates(order)
+        return AutoDownloadBot(order, {'use_invoice_cache': False, **config})
+    return make
+
+
+def statuses(bot):
+    return list(bot.order.items.order_by('row').values_list('status', flat=True))
+
+
+def test_repeats_point_at_the_first_row(make_order):
+    order = make_order(['INV1', 'INV2', 'INV1', 'INV1'])
+    assert InvoiceItem.link_duplicates(order) == 2
+    first = order.items.get(row=0)
+    assert list(order.items.order_by('row').values_list('duplicate_of', flat=True)) == [None, None, first.id, first.id]
+    # Linking again changes nothing
+    assert InvoiceItem.link_duplicates(order) == 2
+
+
+def test_one_fetch_per_invoice(make_bot):
+    bot = make_bot(['INV1', 'INV2', 'INV1', 'INV3', 'INV2'])
+    assert bot.duplicates == {0: [2], 1: [4]}
+    assert bot._pending_indexes() == [0, 1, 3]
+
+
+def test_canonical_outside_the_window_is_fetched(make_bot):
+    bot = make_bot(['INV1', 'INV2', 'INV3', 'INV1'], start_index=2)
+    # Row 3 repeats row 0, which is before the window: the fetch goes through row 0
+    assert bot._pending_indexes() == [2, 0]
+    bot = make_bot(['INV1', 'INV2', 'INV1', 'INV2'], limit=1)
+    assert bot._pending_indexes() == [0]
+
+
+def test_failed_canonical_is_fetched_again(make_bot):
+    bot = make_bot(['INV1', 'INV2', 'INV1'], statuses=['failed', 'completed', 'failed'], start_index=2)
+    assert bot._pending_indexes() == [0]
+
+
+def test_completed_canonical_leaves_the_repeat_on_its_own(make_bot):
+    # The first row finished in an earlier run, its repeat did not
+    bot = make_bot(['INV1', 'INV2', 'INV1'], statuses=['completed', 'pending', 'failed'])
+    assert bot._pending_indexes() == [1, 2]
+    bot._update_item_status(2, 'completed')
+    assert statuses(bot) == ['completed', 'pending', 'completed']
+
+
+def test_completed_repeat_is_skipped(make_bot):
+    bot = make_bot(['INV1', 'INV1', 'INV2'], statuses=['failed', 'completed', 'pending'])
+    assert bot._pending_indexes() == [0, 2]
+
+
+def test_status_reaches_the_repeats(make_bot, monkeypatch):
+    bot = make_bot(['INV1', 'INV2', 'INV1', 'INV1'])
+    events = []
+    monkeypatch.setattr(bot, '_emit', lambda event_type, payload: events.append((event_type, payload['index'], payload['status'])))
+
+    bot._update_item_status(0, 'failed')
+    assert statuses(bot) == ['failed', 'pending', 'failed', 'failed']
+    bot._update_item_status(0, 'completed')
+    assert statuses(bot) == ['completed', 'pending', 'completed', 'completed']
+    assert [item['status'] for item in bot.items] == ['completed', 'pending', 'completed', 'completed']
+    # Every row gets its own progress event, so the table updates each copy
+    assert events[-3:] == [('progress', 0, 'completed'), ('progress', 2, 'completed'), ('progress', 3, 'completed')]
+    assert bot._pending_indexes() == [1]
+
+
+def test_buffered_status_reaches_the_repeats(make_bot):
+    bot = make_bot(['INV1', 'INV1', 'INV2'])
+    bot.status_buffer = StatusBuffer(bot._flush_item_statuses, 100, 60)
+    bot._update_item_status(0, 'completed')
+    assert statuses(bot) == ['pending', 'pending', 'pending']
+    bot.status_buffer.close()
+    assert statuses(bot) == ['completed', 'completed', 'pending']
@@ -0,0 +1,35 @@
+import os
+from types import SimpleNamespace
+from api.browser import BrowserSession, BrowserSessionPool
+
+
+class FakeDriver:
+    """Its 'chromedriver' is the test process itself, so the session has a real RSS."""
+
+    def __init__(self):
+        self.service = SimpleNamespace(process=SimpleNamespace(pid=os.getpid()))
+        self.quit_called = False
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_session_memory_covers_the_driver_process():
+    assert BrowserSession('key', FakeDriver()).memory_mb() > 1
+
+
+def test_browser_over_the_rss_limit_is_recycled():
+    pool = BrowserSessionPool(max_rss_mb=1)
+    session = BrowserSession('key', FakeDriver())
+    pool.release(session)
+    assert session.driver.quit_called
+    assert pool.acquire('key') is None
+
+
+def test_browser_under_the_rss_limit_is_pooled():
+    pool = BrowserSessionPool(max_rss_mb=1024 * 1024)
+    session = BrowserSession('key', FakeDriver())
+    pool.release(session)
+    assert not session.driver.quit_called
+    pool.close_all()
+    assert session.driver.quit_called
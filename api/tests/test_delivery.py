@@ -0,0 +1,48 @@
+import os
+import time
+import pytest
+from api.delivery import copy_files, same_file
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+@pytest.fixture
+def sources(tmp_path):
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    return [write(folder / 'INV1.pdf', b'one' * 100), write(folder / 'INV2.pdf', b'two' * 100)]
+
+
+def test_copies_into_the_target(tmp_path, sources):
+    dest = tmp_path / 'dest'
+    assert copy_files(sources, str(dest)) == (2, 0, 600)
+    assert sorted(os.listdir(dest)) == ['INV1.pdf', 'INV2.pdf']
+    assert all(same_file(src, dest / os.path.basename(src)) for src in sources)
+
+
+def test_identical_target_is_skipped(tmp_path, sources):
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    existing = write(dest / 'INV1.pdf', b'one' * 100)
+    mtime = os.path.getmtime(existing)
+    time.sleep(0.01)
+    assert copy_files(sources, str(dest)) == (1, 1, 300)
+    assert os.path.getmtime(existing) == mtime
+
+
+def test_different_target_of_the_same_size_is_replaced(tmp_path, sources):
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    write(dest / 'INV1.pdf', b'eno' * 100)
+    assert copy_files(sources, str(dest)) == (2, 0, 600)
+    assert (dest / 'INV1.pdf').read_bytes() == b'one' * 100
+    assert not any(name.endswith('.part') for name in os.listdir(dest))
+
+
+def test_passed_deadline_raises(tmp_path, sources):
+    with pytest.raises(TimeoutError):
+        copy_files(sources, str(tmp_path / 'dest'), deadline=time.time() - 1)
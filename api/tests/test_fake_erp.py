@@ -0,0 +1,63 @@
+import json
+import urllib.error
+import urllib.request
+import pytest
+from api.fake_erp import FakeErp, SESSION_COOKIE
+
+
+@pytest.fixture
+def erp():
+    erp = FakeErp(ui_latency=0, download_latency=0, login_latency=0).start()
+    yield erp
+    erp.stop()
+
+
+def get(url, session=None):
+    request = urllib.request.Request(url)
+    if session: request.add_header('Cookie', f"{SESSION_COOKIE}={session}")
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status, response.headers, response.read()
+
+
+def test_closed_name_dialog_is_not_in_the_markup(erp):
+    _, _, body = get(erp.url, erp.open_session())
+    markup = body.decode().split('<script>')[0]
+    # Otherwise its OK button would be the first match of DOWNLOAD_BUTTON_XPATH
+    assert 'DialogOK' not in markup
+    assert '<label>Name</label>' not in markup
+    assert '<button id="download"><span>OK</span></button>' in markup
+
+
+def test_signed_out_page_shows_the_login(erp):
+    _, _, body = get(erp.url)
+    markup = body.decode().split('<script>')[0]
+    assert '<div id="login" class="">' in markup
+    assert '<div id="app" class="hidden">' in markup
+
+
+def test_login_sets_a_session_for_the_downloads(erp):
+    request = urllib.request.Request(f"{erp.url}login", data=json.dumps({'username': 'bot', 'password': 'bot'}).encode())
+    with urllib.request.urlopen(request, timeout=5) as response:
+        session = response.headers['Set-Cookie'].split(';')[0].split('=', 1)[1]
+    status, headers, body = get(f"{erp.url}download?invoice=INV1", session)
+    assert status == 200
+    assert headers['Content-Disposition'] == 'attachment; filename="PO_INV1.pdf"'
+    assert body.startswith(b'%PDF')
+    assert erp.stats['logins'] == 1 and erp.stats['downloads'] == 1
+
+
+def test_wrong_password_and_missing_session_are_refused(erp):
+    request = urllib.request.Request(f"{erp.url}login", data=json.dumps({'username': 'bot', 'password': 'x'}).encode())
+    with pytest.raises(urllib.error.HTTPError) as refused:
+        urllib.request.urlopen(request, timeout=5)
+    assert refused.value.code == 401
+    with pytest.raises(urllib.error.HTTPError):
+        get(f"{erp.url}download?invoice=INV1")
+
+
+def test_export_endpoint_needs_the_session(erp):
+    _, headers, body = get(f"{erp.url}report/po_form?invoice=INV2")
+    assert headers['Content-Type'] == 'text/html'
+    _, headers, body = get(f"{erp.url}report/po_form?invoice=INV2", erp.open_session())
+    assert headers['Content-Type'] == 'application/pdf'
+    assert erp.stats['exports'] == 1
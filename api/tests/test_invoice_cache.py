@@ -0,0 +1,96 @@
+import os
+import zipfile
+from datetime import timedelta
+import pytest
+from django.utils import timezone
+from api.archive import StreamingArchive
+from api.bot import AutoDownloadBot
+from api.invoice_cache import InvoiceCache
+from api.models import CachedInvoiceFile
+
+pytestmark = pytest.mark.django_db
+
+KB = 1 / 1024    # max_mb in kilobytes
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def fill(cache, tmp_path, invoices):
+    """Stores one distinct 1 KB file per invoice, the first one least recently used."""
+    start = timezone.now() - timedelta(hours=len(invoices))
+    for n, invoice in enumerate(invoices):
+        cache.put(invoice, 'po_form', write(tmp_path / 'downloads' / f'{invoice}.pdf', bytes([n]) * 1024))
+        CachedInvoiceFile.objects.filter(invoice_number=invoice).update(last_used_at=start + timedelta(hours=n))
+
+
+def test_eviction_drops_the_least_recently_used(tmp_path):
+    cache = InvoiceCache(root=str(tmp_path / 'cache'), max_mb=2.5 * KB)
+    fill(cache, tmp_path, ['INV1', 'INV2', 'INV3', 'INV4'])
+    blobs = dict(CachedInvoiceFile.objects.values_list('invoice_number', 'sha256'))
+    assert cache.total_bytes() == 4096
+
+    assert cache.evict() == 2
+    assert set(CachedInvoiceFile.objects.values_list('invoice_number', flat=True)) == {'INV3', 'INV4'}
+    assert not os.path.exists(cache._blob_path(blobs['INV1']))
+    assert not os.path.exists(cache._blob_path(blobs['INV2']))
+    assert os.path.exists(cache._blob_path(blobs['INV4']))
+    assert cache.total_bytes() == 2048
+    # Under the cap: nothing more to drop
+    assert cache.evict() == 0
+
+
+def test_a_hit_keeps_an_old_entry(tmp_path):
+    cache = InvoiceCache(root=str(tmp_path / 'cache'), max_mb=2.5 * KB)
+    fill(cache, tmp_path, ['INV1', 'INV2', 'INV3', 'INV4'])
+    # Reading the oldest entry makes it the most recently used
+    assert cache.materialize(cache.lookup_many(['INV1'], 'po_form')['INV1'], str(tmp_path))
+
+    cache.evict()
+    assert set(CachedInvoiceFile.objects.values_list('invoice_number', flat=True)) == {'INV1', 'INV4'}
+
+
+def test_shared_file_stays_while_referenced(tmp_path):
+    cache = InvoiceCache(root=str(tmp_path / 'cache'), max_mb=1.5 * KB)
+    same = write(tmp_path / 'downloads' / 'same.pdf', b'x' * 1024)
+    cache.put('INV1', 'po_form', same)
+    cache.put('INV2', 'po_form', same)
+    fill(cache, tmp_path, ['INV3'])
+    CachedInvoiceFile.objects.filter(invoice_number__in=['INV1', 'INV2']).update(last_used_at=timezone.now() - timedelta(days=1))
+    shared = CachedInvoiceFile.objects.get(invoice_number='INV1').sha256
+
+    # Dropping INV1 frees nothing (INV2 still uses the file), so INV2 goes too
+    assert cache.evict() == 2
+    assert not os.path.exists(cache._blob_path(shared))
+    assert list(CachedInvoiceFile.objects.values_list('invoice_number', flat=True)) == ['INV3']
+
+
+def test_cached_invoices_are_archived_and_completed(make_order, tmp_path):
+    order = make_order(['INV1', 'INV2', 'INV3'], statuses=['pending', 'failed', 'pending'])
+    bot = AutoDownloadBot(order, {})
+    bot.invoice_cache.put('INV1', 'po_form', write(tmp_path / 'downloads' / 'INV1.pdf', b'one'))
+    bot.invoice_cache.put('INV2', 'po_form', write(tmp_path / 'downloads' / 'INV2.pdf', b'two'))
+    os.makedirs(bot.download_dir)
+    bot.archive = StreamingArchive(os.path.join(bot.download_dir, 'archive.zip'))
+
+    assert bot._fill_from_cache() == 2
+    bot.archive.close()
+    with zipfile.ZipFile(os.path.join(bot.download_dir, 'archive.zip')) as zf:
+        assert sorted(zf.namelist()) == ['INV1.pdf', 'INV2.pdf']
+        assert zf.read('INV2.pdf') == b'two'
+    assert dict(order.items.values_list('invoice_number', 'status')) == {'INV1': 'completed', 'INV2': 'completed', 'INV3': 'pending'}
+    # Only the miss is left for the browser
+    assert bot._pending_indexes() == [2]
+    assert CachedInvoiceFile.objects.get(invoice_number='INV1').hits == 1
+
+
+def test_cache_disabled_serves_nothing(make_order, tmp_path):
+    order = make_order(['INV1'])
+    InvoiceCache().put('INV1', 'po_form', write(tmp_path / 'downloads' / 'INV1.pdf', b'one'))
+    bot = AutoDownloadBot(order, {'use_invoice_cache': False})
+    assert bot._fill_from_cache() == 0
+    assert order.items.get().status == 'pending'
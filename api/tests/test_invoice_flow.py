@@ -0,0 +1,110 @@
+import pytest
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
+from api.invoice_flow import (
+    InvoiceFlow, Step, FlowFailed, DownloadNotStarted, SessionLost, CircuitBreaker,
+    classify_error, backoff, MENU_OPEN, FORM_OPEN, INVOICE_ENTERED, TRANSIENT, STALE, DOWNLOAD, SESSION,
+)
+
+
+class Page:
+    """Fake steps: `fail` maps a state to the errors its next runs raise, `lost` to states that no longer hold."""
+
+    def __init__(self, fail=None, lost=()):
+        self.fail = {state: list(errors) for state, errors in (fail or {}).items()}
+        self.lost = set(lost)
+        self.ran = []
+
+    def step(self, state):
+        def run():
+            self.ran.append(state)
+            if self.fail.get(state): raise self.fail[state].pop(0)
+        return Step(state, run, holds=lambda: state not in self.lost)
+
+    def steps(self):
+        return [self.step(state) for state in (MENU_OPEN, FORM_OPEN, INVOICE_ENTERED)]
+
+
+def flow(page, **kwargs):
+    sleeps = []
+    return InvoiceFlow(page.steps(), sleep=sleeps.append, **kwargs), sleeps
+
+
+def test_retries_only_the_failed_step_while_earlier_states_hold():
+    page = Page(fail={INVOICE_ENTERED: [TimeoutException('overlay')]})
+    invoice, sleeps = flow(page)
+    assert invoice.run()
+    assert page.ran == [MENU_OPEN, FORM_OPEN, INVOICE_ENTERED, INVOICE_ENTERED]
+    assert sleeps == [0.5]
+    assert invoice.state == INVOICE_ENTERED
+    assert invoice.errors == [(INVOICE_ENTERED, TRANSIENT, 'Message: overlay')]
+
+
+def test_resumes_from_the_last_state_that_still_holds():
+    page = Page(fail={INVOICE_ENTERED: [StaleElementReferenceException()]}, lost={FORM_OPEN})
+    invoice, sleeps = flow(page)
+    assert invoice.run()
+    assert page.ran == [MENU_OPEN, FORM_OPEN, INVOICE_ENTERED, FORM_OPEN, INVOICE_ENTERED]
+    assert sleeps == [0.1]
+
+
+def test_session_errors_start_over():
+    page = Page(fail={FORM_OPEN: [SessionLost('signed out')]})
+    invoice, sleeps = flow(page)
+    assert invoice.run()
+    assert page.ran == [MENU_OPEN, FORM_OPEN, MENU_OPEN, FORM_OPEN, INVOICE_ENTERED]
+    assert sleeps == [2.0]
+
+
+def test_on_failure_can_reclassify_the_error():
+    seen = []
+
+    def on_failure(error_class, error):
+        seen.append(error_class)
+        return SESSION
+    page = Page(fail={INVOICE_ENTERED: [TimeoutException()]})
+    invoice, sleeps = flow(page, on_failure=on_failure)
+    assert invoice.run()
+    assert seen == [TRANSIENT]
+    assert page.ran[3:] == [MENU_OPEN, FORM_OPEN, INVOICE_ENTERED]
+
+
+def test_gives_up_after_max_failures_with_growing_backoff():
+    page = Page(fail={FORM_OPEN: [TimeoutException()] * 3})
+    invoice, sleeps = flow(page, max_failures=3)
+    with pytest.raises(FlowFailed) as failed:
+        invoice.run()
+    assert (failed.value.state, failed.value.error_class) == (FORM_OPEN, TRANSIENT)
+    assert sleeps == [0.5, 1.0]
+
+
+def test_file_of_an_earlier_attempt_ends_the_flow():
+    page = Page(fail={INVOICE_ENTERED: [DownloadNotStarted()]})
+    done = iter([False, False, False, True])
+    invoice, sleeps = flow(page, is_done=lambda: next(done))
+    assert invoice.run()
+    assert page.ran == [MENU_OPEN, FORM_OPEN, INVOICE_ENTERED]
+    assert sleeps == [1.0]
+
+
+def test_stop_request_ends_the_flow():
+    page = Page()
+    invoice, sleeps = flow(page, should_stop=lambda: len(page.ran) == 2)
+    assert invoice.run() is False
+    assert page.ran == [MENU_OPEN, FORM_OPEN]
+
+
+def test_classify_error_and_backoff():
+    assert classify_error(SessionLost()) == SESSION
+    assert classify_error(WebDriverException('chrome not reachable: disconnected')) == SESSION
+    assert classify_error(DownloadNotStarted()) == DOWNLOAD
+    assert classify_error(StaleElementReferenceException()) == STALE
+    assert classify_error(ValueError()) == TRANSIENT
+    assert [backoff(TRANSIENT, n) for n in (1, 2, 3, 4, 5)] == [0.5, 1.0, 2.0, 4.0, 4.0]
+
+
+def test_circuit_breaker_trips_on_consecutive_failures():
+    breaker = CircuitBreaker(threshold=2)
+    assert not breaker.failure()
+    breaker.success()
+    assert not breaker.failure()
+    assert breaker.failure()
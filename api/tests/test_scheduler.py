@@ -0,0 +1,227 @@
+import os
+import time
+import asyncio
+from datetime import timedelta
+import pytest
+from django.db.models import QuerySet
+from django.utils import timezone
+from api.models import BotJob
+from api.recovery import order_temp_dir, reconcile_items
+from api.scheduler import claim_next_job, renew_lease, run_job, worker_identity, InProcessRunner, prewarm_spare_browser
+from server.sio import Emitter
+
+pytestmark = pytest.mark.django_db
+
+
+def expire(job):
+    BotJob.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+
+def statuses(order):
+    return dict(order.items.values_list('invoice_number', 'status'))
+
+
+def test_claim_takes_a_queued_job(make_order, user):
+    job = BotJob.objects.create(order=make_order(), requested_by=user)
+    claimed = claim_next_job('node-a:1')
+    assert claimed.id == job.id
+    assert (claimed.status, claimed.lease_owner, claimed.attempts) == ('running', 'node-a:1', 1)
+    assert claim_next_job('node-b:2') is None
+
+
+def test_two_workers_never_claim_the_same_job(make_order, user, monkeypatch):
+    first = BotJob.objects.create(order=make_order(), requested_by=user)
+    second = BotJob.objects.create(order=make_order(), requested_by=user)
+    original = QuerySet.update
+    raced = []
+
+    def update(self, **kwargs):
+        # Worker A claims between worker B's read of the candidates and B's own claim
+        if self.model is BotJob and kwargs.get('lease_owner') == 'node-b:2' and not raced:
+            raced.append(claim_next_job('node-a:1'))
+        return original(self, **kwargs)
+    monkeypatch.setattr(QuerySet, 'update', update)
+
+    claimed = claim_next_job('node-b:2')
+    assert raced[0].id == first.id
+    assert claimed.id == second.id
+    assert BotJob.objects.get(pk=first.pk).lease_owner == 'node-a:1'
+
+
+def test_live_lease_is_not_taken_over(make_order, user):
+    BotJob.objects.create(order=make_order(), requested_by=user)
+    job = claim_next_job('node-a:1')
+    assert claim_next_job('node-b:2') is None
+    assert renew_lease(job.id, 'node-a:1')
+
+
+def test_expired_lease_is_taken_over(make_order, user):
+    BotJob.objects.create(order=make_order(), requested_by=user)
+    job = claim_next_job('node-a:1')
+    expire(job)
+
+    taken = claim_next_job('node-b:2')
+    assert taken.id == job.id
+    assert (taken.lease_owner, taken.attempts) == ('node-b:2', 2)
+    # The old owner finds out at its next heartbeat
+    assert not renew_lease(job.id, 'node-a:1')
+    assert renew_lease(job.id, 'node-b:2')
+
+
+def test_job_losing_its_worker_too_often_fails(make_order, user, settings):
+    settings.BOT_JOB_MAX_ATTEMPTS = 2
+    order = make_order()
+    BotJob.objects.create(order=order, requested_by=user)
+    for owner in ('node-a:1', 'node-b:2'):
+        expire(claim_next_job(owner))
+
+    assert claim_next_job('node-c:3') is None
+    job = BotJob.objects.get(order=order)
+    assert job.status == 'failed'
+    order.refresh_from_db()
+    assert order.bot_status == 'failed'
+
+
+def test_reconcile_keeps_completed_only_where_the_file_is(make_order):
+    order = make_order(['A', 'B', 'C', 'D', 'E'], ['completed', 'completed', 'pending', 'processing', 'failed'])
+    folder = order_temp_dir(order.id)
+    os.makedirs(os.path.join(folder, 'worker_1'))
+    open(os.path.join(folder, 'A.pdf'), 'wb').close()
+    # Captured by a worker of the previous owner but never moved up
+    open(os.path.join(folder, 'worker_1', 'C.pdf'), 'wb').close()
+
+    assert reconcile_items(order) == (1, 2)
+    assert statuses(order) == {'A': 'completed', 'B': 'pending', 'C': 'completed', 'D': 'pending', 'E': 'failed'}
+    assert sorted(os.listdir(folder)) == ['A.pdf', 'C.pdf']
+
+
+class FakeBot:
+    """Stands in for AutoDownloadBot in run_job; `during_run` plays what happens meanwhile."""
+    during_run = None
+    seen = None
+
+    def __init__(self, order, config):
+        from api.telemetry import RunTimer
+        self.order = order
+        self.config = config
+        self.abandoned = False
+        self.lease_check = None
+        self.timer = RunTimer()
+        FakeBot.seen = statuses(order)
+
+    def abandon(self):
+        self.abandoned = True
+
+    def run_sync(self):
+        if FakeBot.during_run: FakeBot.during_run(self)
+        self.owner_at_end = self.lease_check()
+        if self.owner_at_end:
+            self.order.bot_status = 'completed'
+            self.order.save(update_fields=['bot_status'])
+
+
+@pytest.fixture
+def fake_bot(monkeypatch):
+    monkeypatch.setattr('api.bot.AutoDownloadBot', FakeBot)
+    FakeBot.during_run = None
+    FakeBot.seen = None
+    return FakeBot
+
+
+def test_takeover_reconciles_before_the_bot_starts(make_order, user, fake_bot):
+    order = make_order(['A', 'B'], ['completed', 'completed'])
+    BotJob.objects.create(order=order, requested_by=user)
+    expire(claim_next_job('node-a:1'))
+    job = claim_next_job('node-b:2')
+    os.makedirs(order_temp_dir(order.id), exist_ok=True)
+    open(os.path.join(order_temp_dir(order.id), 'A.pdf'), 'wb').close()
+
+    assert run_job(job, 'node-b:2') == 'completed'
+    assert fake_bot.seen == {'A': 'completed', 'B': 'pending'}
+    assert BotJob.objects.get(pk=job.pk).status == 'completed'
+
+
+def test_late_owner_backs_off_and_leaves_the_job_alone(make_order, user, fake_bot):
+    order = make_order(['A'])
+    BotJob.objects.create(order=order, requested_by=user)
+    job = claim_next_job('node-a:1')
+
+    def taken_over(bot):
+        expire(job)
+        claim_next_job('node-b:2')
+    fake_bot.during_run = taken_over
+
+    run_job(job, 'node-a:1')
+    job.refresh_from_db()
+    # Still running under the new owner, not closed by the old one
+    assert (job.status, job.lease_owner) == ('running', 'node-b:2')
+    order.refresh_from_db()
+    assert order.bot_status != 'completed'
+
+
+def wait_idle(runner, timeout=5):
+    t0 = time.time()
+    while any(t.is_alive() for t in runner._threads) and time.time() - t0 < timeout:
+        time.sleep(0.02)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_startup_recovers_and_reclaims_a_run_of_the_dead_process(make_order, user, fake_bot, monkeypatch):
+    from server import asgi
+    order = make_order(['A'])
+    order.bot_status = 'running'
+    order.save(update_fields=['bot_status'])
+    job = BotJob.objects.create(
+        order=order, requested_by=user, status='running', lease_owner='old-host:1/t1', attempts=1,
+        lease_expires_at=timezone.now() - timedelta(seconds=5),
+    )
+    runner = InProcessRunner(concurrency=1)
+    monkeypatch.setattr('api.scheduler.inprocess_runner', runner)
+    monkeypatch.setattr(asgi, 'emitter', Emitter(None))
+
+    asyncio.run(asgi.on_startup())
+    wait_idle(runner)
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == ('completed', 2)
+    assert job.lease_owner.startswith(worker_identity())
+    # Recovery ran before the takeover
+    order.refresh_from_db()
+    assert order.bot_message.startswith('Interrupted')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_runner_kicks_again_once_a_dead_lease_expires(make_order, user, fake_bot):
+    order = make_order(['A'])
+    job = BotJob.objects.create(
+        order=order, requested_by=user, status='running', lease_owner='old-host:1/t1', attempts=1,
+        lease_expires_at=timezone.now() + timedelta(seconds=0.5),
+    )
+    runner = InProcessRunner(concurrency=1)
+    runner.kick()
+    wait_idle(runner)
+    # Lease still live: nothing to claim yet, but a recheck is scheduled
+    assert BotJob.objects.get(pk=job.pk).lease_owner == 'old-host:1/t1'
+    assert runner._recheck is not None
+
+    runner._recheck.join(timeout=5)
+    wait_idle(runner)
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == ('completed', 2)
+
+
+def test_runner_start_prewarms_a_browser_for_the_latest_account(make_order, user, settings, monkeypatch):
+    from api.bot import AutoDownloadBot
+    warmed = []
+    monkeypatch.setattr(AutoDownloadBot, 'prewarm', lambda bot: warmed.append(bot.username) or True)
+    settings.BOT_PREWARM_BROWSER = False
+    assert not prewarm_spare_browser()
+
+    settings.BOT_PREWARM_BROWSER = True
+    assert not prewarm_spare_browser()    # No job yet: no account to warm for
+    order = make_order(['A'])
+    BotJob.objects.create(order=order, requested_by=user, config={'username': 'first@erp'}, status='completed')
+    BotJob.objects.create(order=order, requested_by=user, config={'username': 'latest@erp'}, status='completed')
+    assert prewarm_spare_browser()
+    assert warmed == ['latest@erp']
+    # Building the bot leaves no folder behind for the old order
+    assert not os.path.exists(order_temp_dir(order.id))
@@ -0,0 +1,125 @@
+import os
+import time
+import pytest
+from api.delivery import file_digest
+from api.sftp import upload_resumable
+
+
+class LocalFile:
+    def __init__(self, f, drop_writes=0):
+        self._f = f
+        self.drop_writes = drop_writes
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def write(self, data):
+        if self.drop_writes:
+            # A write the server acknowledged but never stored
+            self.drop_writes -= 1
+            return
+        self._f.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+
+class LocalSFTP:
+    """The part of paramiko's SFTPClient upload_resumable uses, on a local folder."""
+
+    def __init__(self, root, drop_writes=0):
+        self.root = str(root)
+        self.drop_writes = drop_writes
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def stat(self, path):
+        try:
+            return os.stat(self._path(path))
+        except OSError as e:
+            raise IOError(str(e))
+
+    def open(self, path, mode):
+        return LocalFile(open(self._path(path), mode), self.drop_writes)
+
+    def listdir(self, path):
+        return os.listdir(self._path(path))
+
+    def remove(self, path):
+        try:
+            os.remove(self._path(path))
+        except OSError as e:
+            raise IOError(str(e))
+
+    def posix_rename(self, old, new):
+        os.replace(self._path(old), self._path(new))
+
+    def rename(self, old, new):
+        os.rename(self._path(old), self._path(new))
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / 'archive.zip'
+    path.write_bytes(os.urandom(10_000))
+    return path
+
+
+@pytest.fixture
+def remote(tmp_path):
+    root = tmp_path / 'remote'
+    root.mkdir()
+    return root
+
+
+def part_name(local_file):
+    return f"archive.zip.{file_digest(local_file)[:16]}.part"
+
+
+def test_fresh_upload(local_file, remote):
+    sent = upload_resumable(LocalSFTP(remote), str(local_file), '/archive.zip', chunk_size=4096)
+    assert sent == 10_000
+    assert (remote / 'archive.zip').read_bytes() == local_file.read_bytes()
+    assert os.listdir(remote) == ['archive.zip']
+
+
+def test_resumes_a_part_of_the_same_content(local_file, remote):
+    (remote / part_name(local_file)).write_bytes(local_file.read_bytes()[:6000])
+    sent = upload_resumable(LocalSFTP(remote), str(local_file), '/archive.zip', chunk_size=4096)
+    assert sent == 4000
+    assert (remote / 'archive.zip').read_bytes() == local_file.read_bytes()
+    assert os.listdir(remote) == ['archive.zip']
+
+
+def test_never_appends_to_the_part_of_other_content(local_file, remote):
+    # Left by an earlier archive with the same name (and by the old size-only scheme)
+    (remote / 'archive.zip.0123456789abcdef.part').write_bytes(b'x' * 6000)
+    (remote / 'archive.zip.part').write_bytes(b'x' * 6000)
+    sent = upload_resumable(LocalSFTP(remote), str(local_file), '/archive.zip', chunk_size=4096)
+    assert sent == 10_000
+    assert (remote / 'archive.zip').read_bytes() == local_file.read_bytes()
+    assert os.listdir(remote) == ['archive.zip']
+
+
+def test_size_mismatch_discards_the_part(local_file, remote):
+    with pytest.raises(IOError, match='size mismatch'):
+        upload_resumable(LocalSFTP(remote, drop_writes=1), str(local_file), '/archive.zip', chunk_size=4096)
+    assert os.listdir(remote) == []
+    # The next attempt starts over instead of resuming from the wrong bytes
+    sent = upload_resumable(LocalSFTP(remote), str(local_file), '/archive.zip', chunk_size=4096)
+    assert sent == 10_000
+    assert (remote / 'archive.zip').read_bytes() == local_file.read_bytes()
+
+
+def test_deadline_keeps_the_part_for_the_next_attempt(local_file, remote):
+    sftp = LocalSFTP(remote)
+    (remote / part_name(local_file)).write_bytes(local_file.read_bytes()[:4096])
+    with pytest.raises(TimeoutError):
+        upload_resumable(sftp, str(local_file), '/archive.zip', chunk_size=4096, deadline=time.time() - 1)
+    assert (remote / part_name(local_file)).stat().st_size == 4096
+    assert upload_resumable(sftp, str(local_file), '/archive.zip', chunk_size=4096) == 10_000 - 4096
+    assert (remote / 'archive.zip').read_bytes() == local_file.read_bytes()
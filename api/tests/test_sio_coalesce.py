@@ -0,0 +1,71 @@
+import asyncio
+from server.sio import coalesce, Emitter
+
+ROOM = {'to': ['order:1']}
+
+
+def progress(index, status, order_id=1):
+    return ('bot_update', {'type': 'progress', 'order_id': order_id, 'index': index, 'status': status}, ROOM)
+
+
+def test_progress_of_one_order_becomes_one_batch_with_the_latest_status():
+    events = [progress(0, 'processing'), progress(1, 'processing'), progress(0, 'completed')]
+    assert coalesce(events) == [('bot_update', {
+        'type': 'progress_batch', 'order_id': 1,
+        'items': [progress(1, 'processing')[1], progress(0, 'completed')[1]],
+    }, ROOM)]
+
+
+def test_single_progress_event_is_sent_as_is():
+    assert coalesce([progress(3, 'completed')]) == [progress(3, 'completed')]
+
+
+def test_other_events_keep_their_place():
+    status = ('bot_update', {'type': 'status_change', 'order_id': 1, 'status': 'completed'}, ROOM)
+    log = ('bot_update', {'type': 'log', 'order_id': 2, 'message': 'hi'}, ROOM)
+    events = [progress(0, 'completed'), log, progress(1, 'completed'), status, progress(2, 'failed')]
+    result = coalesce(events)
+    # Progress of order 1 before its status change is batched before it, what follows starts over
+    assert [data.get('type') for _, data, _ in result] == ['progress_batch', 'log', 'status_change', 'progress']
+    assert [item['index'] for item in result[0][1]['items']] == [0, 1]
+    assert result[3] == progress(2, 'failed')
+
+
+def test_orders_and_targets_are_batched_apart():
+    other_room = ('bot_update', dict(progress(1, 'completed')[1]), {'to': ['order:1', 'topic:orders']})
+    events = [progress(0, 'completed'), progress(0, 'completed', order_id=2), other_room]
+    assert coalesce(events) == events
+
+
+def test_non_bot_events_pass_through():
+    events = [('order_update', {'action': 'created'}, {}), ('order_update', {'action': 'created'}, {})]
+    assert coalesce(events) == events
+
+
+class FakeServer:
+    def __init__(self):
+        self.sent = []
+
+    async def emit(self, event, data, **kwargs):
+        self.sent.append((event, data, kwargs))
+
+
+def test_emitter_sends_the_queue_coalesced():
+    server = FakeServer()
+    emitter = Emitter(server)
+    for index in range(3):
+        emitter.put(*progress(index, 'completed')[:2], **ROOM)
+    asyncio.run(emitter.flush())
+    assert len(server.sent) == 1
+    assert len(server.sent[0][1]['items']) == 3
+    asyncio.run(emitter.flush())
+    assert len(server.sent) == 1
+
+
+def test_emitter_thread_drains_on_close():
+    sent = []
+    emitter = Emitter(None, tick=60)
+    emitter.start_thread(lambda event, data, **kwargs: sent.append((event, data, kwargs)))
+    emitter.put(*progress(0, 'completed')[:2], **ROOM)
+    emitter.close()
+    assert sent == [progress(0, 'completed')]
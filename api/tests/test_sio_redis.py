@@ -0,0 +1,121 @@
+import time
+import asyncio
+import pytest
+import redis
+import redis.asyncio
+import socketio
+from django.core.management import call_command
+from server import sio as sio_module
+from server.sio import Emitter, make_client_manager, enable_worker_mode
+
+fakeredis = pytest.importorskip('fakeredis')
+
+URL = 'redis://redis.invalid:6379/0'
+CHANNEL = 'socketio-tests'
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Every Redis client socketio opens talks to one in-process fakeredis server."""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.asyncio.Redis, 'from_url', classmethod(lambda cls, url, **kw: fakeredis.FakeAsyncRedis(server=server)))
+    monkeypatch.setattr(redis.Redis, 'from_url', classmethod(lambda cls, url, **kw: fakeredis.FakeRedis(server=server)))
+    return server
+
+
+async def start_server(received):
+    """A Socket.IO server on the 'redis' manager with one client in room order:1; received gets what it is sent."""
+    server = socketio.AsyncServer(async_mode='asgi', client_manager=make_client_manager('redis', URL, CHANNEL))
+
+    async def capture(eio_sid, eio_pkt):
+        received.append(server.packet_class(encoded_packet=eio_pkt.data).data)
+    server._send_eio_packet = capture
+    sid = await server.manager.connect('client', '/')
+    await server.enter_room(sid, 'order:1')
+    server.manager.initialize()
+    await asyncio.sleep(0.2)    # Listener subscribed
+    return server
+
+
+async def wait_for(received, event, timeout=3):
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if event in received: return True
+        await asyncio.sleep(0.02)
+    return False
+
+
+async def stop(server):
+    server.manager.thread.cancel()
+    await asyncio.sleep(0)
+
+
+def test_emit_on_one_server_reaches_a_client_of_another(fake_redis):
+    async def check():
+        received_a, received_b = [], []
+        server_a = await start_server(received_a)
+        server_b = await start_server(received_b)
+        event = ['bot_update', {'type': 'progress', 'order_id': 1, 'index': 0, 'status': 'completed'}]
+        await server_a.emit(*event, to='order:1')
+        await server_a.emit('bot_update', {'type': 'progress', 'order_id': 2}, to='order:2')
+        try:
+            assert await wait_for(received_b, event)
+            assert await wait_for(received_a, event)
+            # Only the room's clients get it
+            assert all(data[1]['order_id'] == 1 for data in received_a + received_b)
+        finally:
+            await stop(server_a)
+            await stop(server_b)
+    asyncio.run(check())
+
+
+def test_bot_worker_emit_reaches_the_web_server(fake_redis, settings, monkeypatch):
+    settings.SOCKETIO_CLIENT_MANAGER = 'redis'
+    settings.SOCKETIO_REDIS_URL = URL
+    settings.SOCKETIO_CHANNEL = CHANNEL
+    # A worker process of its own: fresh writer and emitter thread
+    monkeypatch.setattr(sio_module, '_external', None)
+    monkeypatch.setattr(sio_module, 'emitter', Emitter(sio_module.sio, tick=0.05))
+
+    async def check():
+        received = []
+        server = await start_server(received)
+        enable_worker_mode()
+        events = [
+            ['bot_update', {'type': 'progress', 'order_id': 1, 'index': index, 'status': 'completed'}]
+            for index in range(3)
+        ]
+
+        def bot_thread():
+            # What the bot calls while it downloads: a burst of progress events
+            for event, data in events: sio_module.emit(event, data, to='order:1')
+        await asyncio.to_thread(bot_thread)
+
+        def delivered():
+            # Coalesced into progress_batch events, however the emitter frames fell
+            items = []
+            for _, data in received:
+                items += data['items'] if data['type'] == 'progress_batch' else [data]
+            return sorted(item['index'] for item in items)
+        try:
+            t0 = time.time()
+            while delivered() != [0, 1, 2] and time.time() - t0 < 3:
+                await asyncio.sleep(0.02)
+            assert delivered() == [0, 1, 2]
+            assert any(data['type'] == 'progress_batch' for _, data in received)
+        finally:
+            sio_module.emitter.close()
+            await stop(server)
+    asyncio.run(check())
+
+
+def test_worker_mode_refuses_the_memory_manager(settings, monkeypatch):
+    settings.SOCKETIO_CLIENT_MANAGER = 'memory'
+    monkeypatch.setattr(sio_module, '_external', None)
+    with pytest.raises(RuntimeError):
+        enable_worker_mode()
+
+
+def test_check_socketio_command_passes_on_fakeredis(capsys):
+    call_command('check_socketio', '--manager', 'fakeredis', '--timeout', '3')
+    assert 'all checks passed' in capsys.readouterr().out
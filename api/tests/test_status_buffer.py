@@ -0,0 +1,76 @@
+import time
+import threading
+from api.status_buffer import StatusBuffer
+
+
+class Recorder:
+    """flush_fn that records every batch; fails the first `failures` calls."""
+
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.flushed = threading.Event()
+
+    def __call__(self, changes):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        self.batches.append(dict(changes))
+        self.flushed.set()
+
+
+def test_flushes_once_max_items_are_pending():
+    recorder = Recorder()
+    buffer = StatusBuffer(recorder, max_items=3, max_delay=60)
+    try:
+        buffer.add(0, 'completed')
+        buffer.add(1, 'failed')
+        assert recorder.batches == []
+        buffer.add(2, 'completed')
+        assert recorder.batches == [{0: 'completed', 1: 'failed', 2: 'completed'}]
+    finally:
+        buffer.close()
+
+
+def test_latest_status_of_an_item_wins():
+    recorder = Recorder()
+    buffer = StatusBuffer(recorder, max_items=10, max_delay=60)
+    buffer.add(4, 'processing')
+    buffer.add(4, 'completed')
+    buffer.close()
+    assert recorder.batches == [{4: 'completed'}]
+
+
+def test_flushes_after_max_delay_without_new_changes():
+    recorder = Recorder()
+    buffer = StatusBuffer(recorder, max_items=100, max_delay=0.1)
+    try:
+        buffer.add(0, 'completed')
+        assert recorder.flushed.wait(2)
+        assert recorder.batches == [{0: 'completed'}]
+    finally:
+        buffer.close()
+
+
+def test_failed_flush_keeps_the_changes_for_the_next_one():
+    recorder = Recorder(failures=1)
+    buffer = StatusBuffer(recorder, max_items=100, max_delay=60)
+    buffer.add(0, 'completed')
+    buffer.add(1, 'processing')
+    assert buffer.flush() == 0
+    # A newer status that arrived after the failed write is not overwritten by the old one
+    buffer.add(1, 'failed')
+    assert buffer.flush() == 2
+    assert recorder.batches == [{0: 'completed', 1: 'failed'}]
+    buffer.close()
+
+
+def test_close_writes_what_is_pending():
+    recorder = Recorder()
+    buffer = StatusBuffer(recorder, max_items=100, max_delay=60)
+    buffer.add(7, 'failed')
+    t0 = time.time()
+    buffer.close()
+    assert recorder.batches == [{7: 'failed'}]
+    assert time.time() - t0 < 2
+    assert buffer.flush() == 0
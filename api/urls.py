@@ -6,7 +6,7 @@ from rest_framework_simplejwt.views import (
 )
 from .views import (
     UserViewSet, ForwarderViewSet, DestinationViewSet, 
-    OrderImportViewSet, RegisterView, say_hello, dashboard_stats, MyTokenObtainPairView, SecretAdminRecoveryView
+    OrderImportViewSet, RegisterView, say_hello, dashboard_stats, bot_metrics, MyTokenObtainPairView, SecretAdminRecoveryView
 )
 
 router = DefaultRouter()
@@ -28,6 +28,9 @@ urlpatterns = [
     
     # Dashboard Stats Route
     path('dashboard/stats/', dashboard_stats, name='dashboard_stats'),
+
+    # Bot timings (Prometheus)
+    path('metrics/', bot_metrics, name='bot_metrics'),
     
     # Settings Route
     # path('system/settings/', SystemSettingView.as_view(), name='system_settings'),
@@ -17,15 +17,18 @@ from rest_framework.pagination import PageNumberPagination
 from django.conf import settings
 from rest_framework_simplejwt.views import TokenObtainPairView 
 
-from .models import User, Forwarder, Destination, OrderImport
+from django.db import transaction
+from django.db.models import Count, Q
+from .models import User, Forwarder, Destination, OrderImport, InvoiceItem, BotJob, StepTiming
+from .telemetry import histogram_lines, DURATION_BUCKETS
 from .serializers import (
     UserSerializer, RegisterSerializer, ForwarderSerializer, 
     DestinationSerializer, OrderImportSerializer, MyTokenObtainPairSerializer
 )
-from .bot import AutoDownloadBot
+from .cancellation import cancellation
+from .scheduler import enqueue, cancel_queued, inprocess_runner
 # --- SOCKET IO IMPORTS ---
-from asgiref.sync import async_to_sync
-from server.sio import sio 
+from server.sio import emit, order_room, order_rooms, topic_room
 # -------------------------
 class StandardPagination(PageNumberPagination):
     page_size = 10
@@ -100,15 +103,15 @@ class UserViewSet(viewsets.ModelViewSet):
     # --- Emit Events for Users ---
     def perform_create(self, serializer):
         serializer.save()
-        async_to_sync(sio.emit)('user_update', {'action': 'create'})
+        emit('user_update', {'action': 'create'}, to=topic_room('users'))
 
     def perform_update(self, serializer):
         serializer.save()
-        async_to_sync(sio.emit)('user_update', {'action': 'update'})
+        emit('user_update', {'action': 'update'}, to=topic_room('users'))
 
     def perform_destroy(self, instance):
         instance.delete()
-        async_to_sync(sio.emit)('user_update', {'action': 'delete'})
+        emit('user_update', {'action': 'delete'}, to=topic_room('users'))
 
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -127,15 +130,15 @@ class DestinationViewSet(viewsets.ModelViewSet):
     # --- Emit Events for Destinations ---
     def perform_create(self, serializer): 
         serializer.save(created_by=self.request.user)
-        async_to_sync(sio.emit)('destination_update', {'action': 'create'})
+        emit('destination_update', {'action': 'create'}, to=topic_room('destinations'))
 
     def perform_update(self, serializer):
         serializer.save()
-        async_to_sync(sio.emit)('destination_update', {'action': 'update'})
+        emit('destination_update', {'action': 'update'}, to=topic_room('destinations'))
 
     def perform_destroy(self, instance):
         instance.delete()
-        async_to_sync(sio.emit)('destination_update', {'action': 'delete'})
+        emit('destination_update', {'action': 'delete'}, to=topic_room('destinations'))
 
 class ForwarderViewSet(viewsets.ModelViewSet):
     queryset = Forwarder.objects.all().order_by('-created_at')
@@ -149,15 +152,15 @@ class ForwarderViewSet(viewsets.ModelViewSet):
     # --- Emit Events for Forwarders ---
     def perform_create(self, serializer): 
         serializer.save(created_by=self.request.user)
-        async_to_sync(sio.emit)('forwarder_update', {'action': 'create'})
+        emit('forwarder_update', {'action': 'create'}, to=topic_room('forwarders'))
 
     def perform_update(self, serializer):
         serializer.save()
-        async_to_sync(sio.emit)('forwarder_update', {'action': 'update'})
+        emit('forwarder_update', {'action': 'update'}, to=topic_room('forwarders'))
 
     def perform_destroy(self, instance):
         instance.delete()
-        async_to_sync(sio.emit)('forwarder_update', {'action': 'delete'})
+        emit('forwarder_update', {'action': 'delete'}, to=topic_room('forwarders'))
 
 
 class OrderImportViewSet(viewsets.ModelViewSet):
@@ -170,7 +173,7 @@ class OrderImportViewSet(viewsets.ModelViewSet):
     ordering_fields = ['id', 'uploaded_at', 'status', 'file']
 
     def get_queryset(self):
-        queryset = OrderImport.objects.all().order_by('-uploaded_at')
+        queryset = OrderImport.objects.all().prefetch_related('items').order_by('-uploaded_at')
         
         period = self.request.query_params.get('period')
         now = timezone.now()
@@ -203,7 +206,7 @@ class OrderImportViewSet(viewsets.ModelViewSet):
         # Save initial record (File uploads to Cloudinary automatically via settings.STORAGES)
         instance = serializer.save(uploaded_by=self.request.user)
         
-        async_to_sync(sio.emit)('order_update', {'action': 'create', 'id': instance.id, 'status': 'processing'})
+        emit('order_update', {'action': 'create', 'id': instance.id, 'status': 'processing'}, to=[topic_room('orders'), order_room(instance.id)])
 
         t = threading.Thread(target=self.process_file, args=(instance,))
         t.start()
@@ -219,8 +222,10 @@ class OrderImportViewSet(viewsets.ModelViewSet):
             try: shutil.rmtree(temp_dir)
             except: pass
         
+        # delete() clears instance.id
+        order_id = instance.id
         instance.delete()
-        async_to_sync(sio.emit)('order_update', {'action': 'delete', 'id': instance.id})
+        emit('order_update', {'action': 'delete', 'id': order_id}, to=[topic_room('orders'), order_room(order_id)])
 
     def process_file(self, instance):
         try:
@@ -240,7 +245,7 @@ class OrderImportViewSet(viewsets.ModelViewSet):
                 if header_row_index == -1:
                     instance.parsed_data = {"error": "Could not find 'INVOICE NUMBER' header."}
                     instance.save()
-                    async_to_sync(sio.emit)('order_update', {'action': 'error', 'id': instance.id, 'message': 'Header not found'})
+                    emit('order_update', {'action': 'error', 'id': instance.id, 'message': 'Header not found'}, to=[topic_room('orders'), order_room(instance.id)])
                     return
                 
                 # Reset pointer to read full file
@@ -248,66 +253,92 @@ class OrderImportViewSet(viewsets.ModelViewSet):
                 df = pd.read_excel(f, header=header_row_index)
 
             valid_rows = df[df['INVOICE NUMBER'].notna()]
-            extracted_data = []
+            items = []
             
-            for index, (_, row) in enumerate(valid_rows.iterrows()):
+            for _, row in valid_rows.iterrows():
                 def clean(val):
                     if pd.isna(val): return ""
                     if isinstance(val, datetime): return val.strftime('%Y-%m-%d')
                     return str(val).strip()
+
+                def number(val):
+                    if pd.isna(val): return 0
+                    try: return float(val)
+                    except (TypeError, ValueError): return 0
                 
                 inv_num = clean(row.get('INVOICE NUMBER'))
                 if '-' in inv_num: continue
 
-                item = {
-                    "no": clean(row.get('No.')),
-                    "customer": clean(row.get('customer')),
-                    "invoice_number": inv_num,
-                    "destination": clean(row.get('DESTINATION')),
-                    "forwarder": clean(row.get('FORWARDER')),
-                    "qty": row.get('QTY PCS', 0) if pd.notna(row.get('QTY PCS')) else 0,
-                    "amount": row.get('AMOUNT INV (USD)', 0) if pd.notna(row.get('AMOUNT INV (USD)')) else 0,
-                    "eta": clean(row.get('ETA')),
-                    "via": clean(row.get('VIA')),
-                    "status": "pending"
-                }
-                extracted_data.append(item)
-                
-                if index % 5 == 0:
-                    instance.parsed_data = extracted_data
-                    instance.save()
+                items.append(InvoiceItem(
+                    order=instance,
+                    row=len(items),
+                    no=clean(row.get('No.')),
+                    customer=clean(row.get('customer')),
+                    invoice_number=inv_num,
+                    destination=clean(row.get('DESTINATION')),
+                    forwarder=clean(row.get('FORWARDER')),
+                    qty=number(row.get('QTY PCS', 0)),
+                    amount=number(row.get('AMOUNT INV (USD)', 0)),
+                    eta=clean(row.get('ETA')),
+                    via=clean(row.get('VIA')),
+                    status="pending",
+                ))
             
-            instance.parsed_data = extracted_data
-            instance.save()
+            # One bulk insert instead of re-saving a growing JSON blob
+            with transaction.atomic():
+                InvoiceItem.objects.filter(order=instance).delete()
+                InvoiceItem.objects.bulk_create(items, batch_size=500)
+                # Repeated invoices (e.g. one row per container) are fetched once by the bot
+                InvoiceItem.link_duplicates(instance)
+                instance.parsed_data = None
+                instance.save(update_fields=['parsed_data'])
             
             # --- OPTIONAL: We DO NOT delete the input file here ---
             # With Cloudinary, it's better to keep the record of what was uploaded.
             # If you really want to delete it from Cloudinary to save space:
             # instance.file.delete(save=True) 
 
-            async_to_sync(sio.emit)('order_update', {'action': 'processed', 'id': instance.id})
+            emit('order_update', {'action': 'processed', 'id': instance.id}, to=[topic_room('orders'), order_room(instance.id)])
 
         except Exception as e:
             instance.parsed_data = {"error": str(e)}
             instance.save()
-            async_to_sync(sio.emit)('order_update', {'action': 'error', 'id': instance.id, 'message': str(e)})
+            emit('order_update', {'action': 'error', 'id': instance.id, 'message': str(e)}, to=[topic_room('orders'), order_room(instance.id)])
 
     @action(detail=True, methods=['post'])
     def run_bot(self, request, pk=None):
         order = self.get_object()
+        config = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
+        # Only admins may push a run ahead of the queue
+        priority = int(config.pop('priority', 0) or 0) if request.user.role == 'admin' else 0
+        job, created = enqueue(order, request.user, config, priority)
+        if not created:
+            return Response({'message': 'Bot is already queued or running.', 'job_id': job.id})
+
         order.bot_status = 'running'
-        order.save()
-        async_to_sync(sio.emit)('bot_update', {'type': 'status_change', 'order_id': order.id, 'status': 'running', 'message': 'Bot starting...'})
-        config = request.data
-        bot = AutoDownloadBot(order, config)
-        bot.run()
-        return Response({'message': 'Bot started.'})
+        order.bot_message = 'Waiting for a free bot worker...'
+        order.save(update_fields=['bot_status', 'bot_message'])
+        emit('bot_update', {'type': 'status_change', 'order_id': order.id, 'status': 'running', 'message': 'Bot queued...'}, to=order_rooms(order, status_change=True))
+        # Without worker processes (no Redis) the job runs on a thread of this process
+        if settings.BOT_RUN_MODE == 'inprocess': inprocess_runner.kick()
+        return Response({'message': 'Bot queued.', 'job_id': job.id})
 
     @action(detail=True, methods=['post'])
     def stop_bot(self, request, pk=None):
         order = self.get_object()
+        if cancel_queued(order):
+            # Never started: nothing to signal
+            order.bot_status = 'cancelled'
+            order.bot_message = 'Cancelled before start.'
+            order.save(update_fields=['bot_status', 'bot_message'])
+            emit('bot_update', {'type': 'status_change', 'order_id': order.id, 'status': 'cancelled', 'message': 'Cancelled before start.'}, to=order_rooms(order, status_change=True))
+            return Response({'message': 'Queued run cancelled.'})
+
         order.bot_status = 'stopping'
-        order.save()
+        order.save(update_fields=['bot_status'])
+        # Signal the running bot directly (in this process, or in the workers through Redis);
+        # the DB status stays as a safety net
+        cancellation.cancel(order.id)
         return Response({'message': 'Stop signal sent.'})
 
     @action(detail=True, methods=['get'], url_path='preview/(?P<invoice_number>[^/.]+)')
@@ -335,15 +366,14 @@ class OrderImportViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def report_stats(self, request):
         queryset = self.get_queryset()
-        total_files = 0
-        total_invoices = 0
-        total_downloaded = 0
-        for order in queryset:
-            total_files += 1
-            if order.parsed_data and isinstance(order.parsed_data, list):
-                total_invoices += len(order.parsed_data)
-                downloaded = sum(1 for item in order.parsed_data if item.get('status') == 'completed')
-                total_downloaded += downloaded
+        total_files = queryset.count()
+        # Counted in SQL on the (order, status) index instead of scanning every order's items
+        counts = InvoiceItem.objects.filter(order__in=queryset.values('id')).aggregate(
+            total=Count('id'),
+            downloaded=Count('id', filter=Q(status='completed')),
+        )
+        total_invoices = counts['total']
+        total_downloaded = counts['downloaded']
 
         return Response({
             'total_files': total_files,
@@ -370,6 +400,32 @@ def dashboard_stats(request):
         })
     except Exception as e: return Response({'error': str(e)}, status=500)
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def bot_metrics(request):
+    """
+    Prometheus text format. Step histograms are the cumulative counters the runs add
+    to when they finish (StepTiming); job counts cover the last BOT_METRICS_WINDOW_HOURS.
+    Logged-in users, or scrapers sending the X-Metrics-Token header.
+    """
+    token = getattr(settings, 'BOT_METRICS_TOKEN', '')
+    if not (request.user.is_authenticated or (token and request.headers.get('X-Metrics-Token') == token)):
+        return Response({'error': 'Not authorized.'}, status=401)
+
+    steps = {
+        row.step: (row.buckets, row.count, row.total_seconds)
+        for row in StepTiming.objects.all()
+        if len(row.buckets) == len(DURATION_BUCKETS)
+    }
+    lines = histogram_lines('bot_step_duration_seconds', 'step', steps)
+    since = timezone.now() - timedelta(hours=getattr(settings, 'BOT_METRICS_WINDOW_HOURS', 24))
+    lines.append("# TYPE bot_jobs gauge")
+    finished = BotJob.objects.filter(finished_at__gte=since).values('status').annotate(n=Count('id'))
+    active = BotJob.objects.filter(status__in=('queued', 'running')).values('status').annotate(n=Count('id'))
+    for row in list(finished) + list(active):
+        lines.append(f'bot_jobs{{status="{row["status"]}"}} {row["n"]}')
+    return HttpResponse("\n".join(lines) + "\n", content_type='text/plain; version=0.0.4')
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def say_hello(request): return Response({'message': f'Hello, {request.user.username}!'})
@@ -0,0 +1,126 @@
+import time
+import os
+import threading
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+# Per-step timeouts in seconds. A run can override any of them with config['wait_timeouts'].
+DEFAULT_TIMEOUTS = {
+    'overlay': 10,
+    'popup': 5,
+    'menu': 30,
+    'invoice_input': 30,
+    'change_button': 2,
+    'dialog': 30,
+    'dialog_ok': 2,
+    'download_button': 5,
+    'download_started': 30,
+    'success_popup': 3,
+}
+
+OVERLAY_SELECTOR = ".modalBackground, .sys-loading-overlay"
+
+
+class WaitStats:
+    """Thread-safe record of how long every wait step actually took."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._steps = {}
+
+    def record(self, step, elapsed, timed_out=False):
+        with self._lock:
+            entry = self._steps.setdefault(step, {'count': 0, 'total': 0.0, 'max': 0.0, 'timeouts': 0})
+            entry['count'] += 1
+            entry['total'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            if timed_out: entry['timeouts'] += 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                step: {
+                    'count': e['count'],
+                    'avg': round(e['total'] / e['count'], 3),
+                    'max': round(e['max'], 3),
+                    'total': round(e['total'], 3),
+                    'timeouts': e['timeouts'],
+                }
+                for step, e in self._steps.items()
+            }
+
+    def format_summary(self):
+        """One line per run for logs, slowest steps first."""
+        parts = []
+        for step, e in sorted(self.summary().items(), key=lambda kv: kv[1]['total'], reverse=True):
+            line = f"{step} avg {e['avg']}s max {e['max']}s x{e['count']}"
+            if e['timeouts']: line += f" ({e['timeouts']} timeouts)"
+            parts.append(line)
+        return " | ".join(parts)
+
+
+class WaitEngine:
+    """
+    Waits on concrete page conditions instead of fixed sleeps.
+    Every wait is timed into a WaitStats so the real latency of each step is visible.
+    """
+
+    def __init__(self, driver, stats=None, timeouts=None, poll=0.1):
+        self.driver = driver
+        self.stats = stats or WaitStats()
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.poll = poll
+        # Explicit waits only: an implicit wait would stretch every negative lookup
+        self.driver.implicitly_wait(0)
+
+    def until(self, step, condition, timeout=None, required=True):
+        """Waits for condition; returns its value, or None on timeout when the step is optional."""
+        timeout = timeout if timeout is not None else self.timeouts.get(step, 10)
+        start = time.time()
+        try:
+            result = WebDriverWait(self.driver, timeout, poll_frequency=self.poll).until(condition)
+            self.stats.record(step, time.time() - start)
+            return result
+        except TimeoutException:
+            self.stats.record(step, time.time() - start, timed_out=True)
+            if required: raise
+            return None
+
+    # --- Page conditions ---
+    def overlay_gone(self, step='overlay'):
+        """Waits until no loading overlay or modal background is displayed."""
+        def no_overlay(d):
+            try:
+                return not any(o.is_displayed() for o in d.find_elements(By.CSS_SELECTOR, OVERLAY_SELECTOR))
+            except StaleElementReferenceException:
+                return False
+        return self.until(step, no_overlay, required=False)
+
+    def clickable(self, step, xpath, timeout=None, required=True):
+        return self.until(step, EC.element_to_be_clickable((By.XPATH, xpath)), timeout, required)
+
+    def visible(self, step, xpath, timeout=None, required=True):
+        return self.until(step, EC.visibility_of_element_located((By.XPATH, xpath)), timeout, required)
+
+    def any_visible(self, step, xpaths, timeout=None, required=False):
+        """Waits until any of the xpaths shows a displayed element and returns it."""
+        def first_visible(d):
+            for xpath in xpaths:
+                try:
+                    for el in d.find_elements(By.XPATH, xpath):
+                        if el.is_displayed(): return el
+                except StaleElementReferenceException:
+                    continue
+            return False
+        return self.until(step, first_visible, timeout, required)
+
+    def download_started(self, download_dir, known_files, step='download_started', timeout=None):
+        """Waits until a new file (finished or .crdownload) shows up in download_dir."""
+        def new_file(_):
+            try:
+                return set(os.listdir(download_dir)) - known_files or False
+            except FileNotFoundError:
+                return False
+        return self.until(step, new_file, timeout, required=False)
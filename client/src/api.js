@@ -21,11 +21,36 @@ api.interceptors.request.use(
 // --- SOCKET.IO SETUP ---
 const socket = io(BASE_URL, {
   autoConnect: false,
+  // Read on every (re)connect, so a refreshed token is picked up. The server refuses sockets without one.
+  auth: (cb) => cb({ token: localStorage.getItem('access_token') }),
   // Allow both transports. Polling helps verify if the endpoint exists at all.
   transports: ['websocket', 'polling'], 
   reconnectionAttempts: 5,
   reconnectionDelay: 3000,
 });
 
-export { socket }; 
+// --- ROOMS ---
+// The server only sends events to the rooms a client joined: { order_id: 5 } or { topic: 'orders' }.
+// Counted per room, so two components can share one; joined again after every reconnect.
+const subscriptions = new Map();
+
+const subscribe = (room) => {
+  const key = JSON.stringify(room);
+  subscriptions.set(key, (subscriptions.get(key) || 0) + 1);
+  if (subscriptions.get(key) === 1 && socket.connected) socket.emit('subscribe', room);
+};
+
+const unsubscribe = (room) => {
+  const key = JSON.stringify(room);
+  const count = (subscriptions.get(key) || 0) - 1;
+  if (count > 0) return subscriptions.set(key, count);
+  subscriptions.delete(key);
+  if (socket.connected) socket.emit('unsubscribe', room);
+};
+
+socket.on('connect', () => {
+  subscriptions.forEach((_, key) => socket.emit('subscribe', JSON.parse(key)));
+});
+
+export { socket, subscribe, unsubscribe }; 
 export default api;
\ No newline at end of file
@@ -9,9 +9,30 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 import socketio
+from asgiref.sync import sync_to_async
 from django.core.asgi import get_asgi_application
-from .sio import sio
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 django_asgi_app = get_asgi_application()
+# After Django is set up: the Socket.IO client manager is chosen in settings
+from django.conf import settings
+from .sio import sio, emitter
+
+
+async def on_startup():
+    # The emitter drains events queued by views and bot threads on this event loop
+    await emitter.start()
+    if settings.BOT_RUN_MODE == 'inprocess':
+        # No worker processes: this server runs the queued jobs, including those left by a restart
+        from api.scheduler import inprocess_runner, recover_interrupted_runs, prewarm_spare_browser
+        try:
+            await sync_to_async(recover_interrupted_runs)()
+        except Exception as e:
+            print(f"[recovery] Startup recovery failed: {e}")
+        # Chrome starts in the background; the first job no longer pays the cold launch
+        await sync_to_async(prewarm_spare_browser)()
+        # Runs whose lease is still live are claimed once it expires (the runner re-kicks itself)
+        inprocess_runner.kick()
+
+
 # application = get_asgi_application()
-application = socketio.ASGIApp(sio, django_asgi_app)
\ No newline at end of file
+application = socketio.ASGIApp(sio, django_asgi_app, on_startup=on_startup, on_shutdown=emitter.stop)
\ No newline at end of file
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 from datetime import timedelta
+from botocore.config import Config
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -23,6 +24,13 @@ AWS_S3_REGION_NAME = 'sgp1'
 AWS_S3_ENDPOINT_URL = f'https://{AWS_S3_REGION_NAME}.digitaloceanspaces.com'
 AWS_S3_OBJECT_PARAMETERS = {'CacheControl': 'max-age=86400'}
 AWS_S3_SIGNATURE_VERSION = 's3v4'
+# Per-request timeouts: a stalled upload fails (and the bot delivery retries it) instead of hanging
+AWS_S3_CLIENT_CONFIG = Config(
+    signature_version=AWS_S3_SIGNATURE_VERSION,
+    connect_timeout=10,
+    read_timeout=60,
+    retries={'max_attempts': 3, 'mode': 'standard'},
+)
 AWS_DEFAULT_ACL = 'public-read' # Files are public (good for download links)
 
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -172,4 +180,54 @@ STORAGES = {
     "staticfiles": {
         "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
     },
-}
\ No newline at end of file
+}
+
+# --- BOT SETTINGS ---
+# Optional Redis used to reach bots running in other processes (e.g. "redis://localhost:6379/0")
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+# Socket.IO client manager (see server/sio.py): 'memory' for a single ASGI process, 'redis' to run
+# several uvicorn workers or nodes (and to reach clients from the bot worker processes)
+SOCKETIO_CLIENT_MANAGER = os.environ.get('SOCKETIO_CLIENT_MANAGER', 'redis' if REDIS_URL else 'memory')
+SOCKETIO_REDIS_URL = os.environ.get('SOCKETIO_REDIS_URL', REDIS_URL or 'redis://localhost:6379/0')
+SOCKETIO_CHANNEL = 'socketio'
+
+BOT_STOP_DB_CHECK_INTERVAL = 15         # Seconds between DB stop checks (safety net only)
+
+# Warm browser sessions kept between bot runs (see api/browser.py)
+BOT_SESSION_IDLE_TIMEOUT = 600          # Close a pooled browser after 10 minutes unused
+BOT_SESSION_MAX_AGE = 4 * 60 * 60       # Force a fresh login after 4 hours
+BOT_SESSION_POOL_SIZE = 4               # Max idle browsers kept per process
+BOT_SESSION_MAX_RSS_MB = 1024           # A browser using more (all its Chrome processes) is closed, not pooled; 0 = no limit
+BOT_BROWSER_PROFILE = 'standard'        # 'lean' = headless, no images/fonts, JS heap cap (see api/browser.py)
+BOT_PREWARM_BROWSER = True              # Keep a spare browser started for the next run
+BOT_DRIVER_PIN_FILE = os.path.join(MEDIA_ROOT, 'drivers', 'chromedriver.json')  # Resolved chromedriver
+
+# Invoice files shared across orders: a re-uploaded invoice is copied from here instead of the ERP
+BOT_INVOICE_CACHE_DIR = os.path.join(MEDIA_ROOT, 'invoice_cache')
+BOT_INVOICE_CACHE_MAX_MB = 2048         # Least recently used files are evicted above this size
+BOT_INVOICE_CACHE_MAX_AGE_DAYS = 30     # Older files are downloaded again
+
+# Where queued bot jobs run:
+#   'workers'   `python manage.py run_bot_workers` processes next to the web server. Needs Redis
+#               (REDIS_URL and SOCKETIO_CLIENT_MANAGER='redis'): their progress events and the
+#               stop requests travel through it.
+#   'inprocess' threads of the web process itself (single server without Redis).
+BOT_RUN_MODE = os.environ.get('BOT_RUN_MODE', 'workers' if REDIS_URL else 'inprocess')
+# Bot job queue
+BOT_MAX_CONCURRENCY = int(os.environ.get('BOT_MAX_CONCURRENCY', 2))   # Bots running at once on this node
+BOT_WORKER_MAX_JOBS = 20                # Recycle a worker process after N jobs
+BOT_WORKER_MAX_RSS_MB = 1500            # ...or when it (with its Chrome) uses more memory
+BOT_QUEUE_POLL_INTERVAL = 2             # Seconds between queue checks of an idle worker
+
+# Several nodes may run `run_bot_workers` against the same database
+BOT_NODE_NAME = os.environ.get('BOT_NODE_NAME', '')  # Defaults to the hostname
+BOT_LEASE_SECONDS = 60                  # A job whose worker stops renewing for this long is taken over
+BOT_HEARTBEAT_INTERVAL = 15             # Seconds between lease renewals
+BOT_JOB_MAX_ATTEMPTS = 3                # Give up on a job that lost its worker this many times
+# Key encrypting the credentials of queued jobs (BotJob.secrets); defaults to one derived from SECRET_KEY
+BOT_SECRETS_KEY = os.environ.get('BOT_SECRETS_KEY', '')
+
+# /api/metrics/ (Prometheus): cumulative step timing histograms (StepTiming) and job counts
+BOT_METRICS_WINDOW_HOURS = 24         # Window of the finished-job counts
+BOT_METRICS_TOKEN = os.environ.get('BOT_METRICS_TOKEN', '')   # Sent by scrapers as X-Metrics-Token
@@ -1,5 +1,285 @@
+import os
+import asyncio
+import threading
 import socketio
+from asgiref.sync import async_to_sync
+from django.conf import settings
+
+# Seconds between two frames of queued events
+EMIT_TICK = float(os.environ.get('SIO_EMIT_TICK', 0.25))
+
+CLIENT_MANAGERS = ('memory', 'redis', 'fakeredis')
+_fake_server = None
+
+
+def _fake_redis_server():
+    """One fakeredis server per process, shared by every fake manager (optional dependency)."""
+    global _fake_server
+    if _fake_server is None:
+        import fakeredis
+        _fake_server = fakeredis.FakeServer()
+    return _fake_server
+
+
+class FakeRedisManager(socketio.AsyncRedisManager):
+    """Redis pub/sub manager on an in-process fakeredis server, for checks without a Redis."""
+
+    def _redis_connect(self):
+        import fakeredis
+        self.redis = fakeredis.FakeAsyncRedis(server=_fake_redis_server())
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.connected = True
+
+
+class FakeRedisWriter(socketio.RedisManager):
+    """Write-only counterpart of FakeRedisManager (what bot worker processes use)."""
+
+    def _redis_connect(self):
+        import fakeredis
+        self.redis = fakeredis.FakeRedis(server=_fake_redis_server())
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.connected = True
+
+
+def make_client_manager(kind=None, url=None, channel=None):
+    """
+    Client manager of the Socket.IO server:
+    'memory'    clients and rooms live in this process only (a single ASGI worker).
+    'redis'     every emit goes through Redis pub/sub, so any uvicorn worker or node, and
+                the bot worker processes, reach the clients connected to any other one.
+    'fakeredis' same as 'redis' on an in-process fake server (manage.py check_socketio).
+    """
+    kind = kind or settings.SOCKETIO_CLIENT_MANAGER
+    url = url or settings.SOCKETIO_REDIS_URL
+    channel = channel or settings.SOCKETIO_CHANNEL
+    if kind == 'memory': return None
+    if kind == 'redis': return socketio.AsyncRedisManager(url, channel=channel)
+    if kind == 'fakeredis': return FakeRedisManager('redis://fakeredis', channel=channel)
+    raise ValueError(f"Unknown SOCKETIO_CLIENT_MANAGER '{kind}' (expected one of {', '.join(CLIENT_MANAGERS)})")
+
+
+def make_external_manager(kind=None, url=None, channel=None):
+    """Write-only manager for processes without clients (bot workers). None with 'memory'."""
+    kind = kind or settings.SOCKETIO_CLIENT_MANAGER
+    url = url or settings.SOCKETIO_REDIS_URL
+    channel = channel or settings.SOCKETIO_CHANNEL
+    if kind == 'redis': return socketio.RedisManager(url, channel=channel, write_only=True)
+    if kind == 'fakeredis': return FakeRedisWriter('redis://fakeredis', channel=channel, write_only=True)
+    return None
+
 
 # Create a standard Async Socket.IO server
 # cors_allowed_origins='*' allows your Vue app to connect from any port
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
\ No newline at end of file
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', client_manager=make_client_manager())
+
+_external = None
+
+
+def coalesce(events):
+    """
+    Merges the bot 'progress' events of each order queued since the last frame into one
+    'progress_batch' event holding only the latest status of every item. Any other event
+    keeps its place; progress queued after it starts a new batch, so the order is preserved.
+    events: [(event, data, kwargs)]
+    """
+    frames = []
+    batches = {}
+    for event, data, kwargs in events:
+        target = repr(sorted(kwargs.items()))
+        order_id = data.get('order_id') if isinstance(data, dict) else None
+        if order_id is not None and event == 'bot_update' and data.get('type') == 'progress':
+            key = (order_id, target)
+            if key not in batches:
+                batches[key] = {}
+                frames.append((event, batches[key], kwargs, order_id))
+            # Intermediate states of an item (processing -> completed) collapse to the last one
+            batches[key].pop(data.get('index'), None)
+            batches[key][data.get('index')] = data
+            continue
+        if order_id is not None:
+            for key in [k for k in batches if k[0] == order_id]: del batches[key]
+        frames.append((event, data, kwargs, None))
+
+    result = []
+    for event, data, kwargs, order_id in frames:
+        if order_id is None:
+            result.append((event, data, kwargs))
+        elif len(data) == 1:
+            result.append((event, next(iter(data.values())), kwargs))
+        else:
+            result.append((event, {'type': 'progress_batch', 'order_id': order_id, 'items': list(data.values())}, kwargs))
+    return result
+
+
+class Emitter:
+    """
+    Emits for synchronous code (views, bot threads) without blocking it: events go into
+    a queue that is drained every `tick` seconds, either by a task on the ASGI event loop
+    (web process) or by a thread writing to Redis (bot worker processes).
+    """
+
+    def __init__(self, server, tick=EMIT_TICK):
+        self.server = server
+        self.tick = tick
+        self._queue = []
+        self._lock = threading.Lock()
+        self._task = None
+        self._thread = None
+        self._send = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self):
+        return (self._task is not None and not self._task.done()) or self._thread is not None
+
+    def put(self, event, data, **kwargs):
+        with self._lock:
+            self._queue.append((event, data, kwargs))
+
+    def _take(self):
+        with self._lock:
+            events, self._queue = self._queue, []
+        return coalesce(events) if events else []
+
+    # --- Web process: drained on the ASGI loop ---
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._drain_loop())
+
+    async def _drain_loop(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            await self.flush()
+
+    async def flush(self):
+        for event, data, kwargs in self._take():
+            try:
+                await self.server.emit(event, data, **kwargs)
+            except Exception as e:
+                print(f"Socket Emit Error: {e}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    # --- Bot worker process: drained by a thread ---
+    def start_thread(self, send):
+        if self._thread: return
+        self._send = send
+        self._thread = threading.Thread(target=self._drain_thread, name='sio-emitter', daemon=True)
+        self._thread.start()
+
+    def _drain_thread(self):
+        while not self._stopped.wait(self.tick):
+            self.flush_sync()
+
+    def flush_sync(self):
+        for event, data, kwargs in self._take():
+            try:
+                self._send(event, data, **kwargs)
+            except Exception as e:
+                print(f"Socket Emit Error: {e}")
+
+    def close(self):
+        """Sends what is still queued (the process is about to exit)."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=self.tick + 1)
+            self._thread = None
+            self.flush_sync()
+
+
+emitter = Emitter(sio)
+
+
+# --- Rooms ---
+# Clients only receive what they subscribed to: 'order:<id>' (progress of one order),
+# 'user:<id>' (joined on connect: status of the user's own orders) and 'topic:<name>' (list pages).
+TOPICS = ('orders', 'users', 'forwarders', 'destinations')
+
+
+def order_room(order_id):
+    return f"order:{order_id}"
+
+
+def user_room(user_id):
+    return f"user:{user_id}"
+
+
+def topic_room(name):
+    return f"topic:{name}"
+
+
+def order_rooms(order, status_change=False):
+    """Rooms of a bot_update: watchers of the order; status changes also reach the order list and the owner."""
+    rooms = [order_room(order.id)]
+    if status_change:
+        rooms.append(topic_room('orders'))
+        if order.uploaded_by_id: rooms.append(user_room(order.uploaded_by_id))
+    return rooms
+
+
+def _requested_rooms(data):
+    """{'order_id': 5} / {'order_id': [5, 6]} / {'topic': 'orders'} -> room names."""
+    if not isinstance(data, dict): return []
+    rooms = []
+    order_ids = data.get('order_id')
+    for order_id in (order_ids if isinstance(order_ids, list) else [order_ids]):
+        try:
+            rooms.append(order_room(int(order_id)))
+        except (TypeError, ValueError):
+            pass
+    if data.get('topic') in TOPICS: rooms.append(topic_room(data['topic']))
+    return rooms
+
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    """Only clients sending a valid access token in the handshake ({ token }) may connect."""
+    from rest_framework_simplejwt.tokens import AccessToken
+    from rest_framework_simplejwt.exceptions import TokenError
+    try:
+        token = AccessToken((auth or {}).get('token') or '')
+    except TokenError:
+        raise socketio.exceptions.ConnectionRefusedError('authentication failed')
+    await sio.enter_room(sid, user_room(token.get('user_id')))
+    # Servers without ASGI lifespan events start the emitter on the first client
+    await emitter.start()
+
+
+@sio.event
+async def subscribe(sid, data):
+    rooms = _requested_rooms(data)
+    for room in rooms: await sio.enter_room(sid, room)
+    return {'rooms': rooms}
+
+
+@sio.event
+async def unsubscribe(sid, data):
+    rooms = _requested_rooms(data)
+    for room in rooms: await sio.leave_room(sid, room)
+    return {'rooms': rooms}
+
+
+def enable_worker_mode():
+    """Called in bot worker processes: they have no clients, so their events go out through Redis."""
+    global _external
+    if _external is None:
+        _external = make_external_manager()
+        if _external is None:
+            # An in-memory manager here would drop every event of the bots
+            raise RuntimeError("Bot worker processes need SOCKETIO_CLIENT_MANAGER='redis' to reach the clients")
+        emitter.start_thread(_external.emit)
+
+
+def emit(event, data, **kwargs):
+    """Emits from synchronous code, in the web process or in a bot worker process. Never blocks on the socket."""
+    if emitter.running:
+        emitter.put(event, data, **kwargs)
+    elif _external is not None:
+        _external.emit(event, data, **kwargs)
+    else:
+        # No event loop serving clients in this process (e.g. a management command)
+        async_to_sync(sio.emit)(event, data, **kwargs)
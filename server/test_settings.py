@@ -0,0 +1,30 @@
+# Settings for `python -m pytest` (see pytest.ini): local SQLite, local files, no Redis
+import tempfile
+from .settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'autosave_test.sqlite3'),
+    }
+}
+# Tables straight from the models: migration 0007 switches the ids to MongoDB ObjectIds
+MIGRATION_MODULES = {'api': None}
+
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+MEDIA_ROOT = tempfile.mkdtemp(prefix='autosave_media_')
+
+# --- BOT SETTINGS ---
+REDIS_URL = ''
+SOCKETIO_CLIENT_MANAGER = 'memory'
+BOT_RUN_MODE = 'inprocess'
+BOT_PREWARM_BROWSER = False
+BOT_DRIVER_PIN_FILE = os.path.join(MEDIA_ROOT, 'drivers', 'chromedriver.json')
+BOT_INVOICE_CACHE_DIR = os.path.join(MEDIA_ROOT, 'invoice_cache')